@@ -38,13 +38,47 @@ def create_app():
     migrate.init_app(app, db)
     login_manager.init_app(app)
     use_eventlet = os.environ.get("USE_EVENTLET", "1") == "1"
-    socketio.init_app(app, async_mode=("eventlet" if use_eventlet else "threading"))
+    # หลาย worker: emit วิ่งผ่าน message queue (ดู app/services/socket_fanout.py)
+    from .services import socket_fanout
+    socketio.init_app(
+        app,
+        async_mode=("eventlet" if use_eventlet else "threading"),
+        client_manager=socket_fanout.client_manager(app),
+    )
     print("USE_EVENTLET =", os.getenv("USE_EVENTLET"))
     print("Socket.IO async_mode =", socketio.async_mode)
 
     # ให้ Alembic เห็น models
     from . import models
 
+    # sync ตาราง conversation ทุกครั้งที่ flush LineMessage / LineUser
+    from .services import conversations
+    conversations.init_app(app)
+
+    # ล้าง summary cache ของ conversation ที่ถูกแก้ หลัง commit/rollback
+    from .services import summary_cache
+    summary_cache.init_app(app)
+
+    # header นับจำนวน query ต่อ request (เปิดเฉพาะตอน load test)
+    from .services import query_counter
+    query_counter.init_app(app)
+
+    # worker ของคิว webhook_inbox (สตาร์ทตอน request แรก)
+    from .services import webhook_ingest
+    webhook_ingest.init_app(app)
+
+    # worker ส่งข้อความขาออก (สตาร์ทและกู้ข้อความค้างตอน request แรก)
+    from .services import outbound
+    outbound.init_app(app)
+
+    # worker ดึงไฟล์สื่อขาเข้า (สตาร์ทและกู้งานค้างตอน request แรก)
+    from .services import media_pipeline
+    media_pipeline.init_app(app)
+
+    # dispatcher ข้อความตั้งเวลา (สตาร์ทตอน request แรก)
+    from .services import scheduler
+    scheduler.init_app(app)
+
     # import และ register blueprints (import ข้างในกันวงกลม)
     from .blueprints.auth.routes import bp as auth_bp
     from .blueprints.admin.routes import bp as admin_bp
@@ -58,6 +92,7 @@ def create_app():
     from .blueprints.tags import bp as tags_bp
     from .blueprints.search import bp as search_bp
     from .blueprints.stats import bp as stats_bp
+    from .blueprints.broadcasts import bp as broadcasts_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp)
@@ -71,6 +106,7 @@ def create_app():
     app.register_blueprint(tags_bp)
     app.register_blueprint(search_bp)
     app.register_blueprint(stats_bp)
+    app.register_blueprint(broadcasts_bp)
 
     @app.get("/_env_check")
     def _env_check():
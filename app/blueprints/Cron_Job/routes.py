@@ -3,13 +3,14 @@ import os
 from flask import Blueprint, request, jsonify
 from app.models import LineAccount
 from app.services.oa_checker import run_full_health_check  # ← ฟังก์ชัน SYNC
+from app.services import broadcasts, conversations, profile_enricher
 from app.extensions import db
 # (ถ้ามีระบบ logging อยู่แล้ว แนะนำใช้ logger แทน print)
 
 cron_bp = Blueprint("cron", __name__, url_prefix="/api/cron")
 
-@cron_bp.route("/check-all-oa-status", methods=["POST"])
-def trigger_oa_health_check():
+def _check_cron_auth():
+    """คืน response error ถ้า Authorization ไม่ตรงกับ CRON_SECRET, คืน None ถ้าผ่าน"""
     cron_secret = os.environ.get("CRON_SECRET")
     auth_header = request.headers.get("Authorization", "")
 
@@ -19,6 +20,14 @@ def trigger_oa_health_check():
 
     if auth_header != f"Bearer {cron_secret}":
         return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@cron_bp.route("/check-all-oa-status", methods=["POST"])
+def trigger_oa_health_check():
+    auth_error = _check_cron_auth()
+    if auth_error:
+        return auth_error
 
     try:
         accounts = LineAccount.query.all()
@@ -53,3 +62,50 @@ def trigger_oa_health_check():
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "InternalError", "details": str(e)}), 500
+
+
+@cron_bp.route("/refresh-profiles", methods=["POST"])
+def trigger_profile_refresh():
+    """ส่งโปรไฟล์ที่เก่าเกินกำหนดเข้าคิวให้ worker ดึงใหม่ (display_name / picture_url)"""
+    auth_error = _check_cron_auth()
+    if auth_error:
+        return auth_error
+
+    limit = request.args.get("limit", default=500, type=int)
+    try:
+        queued = profile_enricher.refresh_stale_profiles(limit=max(1, min(limit, 5000)))
+        return jsonify({"message": "OK", "queued": queued}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "InternalError", "details": str(e)}), 500
+
+
+@cron_bp.route("/reconcile-unread", methods=["POST"])
+def trigger_unread_reconcile():
+    """ซ่อมตัวนับ unread ที่คลาดเคลื่อน (เทียบกับจำนวนข้อความจริงหลัง last_read_timestamp)"""
+    auth_error = _check_cron_auth()
+    if auth_error:
+        return auth_error
+
+    batch_size = request.args.get("batch_size", default=500, type=int)
+    try:
+        result = conversations.reconcile_unread_counts(batch_size=max(1, min(batch_size, 5000)))
+        return jsonify({"message": "OK", **result}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "InternalError", "details": str(e)}), 500
+
+
+@cron_bp.route("/resume-broadcasts", methods=["POST"])
+def trigger_broadcast_resume():
+    """resume broadcast ที่ค้าง (worker ตาย/รีสตาร์ทระหว่างส่ง) ต่อจาก batch ล่าสุดที่ส่งสำเร็จ"""
+    auth_error = _check_cron_auth()
+    if auth_error:
+        return auth_error
+
+    try:
+        resumed = broadcasts.resume_stalled()
+        return jsonify({"message": "OK", "resumed": resumed}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "InternalError", "details": str(e)}), 500
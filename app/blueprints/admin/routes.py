@@ -9,6 +9,7 @@ from datetime import timedelta
 from app import socketio, create_app
 from flask_socketio import join_room
 from app.services.oa_checker import run_full_health_check
+from app.services import circuit_breaker, metrics, rate_limit
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -128,7 +129,9 @@ def debug_db_connection():
 @login_required
 def oa_health_check_page():
     accounts = LineAccount.query.order_by(LineAccount.is_active.asc(), LineAccount.id.asc()).all()
-    return render_template('admin/oa_health_check.html', accounts=accounts, timedelta=timedelta)
+    return render_template(
+        'admin/oa_health_check.html', accounts=accounts, timedelta=timedelta, breakers=circuit_breaker.snapshot()
+    )
 
 # --- เราจะกลับมาใช้ API Endpoint แบบเดิม ---
 @bp.route('/api/run-oa-check', methods=['POST'])
@@ -143,3 +146,27 @@ def run_oa_check_api():
     except Exception as e:
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route('/api/metrics')
+@login_required
+@admin_required
+def metrics_api():
+    """ตัวนับภายใน worker process นี้ (เช่น webhook ซ้ำ / redelivery)"""
+    return jsonify(metrics.snapshot()), 200
+
+
+@bp.route('/api/rate-limits')
+@login_required
+@admin_required
+def rate_limits_api():
+    """budget คงเหลือ + จำนวนครั้งที่ต้องรอ/ถูกเลื่อน/โดน 429 ต่อ OA ต่อกลุ่ม endpoint (ของ worker process นี้)"""
+    return jsonify(rate_limit.snapshot()), 200
+
+
+@bp.route('/api/circuit-breakers')
+@login_required
+@admin_required
+def circuit_breakers_api():
+    """สถานะ circuit breaker ต่อ OA (ของ worker process นี้)"""
+    return jsonify(circuit_breaker.snapshot()), 200
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('broadcasts', __name__, url_prefix='/broadcasts')
+
+from . import routes
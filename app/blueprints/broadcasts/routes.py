@@ -0,0 +1,79 @@
+# app/blueprints/broadcasts/routes.py - API สร้าง/ติดตาม/หยุด broadcast ไปยัง segment จากหน้าค้นหา (สั่งส่ง/หยุดได้เฉพาะแอดมิน)
+from functools import wraps
+
+from flask import jsonify, request
+from flask_login import current_user, login_required
+
+from . import bp
+from app.extensions import db
+from app.models import Broadcast
+from app.services import broadcasts, scheduler, segments
+from app.services.authz import is_admin
+
+
+def _admin_api(func):
+    """เหมือน admin_required แต่ตอบ JSON 403 (เรียกจาก fetch ไม่ใช่หน้าเว็บ)"""
+
+    @wraps(func)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if not is_admin():
+            return jsonify({"status": "error", "message": "Admin permission required"}), 403
+        return func(*args, **kwargs)
+
+    return wrapped
+
+
+@bp.post("/api")
+@_admin_api
+def create_broadcast():
+    """
+    สร้าง broadcast จากเงื่อนไขเดียวกับ /api/search/users + ข้อความ แล้วให้ worker ส่งเบื้องหลัง
+    ถ้ามี send_at จะตั้งเวลาไว้แทน (segment ถูก resolve ตอนถึงเวลา)
+    """
+    data = request.get_json() or {}
+    try:
+        filters = segments.parse_filters(data.get("filters") or {})
+        if data.get("send_at"):
+            due_at = scheduler.parse_due_at(data["send_at"])
+            schedule = scheduler.schedule_broadcast(filters, data.get("message") or {}, due_at, admin_user_id=current_user.id)
+            db.session.commit()
+            scheduler.submit(schedule)
+            return jsonify({"scheduled": scheduler.serialize(schedule)}), 202
+        broadcast = broadcasts.create(filters, data.get("message") or {}, admin_user_id=current_user.id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(broadcasts.progress(broadcast)), 202
+
+
+@bp.get("/api")
+@login_required
+def list_broadcasts():
+    limit = max(1, min(request.args.get("limit", default=20, type=int), 100))
+    rows = Broadcast.query.order_by(Broadcast.id.desc()).limit(limit).all()
+    return jsonify([broadcasts.progress(row) for row in rows])
+
+
+@bp.get("/api/<int:broadcast_id>")
+@login_required
+def broadcast_status(broadcast_id):
+    return jsonify(broadcasts.progress(Broadcast.query.get_or_404(broadcast_id)))
+
+
+@bp.post("/api/<int:broadcast_id>/cancel")
+@_admin_api
+def cancel_broadcast(broadcast_id):
+    Broadcast.query.get_or_404(broadcast_id)
+    if not broadcasts.cancel(broadcast_id):
+        return jsonify({"status": "error", "message": "Broadcast already finished"}), 409
+    return jsonify(broadcasts.progress(db.session.get(Broadcast, broadcast_id)))
+
+
+@bp.post("/api/<int:broadcast_id>/resume")
+@_admin_api
+def resume_broadcast(broadcast_id):
+    """ส่งต่อจาก batch ที่ค้าง (เช่น worker ตาย) ถ้ามี worker ถือ lease อยู่จะไม่มีผล"""
+    broadcast = Broadcast.query.get_or_404(broadcast_id)
+    broadcasts.start(broadcast.id)
+    return jsonify(broadcasts.progress(broadcast)), 202
@@ -1,6 +1,7 @@
 import os
 import uuid
 import json
+import base64
 from werkzeug.utils import secure_filename
 from flask import current_app, url_for , Response 
 from flask import Blueprint, render_template, request , session , abort 
@@ -10,18 +11,16 @@ from datetime import datetime, timedelta , timezone
 from . import bp   # ใช้ bp ที่ import มาจาก __init__.py
 from flask import jsonify
 from app.models import  db 
-from sqlalchemy import func, case
-from sqlalchemy.orm import joinedload
-from linebot import LineBotApi
-from linebot.models import TextSendMessage , ImageSendMessage , StickerSendMessage
-from linebot.exceptions import LineBotApiError
-from sqlalchemy import or_
-from app.models import User, LineUser, LineAccount, LineMessage, QuickReply, OAGroup, Sticker
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy import and_, or_, tuple_
+from app.models import User, LineUser, LineAccount, LineMessage, QuickReply, OAGroup, Sticker, Tag, tags_users
+from app.models import Conversation, ScheduledMessage, oa_group_association
 import traceback
 from flask_socketio import join_room, leave_room
 from app.extensions import socketio
 from app.blueprints.chats import bp
-from app.services import s3_client
+from app.services import s3_client, line_registry, oa_rooms, outbound, room_events, scheduler, summary_cache
+from app.services.authz import is_admin
 
 # ---- Helper Functions ----
 
@@ -33,7 +32,7 @@ def format_message_for_api(message):
 
     if message.message_type == "text":
         content = message.message_text
-    elif message.message_type == "image":
+    elif message.message_type in ("image", "video", "audio", "file"):
         content = message.message_url
     elif message.message_type == "sticker":
         content = f"https://stickershop.line-scdn.net/stickershop/v1/sticker/{message.sticker_id}/ANDROID/sticker.png"
@@ -54,8 +53,14 @@ def format_message_for_api(message):
         'is_close_event': is_close_event,
         'line_sent_successfully': message.line_sent_successfully,
         'line_error_message': message.line_error_message,
+        'send_status': message.send_status,
         'user_id': message.user_id,
-        'oa_id': message.line_account_id
+        'oa_id': message.line_account_id,
+        'media_status': message.media_status,
+        'media_content_type': message.media_content_type,
+        'media_size': message.media_size,
+        'media_duration_ms': message.media_duration_ms,
+        'file_name': message.file_name,
     }
 
     if message.is_outgoing and message.admin:
@@ -102,30 +107,36 @@ def truncate_text(text, length=10):
         return text[:length] + '...'
     return text
 
-def _generate_conversation_data(user_id, oa_id):
-    """
-    [โรงงานผลิตข้อมูล] Helper function ที่ทำหน้าที่ดึงข้อมูลล่าสุดของ 1 conversation เสมอ
-    """
-    line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first()
-    if not line_user:
-        return None
+def _load_tags_map(user_db_ids):
+    """โหลด tags ของหลาย LineUser ใน query เดียว คืน {line_user.id: [{'name', 'color'}]}"""
+    tags_map = {uid: [] for uid in user_db_ids}
+    if not user_db_ids:
+        return tags_map
+    rows = (
+        db.session.query(tags_users.c.line_user_id, Tag.name, Tag.color)
+        .join(Tag, Tag.id == tags_users.c.tag_id)
+        .filter(tags_users.c.line_user_id.in_(list(user_db_ids)))
+        .order_by(Tag.id)
+        .all()
+    )
+    for line_user_id, name, color in rows:
+        tags_map[line_user_id].append({'name': name, 'color': color})
+    return tags_map
 
-    latest_message = LineMessage.query.filter_by(user_id=user_id, line_account_id=oa_id).order_by(LineMessage.timestamp.desc()).first()
-    unread_count = 0
-    if line_user.last_read_timestamp:
-        unread_count = db.session.query(func.count(LineMessage.id)).filter(
-            LineMessage.user_id == user_id,
-            LineMessage.line_account_id == oa_id,
-            LineMessage.is_outgoing == False,
-            LineMessage.timestamp > line_user.last_read_timestamp
-        ).scalar() or 0
-    else:
-        unread_count = db.session.query(func.count(LineMessage.id)).filter(
-            LineMessage.user_id == user_id,
-            LineMessage.line_account_id == oa_id,
-            LineMessage.is_outgoing == False
-        ).scalar() or 0
-        
+
+def _load_read_by_map(admin_ids):
+    """โหลดชื่อแอดมิน (ส่วนหน้า @) ของหลายคนใน query เดียว คืน {admin_id: name}"""
+    admin_ids = {aid for aid in admin_ids if aid}
+    if not admin_ids:
+        return {}
+    return {
+        admin_id: email.split('@')[0]
+        for admin_id, email in db.session.query(User.id, User.email).filter(User.id.in_(admin_ids))
+    }
+
+
+def _build_conversation_payload(line_user, latest_message, unread_count, oa_name, tags_list, read_by_name):
+    """ประกอบ dict ของ sidebar 1 แถวจากข้อมูลที่โหลดมาแล้ว (ไม่ยิง query เพิ่ม)"""
     last_message_prefix = "คุณ:" if latest_message and latest_message.is_outgoing else "ลูกค้า:"
     last_message_content = "[No messages yet]"
     last_unread_timestamp = None
@@ -151,14 +162,6 @@ def _generate_conversation_data(user_id, oa_id):
             aware_timestamp = latest_message.timestamp.replace(tzinfo=timezone.utc)
             last_unread_timestamp = aware_timestamp.timestamp()
 
-    # ★★★ เพิ่มส่วนนี้เข้ามาใหม่ (วางไว้ตรงนี้ ก่อน return) ★★★
-    read_by_name = None
-    if line_user.read_by_admin:
-        # ดึงชื่ออีเมลส่วนหน้าก่อน @
-        read_by_name = line_user.read_by_admin.email.split('@')[0]
-    # ★★★ จบส่วนที่เพิ่ม ★★★
-    tags_list = [{'name': tag.name, 'color': tag.color} for tag in line_user.tags]
-
     last_message_iso_timestamp = None
     if latest_message:
         # แปลงเวลา UTC เป็น ISO format string
@@ -168,7 +171,7 @@ def _generate_conversation_data(user_id, oa_id):
         'user_id': line_user.user_id,
         'line_account_id': line_user.line_account_id,
         'display_name': line_user.nickname or line_user.display_name or f"User: {line_user.user_id[:12]}...",
-        'oa_name': line_user.line_account.name,
+        'oa_name': oa_name,
         'last_message_prefix': last_message_prefix,
         'last_message_content': last_message_content,
         'status': line_user.status,
@@ -180,156 +183,267 @@ def _generate_conversation_data(user_id, oa_id):
         'last_message_iso_timestamp': last_message_iso_timestamp
     }
 
-# ---- Routes ----
 
-@bp.route("/")
-@login_required
-def index():
+SIDEBAR_PAGE_SIZE = 20
+SIDEBAR_MAX_PAGE_SIZE = 100
+HISTORY_PAGE_SIZE = 20
+HISTORY_MORE_PAGE_SIZE = 10
+
+
+def _encode_cursor(values):
+    """เข้ารหัสตำแหน่งของแถวสุดท้าย (list ของค่าที่ใช้เรียง) เป็น string สำหรับ keyset pagination"""
+    raw = json.dumps(values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """คืน list ของค่าใน cursor หรือ None ถ้า cursor ไม่ถูกต้อง"""
     try:
-        # --- โหลดข้อมูลกลุ่มทั้งหมด ---
-        all_groups = OAGroup.query.order_by(OAGroup.name).all()
-        selected_group_ids = session.get("active_group_ids", [])
-        status_filter = request.args.get("status_filter", "all")
-        page = request.args.get("page", 1, type=int)
-        per_page = 20
-
-        # --- สร้าง Subquery สำหรับดึงข้อความล่าสุดของแต่ละผู้ใช้ ---
-        subquery = (
-            db.session.query(
-                LineMessage.user_id,
-                LineMessage.line_account_id,
-                func.max(LineMessage.timestamp).label("max_timestamp")
-            )
-            .group_by(LineMessage.user_id, LineMessage.line_account_id)
-            .subquery()
-        )
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
 
-        # --- Query หลัก ---
-        query = (
-            db.session.query(LineMessage, LineUser)
-            .join(
-                subquery,
-                (LineMessage.user_id == subquery.c.user_id)
-                & (LineMessage.line_account_id == subquery.c.line_account_id)
-                & (LineMessage.timestamp == subquery.c.max_timestamp)
-            )
-            .join(
-                LineUser,
-                (LineMessage.user_id == LineUser.user_id)
-                & (LineMessage.line_account_id == LineUser.line_account_id)
-            )
-            .options(
-                joinedload(LineMessage.line_account),
-                joinedload(LineMessage.admin)
-            )
-        )
 
-        # --- ตัวกรองสถานะ ---
-        if status_filter != "all":
-            query = query.filter(LineUser.status == status_filter)
+def _encode_sidebar_cursor(conv):
+    """cursor = (status_rank, last_message_at, id) ของแถวสุดท้าย"""
+    return _encode_cursor([conv.status_rank, conv.last_message_at.isoformat(), conv.id])
+
+
+def _decode_sidebar_cursor(cursor):
+    """คืน (status_rank, last_message_at, id) หรือ None ถ้า cursor ไม่ถูกต้อง"""
+    try:
+        rank, last_message_at, conv_id = _decode_cursor(cursor)
+        return int(rank), datetime.fromisoformat(last_message_at), int(conv_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _encode_history_cursor(message):
+    """cursor = (timestamp, id) ของข้อความที่เก่าที่สุดในหน้า"""
+    return _encode_cursor([message.timestamp.isoformat(), message.id])
+
+
+def _decode_history_cursor(cursor):
+    """คืน (timestamp, id) หรือ None ถ้า cursor ไม่ถูกต้อง"""
+    try:
+        timestamp, message_id = _decode_cursor(cursor)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError):
+        return None
 
-        # --- ตัวกรองตามกลุ่ม ---
-        if selected_group_ids:
-            query = (
-                query.join(LineAccount, LineMessage.line_account_id == LineAccount.id)
-                .filter(LineAccount.groups.any(OAGroup.id.in_(selected_group_ids)))
-            )
 
-        # --- เรียงลำดับ: เปิดก่อน ปิดทีหลัง ---
-        sort_order = case((LineUser.status == "closed", 1), else_=0)
-        pagination = (
-            query.order_by(sort_order.asc(), subquery.c.max_timestamp.desc())
-            .paginate(page=page, per_page=per_page, error_out=False)
+def _fetch_history_page(user_id, oa_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    ดึงประวัติแชทย้อนหลังแบบ keyset บน (timestamp, id) ใช้ index ix_line_message_oa_user_time_id
+    ต้นทุนต่อหน้าเท่ากันไม่ว่าจะเลื่อนย้อนไปไกลแค่ไหน คืน (messages เก่า->ใหม่, has_more, before_cursor)
+    """
+    query = (
+        LineMessage.query
+        .options(joinedload(LineMessage.admin), joinedload(LineMessage.line_account))
+        .filter(LineMessage.line_account_id == oa_id, LineMessage.user_id == user_id)
+    )
+    if before is not None:
+        query = query.filter(tuple_(LineMessage.timestamp, LineMessage.id) < tuple_(*before))
+
+    rows = query.order_by(LineMessage.timestamp.desc(), LineMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    before_cursor = _encode_history_cursor(rows[-1]) if has_more else None
+    rows.reverse()
+    return rows, has_more, before_cursor
+
+
+def _fetch_sidebar_page(status_filter, group_ids, cursor=None, limit=SIDEBAR_PAGE_SIZE):
+    """
+    ดึง conversation 1 หน้าแบบ keyset (ไม่มี OFFSET/COUNT) เรียง เปิดก่อน/ปิดทีหลัง แล้วตามข้อความล่าสุด
+    คืน (rows, next_cursor)
+    """
+    # inner join LineUser ในคิวรี (ไม่กรองทีหลัง) ให้ขนาดหน้าและ cursor ตรงกับแถวที่คืนจริง
+    query = (
+        Conversation.query
+        .join(Conversation.line_user)
+        .options(contains_eager(Conversation.line_user), joinedload(Conversation.line_account))
+        .filter(Conversation.last_message_at.isnot(None))
+    )
+
+    # --- ตัวกรองสถานะ ---
+    if status_filter and status_filter != "all":
+        query = query.filter(Conversation.status == status_filter)
+
+    # --- ตัวกรองตามกลุ่ม ---
+    if group_ids:
+        query = query.filter(Conversation.line_account_id.in_(
+            db.session.query(oa_group_association.c.line_account_id)
+            .filter(oa_group_association.c.oa_group_id.in_(group_ids))
+        ))
+
+    # --- ต่อจากแถวสุดท้ายของหน้าก่อน (rank ASC, last_message_at DESC, id DESC) ---
+    if cursor is not None:
+        rank, last_message_at, conv_id = cursor
+        query = query.filter(or_(
+            Conversation.status_rank > rank,
+            and_(Conversation.status_rank == rank, Conversation.last_message_at < last_message_at),
+            and_(
+                Conversation.status_rank == rank,
+                Conversation.last_message_at == last_message_at,
+                Conversation.id < conv_id,
+            ),
+        ))
+
+    rows = (
+        query.order_by(
+            Conversation.status_rank.asc(),
+            Conversation.last_message_at.desc(),
+            Conversation.id.desc(),
         )
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = _encode_sidebar_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
-        users_with_messages = pagination.items
 
-        # --- เตรียมข้อมูลเพื่อคำนวณจำนวนข้อความที่ยังไม่ได้อ่าน ---
-        user_info_for_unread = [
-            (user.user_id, user.line_account_id, user.last_read_timestamp)
-            for msg, user in users_with_messages
-        ]
+def _build_summary_payload(conv, tags_list, read_by_name):
+    """แปลงแถว conversation เป็น dict รูปแบบเดียวกับ render_conversation_update"""
+    user = conv.line_user
+    has_unread = conv.unread_count > 0 or (
+        not conv.last_message_is_outgoing
+        and (user.last_read_timestamp is None or conv.last_message_at > user.last_read_timestamp)
+    )
+    if conv.last_message_type in ("text", "event"):
+        last_message_content = truncate_text(conv.last_message_preview, 10)
+    else:
+        last_message_content = f"[{(conv.last_message_type or '').capitalize()}]"
+
+    return {
+        'user_id': conv.user_id,
+        'line_account_id': conv.line_account_id,
+        'display_name': user.nickname or user.display_name or f"User: {user.user_id[:12]}...",
+        'oa_name': conv.line_account.name if conv.line_account else None,
+        'last_message_prefix': "คุณ:" if conv.last_message_is_outgoing else "ลูกค้า:",
+        'last_message_content': last_message_content,
+        'status': conv.status,
+        'picture_url': user.picture_url,
+        'unread_count': conv.unread_count,
+        'last_unread_timestamp': conv.last_message_at.replace(tzinfo=timezone.utc).timestamp() if has_unread else None,
+        'read_by': read_by_name,
+        'tags': tags_list,
+        'last_message_iso_timestamp': conv.last_message_at.isoformat() + "Z",
+    }
+
 
-        unread_counts_map = {}
-        if user_info_for_unread:
-            conditions = []
-            for uid, l_acc_id, last_read in user_info_for_unread:
-                base_condition = (
-                    (LineMessage.user_id == uid)
-                    & (LineMessage.line_account_id == l_acc_id)
-                    & (LineMessage.is_outgoing == False)
-                )
-                if last_read:
-                    base_condition &= (LineMessage.timestamp > last_read)
-                conditions.append(base_condition)
-
-            if conditions:
-                query_for_counts = (
-                    db.session.query(
-                        LineMessage.user_id,
-                        LineMessage.line_account_id,
-                        func.count(LineMessage.id)
-                    )
-                    .filter(or_(*conditions))
-                    .group_by(LineMessage.user_id, LineMessage.line_account_id)
-                    .all()
-                )
-
-                unread_counts_map = {
-                    (uid, l_id): count for uid, l_id, count in query_for_counts
-                }
-
-        # --- รวมข้อมูลทั้งหมดสำหรับการแสดงผล ---
-        conversations = []
-        for msg, user in users_with_messages:
-            unread_count = unread_counts_map.get(
-                (user.user_id, user.line_account_id), 0
+def _build_summary_payloads(summaries, since=None):
+    """
+    payload ของหลาย conversation ตามลำดับเดิม (tags / ชื่อผู้อ่าน โหลดแบบ batch อย่างละ 1 query)
+    ใช้ summary cache ที่ cache_version ตรงกับแถวที่โหลดมา; since = summary_cache.begin() ก่อนโหลดแถว
+    """
+    versions = {(conv.line_account_id, conv.user_id): conv.cache_version for conv in summaries}
+    cached = summary_cache.get_many(versions, versions=versions)
+    missing = [conv for conv in summaries if (conv.line_account_id, conv.user_id) not in cached]
+    if missing:
+        tags_map = _load_tags_map({conv.line_user_id for conv in missing})
+        read_by_map = _load_read_by_map({conv.read_by_admin_id for conv in missing})
+        built = {
+            (conv.line_account_id, conv.user_id): _build_summary_payload(
+                conv, tags_map.get(conv.line_user_id, []), read_by_map.get(conv.read_by_admin_id)
             )
+            for conv in missing
+        }
+        if since is not None:
+            summary_cache.put_many({key: (versions[key], payload) for key, payload in built.items()}, since)
+        cached.update(built)
+    return [cached[(conv.line_account_id, conv.user_id)] for conv in summaries]
+
 
-            aware_timestamp = msg.timestamp.replace(tzinfo=timezone.utc)
-            correct_timestamp = aware_timestamp.timestamp()
-            has_unread = (
-                unread_count > 0
-                or (
-                    not msg.is_outgoing
-                    and (
-                        user.last_read_timestamp is None
-                        or msg.timestamp > user.last_read_timestamp
-                    )
-                )
+def _build_sidebar_rows(summaries, since=None):
+    """payload ของ sidebar ทั้งหน้า พร้อม object เดิมสำหรับ template"""
+    rows = _build_summary_payloads(summaries, since)
+    for row, conv in zip(rows, summaries):
+        row.update({"summary": conv, "user": conv.line_user})
+    return rows
+
+
+def _generate_conversations_data(pairs):
+    """
+    [โรงงานผลิตข้อมูลแบบ batch] รับ (user_id, oa_id) หลายคู่ คืน {(user_id, oa_id): payload}
+    ใช้จำนวน query คงที่ไม่ว่าจะกี่ conversation (conversation+user+OA, tags, แอดมิน)
+    """
+    keys = {(int(oa_id), str(user_id)) for user_id, oa_id in pairs}
+    if not keys:
+        return {}
+
+    since = summary_cache.begin()
+    result = {(user_id, oa_id): payload for (oa_id, user_id), payload in summary_cache.get_many(keys).items()}
+    keys = [key for key in keys if (key[1], key[0]) not in result]
+    if not keys:
+        return result
+
+    summaries = [
+        conv for conv in (
+            Conversation.query
+            .options(joinedload(Conversation.line_user), joinedload(Conversation.line_account))
+            .filter(tuple_(Conversation.line_account_id, Conversation.user_id).in_(keys))
+            .all()
+        )
+        if conv.line_user is not None
+    ]
+    result.update(
+        ((conv.user_id, conv.line_account_id), payload)
+        for conv, payload in zip(summaries, _build_summary_payloads(summaries, since))
+    )
+
+    # user ที่ยังไม่มีข้อความเลย (ยังไม่มีแถว conversation) ใช้ข้อมูลจาก LineUser แทน
+    missing = [(oa_id, user_id) for oa_id, user_id in keys if (user_id, oa_id) not in result]
+    if missing:
+        line_users = (
+            LineUser.query.options(joinedload(LineUser.line_account))
+            .filter(tuple_(LineUser.line_account_id, LineUser.user_id).in_(missing))
+            .all()
+        )
+        tags_map = _load_tags_map({u.id for u in line_users})
+        read_by_map = _load_read_by_map({u.read_by_admin_id for u in line_users})
+        for line_user in line_users:
+            result[(line_user.user_id, line_user.line_account_id)] = _build_conversation_payload(
+                line_user, None, 0, line_user.line_account.name,
+                tags_map.get(line_user.id, []), read_by_map.get(line_user.read_by_admin_id),
             )
-            last_unread_timestamp = correct_timestamp if has_unread else None
-
-            last_message_iso_timestamp = msg.timestamp.isoformat() + "Z" if msg else None
-
-            # ★★★ ดึงชื่อผู้ดูข้อความล่าสุด ★★★
-            read_by_name = None
-            if user.read_by_admin:
-                read_by_name = user.read_by_admin.email.split("@")[0]
-
-            conversations.append({
-                "message": msg,
-                "user": user,
-                "unread_count": unread_count,
-                "last_unread_timestamp": last_unread_timestamp,
-                "tags": [
-                    {"name": tag.name, "color": tag.color}
-                    for tag in user.tags
-                ],
-                "read_by": read_by_name,
-                "last_message_iso_timestamp": last_message_iso_timestamp
-            })
+    return result
+
+
+def _generate_conversation_data(user_id, oa_id):
+    """
+    [โรงงานผลิตข้อมูล] Helper function ที่ทำหน้าที่ดึงข้อมูลล่าสุดของ 1 conversation เสมอ
+    """
+    return _generate_conversations_data([(user_id, oa_id)]).get((str(user_id), int(oa_id)))
+
+# ---- Routes ----
+
+@bp.route("/")
+@login_required
+def index():
+    try:
+        # --- โหลดข้อมูลกลุ่มทั้งหมด ---
+        all_groups = OAGroup.query.order_by(OAGroup.name).all()
+        selected_group_ids = session.get("active_group_ids", [])
+        status_filter = request.args.get("status_filter", "all")
+
+        since = summary_cache.begin()
+        summaries, next_cursor = _fetch_sidebar_page(status_filter, selected_group_ids)
+        conversation_rows = _build_sidebar_rows(summaries, since)
 
         # --- ส่งข้อมูลไปยัง Template ---
         server_data_to_js = {
             "current_user_email": current_user.email,
+            "socket_websocket_only": current_app.config.get("SOCKETIO_WEBSOCKET_ONLY", False),
             "selected_group_ids": selected_group_ids,
         }
 
         return render_template(
             "chats/index.html",
-            conversations=conversations,
-            pagination=pagination,
+            conversations=conversation_rows,
+            next_cursor=next_cursor,
             all_groups=all_groups,
             selected_group_ids=selected_group_ids,
             status_filter=status_filter,
@@ -344,6 +458,27 @@ def index():
 
 
 
+@bp.route("/api/sidebar")
+@login_required
+def sidebar_api():
+    """sidebar แบบ JSON (keyset pagination ด้วย ?cursor=) ใช้แทนการโหลดหน้า /chats/ ทั้งหน้า"""
+    status_filter = request.args.get("status_filter", "all")
+    limit = min(max(request.args.get("limit", SIDEBAR_PAGE_SIZE, type=int), 1), SIDEBAR_MAX_PAGE_SIZE)
+    raw_cursor = request.args.get("cursor")
+    cursor = _decode_sidebar_cursor(raw_cursor) if raw_cursor else None
+    if raw_cursor and cursor is None:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    since = summary_cache.begin()
+    summaries, next_cursor = _fetch_sidebar_page(
+        status_filter, session.get("active_group_ids", []), cursor=cursor, limit=limit
+    )
+    rows = _build_sidebar_rows(summaries, since)
+    for row in rows:
+        del row["summary"], row["user"]
+    return jsonify({"conversations": rows, "next_cursor": next_cursor})
+
+
 @bp.route("/<user_id>", endpoint="show")
 @login_required
 def show(user_id):
@@ -367,7 +502,7 @@ def show(user_id):
     return render_template(
         "chats/index.html",
         conversations=[], # ส่งลิสต์ว่างไป เพราะหน้านี้จะแสดงแค่คนเดียว
-        pagination=None,    # ไม่มี pagination ในหน้านี้
+        next_cursor=None,   # ไม่มี pagination ในหน้านี้
         all_groups=OAGroup.query.order_by(OAGroup.name).all(),
         selected_group_ids=session.get("active_group_ids", []),
         status_filter='all',
@@ -394,23 +529,19 @@ def get_messages_for_user(user_id):
         line_user.read_by_admin_id = current_user.id
 
     line_user.last_read_timestamp = datetime.utcnow()
+    line_user.unread_count = 0
 
     if status_was_changed:
         db.session.flush() 
         fresh_data = _generate_conversation_data(line_user.user_id, line_user.line_account_id)
         if fresh_data:
-            target_groups = line_user.line_account.groups
-            for group in target_groups:
-                room_name = f'group_{group.id}'
-                socketio.emit('render_conversation_update', fresh_data, to=room_name)
+            room_events.emit('render_conversation_update', fresh_data, to=oa_rooms.rooms_for(line_user.line_account_id))
     
     db.session.commit()
 
     user_tags = [{'id': tag.id, 'name': tag.name, 'color': tag.color} for tag in line_user.tags]
-    total_messages = LineMessage.query.filter_by(user_id=user_id, line_account_id=oa_id).count()
-    messages_query = LineMessage.query.filter_by(user_id=user_id, line_account_id=oa_id).order_by(LineMessage.timestamp.desc()).limit(20).all()
-    messages_query.reverse()
-    processed_messages = [format_message_for_api(m) for m in messages_query]
+    messages, has_more, before_cursor = _fetch_history_page(user_id, oa_id)
+    processed_messages = [format_message_for_api(m) for m in messages]
     
     response_data = {
         "user": {
@@ -426,7 +557,8 @@ def get_messages_for_user(user_id):
         },
         "account": {"id": account.id, "name": account.name, "manager_url": account.manager_url},
         "messages": processed_messages, 
-        "total_messages": total_messages
+        "has_more": has_more,
+        "before": before_cursor
     }
     return jsonify(response_data)
 
@@ -441,7 +573,7 @@ def send_message():
     if not all([user_id, oa_id, message_text]):
         return jsonify({"status": "error", "message": "Missing data"}), 400
 
-    account = LineAccount.query.get(oa_id)
+    account = line_registry.get_by_id(oa_id)
     line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first()
 
     if not account or not line_user:
@@ -453,17 +585,6 @@ def send_message():
     if line_user.is_blocked:
         line_sent_successfully = False
         line_api_error_message = "Message not sent: This user has blocked the OA."
-    else:
-        try:
-            line_bot_api = LineBotApi(account.channel_access_token)
-            message_to_send = TextSendMessage(text=message_text)
-            line_bot_api.push_message(user_id, message_to_send)
-        except LineBotApiError as e:
-            line_sent_successfully = False
-            line_api_error_message = f"LINE API Error: {e.error.message}"
-        except Exception as e:
-            line_sent_successfully = False
-            line_api_error_message = f"An unexpected error occurred: {str(e)}"
 
     line_user.last_message_at = datetime.utcnow()
 
@@ -478,24 +599,27 @@ def send_message():
         line_sent_successfully=line_sent_successfully,
         line_error_message=line_api_error_message
     )
+    if line_sent_successfully:
+        # ส่งไป LINE เบื้องหลัง (ไม่รอ LINE ใน request) ผลการส่งจะตามไปทาง message_updated
+        outbound.prepare(new_message)
+    else:
+        new_message.send_status = outbound.STATUS_FAILED
     db.session.add(new_message)
     db.session.flush()
 
     message_data_for_socket = format_message_for_api(new_message)
     message_data_for_socket.update({'user_id': user_id, 'oa_id': int(oa_id)})
-    target_groups = line_user.line_account.groups
-    for group in target_groups:
-        group_room_name = f'group_{group.id}'
-        socketio.emit('new_message', message_data_for_socket, to=group_room_name)
+    target_rooms = oa_rooms.rooms_for(oa_id)
+    room_events.emit('new_message', message_data_for_socket, to=target_rooms)
 
     # 2. ส่งข้อมูลอัปเดต sidebar ใหม่
     fresh_data = _generate_conversation_data(user_id, oa_id)
     if fresh_data:
-        for group in target_groups:
-            group_room_name = f'group_{group.id}'
-            socketio.emit('render_conversation_update', fresh_data, to=group_room_name)
+        room_events.emit('render_conversation_update', fresh_data, to=target_rooms)
             
     db.session.commit() # Commit
+    if line_sent_successfully:
+        outbound.submit(oa_id)
 
     response_data = format_message_for_api(new_message)
     response_data.update({
@@ -507,6 +631,65 @@ def send_message():
     return jsonify(response_data)
 
 
+@bp.route("/api/schedule_message", methods=["POST"])
+@login_required
+def schedule_message():
+    """ตั้งเวลาส่งข้อความ (send_at เป็น ISO8601, ไม่มี timezone = เวลาไทย) dispatcher จะส่งเข้าคิว outbound เมื่อถึงเวลา"""
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    oa_id = data.get('oa_id')
+    if not all([user_id, oa_id]):
+        return jsonify({"status": "error", "message": "Missing data"}), 400
+
+    line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first()
+    if not line_user:
+        return jsonify({"status": "error", "message": "OA or User not found"}), 404
+
+    message = {
+        'type': data.get('type') or 'text',
+        'text': data.get('message'),
+        'url': data.get('url'),
+        'package_id': data.get('package_id'),
+        'sticker_id': data.get('sticker_id'),
+    }
+    try:
+        due_at = scheduler.parse_due_at(data.get('send_at'))
+        schedule = scheduler.schedule_message(line_user, message, due_at, admin_user_id=current_user.id)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    db.session.commit()
+    scheduler.submit(schedule)
+    return jsonify({"status": "success", **scheduler.serialize(schedule)}), 201
+
+
+@bp.route("/api/scheduled/<user_id>")
+@login_required
+def list_scheduled_messages(user_id):
+    """ข้อความที่ตั้งเวลาไว้และยังไม่ถึงเวลาของแชทนี้"""
+    oa_id = request.args.get('oa_id', type=int)
+    if not oa_id:
+        return jsonify({"error": "Missing OA ID"}), 400
+    rows = (
+        ScheduledMessage.query
+        .filter_by(line_account_id=oa_id, user_id=user_id, status=scheduler.STATUS_SCHEDULED)
+        .order_by(ScheduledMessage.due_at.asc())
+        .all()
+    )
+    return jsonify([scheduler.serialize(row) for row in rows])
+
+
+@bp.route("/api/scheduled/<int:schedule_id>/cancel", methods=["POST"])
+@login_required
+def cancel_scheduled_message(schedule_id):
+    schedule = ScheduledMessage.query.get_or_404(schedule_id)
+    if schedule.filters and not is_admin():
+        # broadcast ที่ตั้งเวลาไว้ ยกเลิกได้เฉพาะแอดมินเหมือน /broadcasts/api/<id>/cancel
+        return jsonify({"status": "error", "message": "Admin permission required"}), 403
+    if not scheduler.cancel(schedule.id):
+        return jsonify({"status": "error", "message": "Message already sent or cancelled"}), 409
+    return jsonify({"status": "success", **scheduler.serialize(db.session.get(ScheduledMessage, schedule_id))})
+
+
 @bp.route('/user/update/<int:id>', methods=['POST'])
 @login_required
 def update_details(id):
@@ -573,19 +756,12 @@ def send_image():
     if not all([file, user_id, oa_id]) or file.filename == '':
         return jsonify({"error": "Missing data or file"}), 400
 
-    account = LineAccount.query.get(oa_id)
+    account = line_registry.get_by_id(oa_id)
     if not account:
         return jsonify({"status": "error", "message": "OA not found"}), 404
 
     try:
         permanent_url = s3_client.upload_fileobj(file)
-        
-        line_bot_api = LineBotApi(account.channel_access_token)
-        message_to_send = ImageSendMessage(
-            original_content_url=permanent_url, 
-            preview_image_url=permanent_url
-        )
-        line_bot_api.push_message(user_id, message_to_send)
 
         new_message = LineMessage(
             user_id=user_id,
@@ -596,8 +772,10 @@ def send_image():
             timestamp=datetime.utcnow(),
             admin_user_id=current_user.id
         )
+        outbound.prepare(new_message)
         db.session.add(new_message)
         db.session.commit()
+        outbound.submit(oa_id)
 
         line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first() # เพิ่มบรรทัดนี้
         if not line_user: # เพิ่มการตรวจสอบ
@@ -606,12 +784,10 @@ def send_image():
         message_data_for_socket = format_message_for_api(new_message)
         message_data_for_socket.update({'user_id': user_id, 'oa_id': int(oa_id)})
 
-        target_groups = line_user.line_account.groups # แก้ไข user เป็น line_user
-        if not target_groups:
-            print(f"Warning: LineAccount ID {line_user.line_account.id} has no groups. Broadcast will not be sent.") # แก้ไข
-        for group in target_groups:
-            group_room_name = f'group_{group.id}'
-            socketio.emit('new_message', message_data_for_socket, to=group_room_name)
+        target_rooms = oa_rooms.rooms_for(line_user.line_account_id)
+        if not target_rooms:
+            print(f"Warning: LineAccount ID {line_user.line_account_id} has no groups. Broadcast will not be sent.")
+        room_events.emit('new_message', message_data_for_socket, to=target_rooms)
         # --- จบส่วนแก้ไข ---
 
         response_data = format_message_for_api(new_message)
@@ -623,6 +799,76 @@ def send_image():
         traceback.print_exc()
         return jsonify({"db_saved_successfully": False, "db_error": str(e)}), 500
     
+def _outbound_media_type(content_type):
+    """แปลง content-type ของไฟล์ที่แอดมินแนบเป็น message_type ที่เก็บใน LineMessage"""
+    major = (content_type or "").split("/")[0]
+    if major in ("image", "video", "audio"):
+        return major
+    return "file"
+
+
+@bp.route('/api/send_file', methods=['POST'])
+@login_required
+def send_file():
+    """ส่งไฟล์ (วิดีโอ/เสียง/เอกสาร/รูป) โดย stream ขึ้น S3 แบบ multipart ไม่โหลดทั้งไฟล์เข้า memory"""
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files['file']
+    user_id = request.form.get('user_id')
+    oa_id = request.form.get('oa_id')
+    duration_ms = request.form.get('duration_ms', type=int)
+
+    if not all([file, user_id, oa_id]) or file.filename == '':
+        return jsonify({"error": "Missing data or file"}), 400
+
+    account = line_registry.get_by_id(oa_id)
+    if not account:
+        return jsonify({"status": "error", "message": "OA not found"}), 404
+
+    try:
+        # werkzeug เก็บไฟล์ใหญ่ไว้ใน temp file อยู่แล้ว หาขนาดด้วย seek แทนการ read ทั้งก้อน
+        file.stream.seek(0, os.SEEK_END)
+        file_size = file.stream.tell()
+        file.stream.seek(0)
+
+        content_type = file.mimetype or s3_client._ctype(file.filename)
+        message_type = _outbound_media_type(content_type)
+        permanent_url = s3_client.upload_fileobj(file)
+
+        new_message = LineMessage(
+            user_id=user_id,
+            line_account_id=oa_id,
+            message_type=message_type,
+            message_url=permanent_url,
+            media_content_type=content_type,
+            media_size=file_size,
+            media_duration_ms=duration_ms,
+            file_name=file.filename[:255],
+            is_outgoing=True,
+            timestamp=datetime.utcnow(),
+            admin_user_id=current_user.id
+        )
+        # รูปแบบข้อความที่ส่งไป LINE สร้างจากแถวนี้ตอน worker ส่ง (outbound.build_send_message)
+        outbound.prepare(new_message)
+        db.session.add(new_message)
+        db.session.commit()
+        outbound.submit(oa_id)
+
+        message_data_for_socket = format_message_for_api(new_message)
+        message_data_for_socket.update({'user_id': user_id, 'oa_id': int(oa_id)})
+        room_events.emit('new_message', message_data_for_socket, to=oa_rooms.rooms_for(new_message.line_account_id))
+
+        response_data = format_message_for_api(new_message)
+        response_data.update({"db_saved_successfully": True})
+        return jsonify(response_data)
+
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+        return jsonify({"db_saved_successfully": False, "db_error": str(e)}), 500
+
+
 @bp.route("/api/send_sticker", methods=["POST"])
 @login_required
 def send_sticker():
@@ -635,17 +881,10 @@ def send_sticker():
     if not all([user_id, oa_id, package_id, sticker_id]):
         return jsonify({"status": "error", "message": "Missing data"}), 400
 
-    account = LineAccount.query.get(oa_id)
+    account = line_registry.get_by_id(oa_id)
     if not account:
         return jsonify({"status": "error", "message": "OA not found"}), 404
 
-    try:
-        line_bot_api = LineBotApi(account.channel_access_token)
-        message_to_send = StickerSendMessage(package_id=package_id, sticker_id=sticker_id)
-        line_bot_api.push_message(user_id, message_to_send)
-    except Exception as e:
-        return jsonify({"status": "error", "message": "Failed to send sticker via LINE"}), 500
-
     new_message = LineMessage(
         user_id=user_id,
         line_account_id=oa_id,
@@ -656,8 +895,10 @@ def send_sticker():
         timestamp=datetime.utcnow(),
         admin_user_id=current_user.id
     )
+    outbound.prepare(new_message)
     db.session.add(new_message)
     db.session.commit()
+    outbound.submit(oa_id)
 
     line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first() # เพิ่มบรรทัดนี้
     if not line_user: # เพิ่มการตรวจสอบ
@@ -665,12 +906,10 @@ def send_sticker():
     
     message_data_for_socket = format_message_for_api(new_message)
     message_data_for_socket.update({'user_id': user_id, 'oa_id': int(oa_id)})
-    target_groups = line_user.line_account.groups # แก้ไข user เป็น line_user
-    if not target_groups:
-        print(f"Warning: LineAccount ID {line_user.line_account.id} has no groups. Broadcast will not be sent.") # แก้ไข
-    for group in target_groups:
-        group_room_name = f'group_{group.id}'
-        socketio.emit('new_message', message_data_for_socket, to=group_room_name)
+    target_rooms = oa_rooms.rooms_for(line_user.line_account_id)
+    if not target_rooms:
+        print(f"Warning: LineAccount ID {line_user.line_account_id} has no groups. Broadcast will not be sent.")
+    room_events.emit('new_message', message_data_for_socket, to=target_rooms)
     # --- จบส่วนแก้ไข ---
 
     response_data = format_message_for_api(new_message)
@@ -794,14 +1033,17 @@ def download_chat(user_id):
 @login_required
 def load_more(user_id):
     oa_id = request.args.get("oa", type=int)
-    offset = request.args.get("offset", type=int, default=0)
-    limit = 10
-    messages = LineMessage.query.filter_by(user_id=user_id, line_account_id=oa_id).order_by(LineMessage.timestamp.desc()).offset(offset).limit(limit).all()
-    messages.reverse()
-    
+    raw_before = request.args.get("before")
+    before = _decode_history_cursor(raw_before) if raw_before else None
+    if not oa_id or (raw_before and before is None):
+        return jsonify({"error": "Missing OA ID or invalid cursor"}), 400
+
+    messages, has_more, before_cursor = _fetch_history_page(
+        user_id, oa_id, before=before, limit=HISTORY_MORE_PAGE_SIZE
+    )
     processed_messages = [format_message_for_api(m) for m in messages]
-    
-    return jsonify({"messages": processed_messages})
+
+    return jsonify({"messages": processed_messages, "has_more": has_more, "before": before_cursor})
 
 @bp.route('/api/search_conversations')
 @login_required
@@ -827,36 +1069,16 @@ def search_conversations():
         user_query = user_query.join(LineAccount).filter(LineAccount.groups.any(OAGroup.id.in_(selected_group_ids)))
 
     found_users = user_query.limit(20).all()
+    summaries = _generate_conversations_data((user.user_id, user.line_account_id) for user in found_users)
 
     results = []
     for user in found_users:
-        latest_message = LineMessage.query.filter_by(
-            user_id=user.user_id,
-            line_account_id=user.line_account_id
-        ).order_by(LineMessage.timestamp.desc()).first()
-
-        if latest_message:
-            if latest_message.is_outgoing:
-                last_message_prefix = "คุณ:"
-            else:
-                last_message_prefix = "ลูกค้า:"
-            
-            if latest_message.message_type == 'text':
-                last_message_content = truncate_text(latest_message.message_text)
-            else:
-                last_message_content = f"[{latest_message.message_type.capitalize()}]"
-
-            results.append({
-                'user_id': latest_message.user_id,
-                'line_account_id': latest_message.line_account_id,
-                'display_name': user.nickname or user.display_name or f"User: {user.user_id[:12]}...",
-                'oa_name': latest_message.line_account.name,
-                'last_message_prefix': last_message_prefix,
-                'last_message_content': last_message_content,
-                'is_read': latest_message.is_outgoing,
-                'picture_url': user.picture_url,
-                'status': user.status
-            })
+        payload = summaries.get((user.user_id, user.line_account_id))
+        # แสดงเฉพาะคนที่มีข้อความแล้ว (เหมือนเดิม)
+        if not payload or not payload['last_message_iso_timestamp']:
+            continue
+        payload['is_read'] = payload['last_unread_timestamp'] is None
+        results.append(payload)
 
     return jsonify(results)
 
@@ -874,6 +1096,10 @@ def update_conversation_status(user_db_id):
     # 1. อัปเดตสถานะใน object (ยังไม่ commit) - ส่วนนี้ทำงานทุกครั้ง
     user.status = new_status
 
+    # ข้อความเตือนอัตโนมัติผูกกับสถานะ (เช่น deposit): ยกเลิกของสถานะเดิม แล้วตั้งของสถานะใหม่ (ถ้าตั้งค่าไว้)
+    scheduler.cancel_for_status_change(user, new_status)
+    reminder = scheduler.schedule_status_reminder(user, new_status, admin_user_id=current_user.id)
+
     # 2. ตรวจสอบเงื่อนไข: ถ้าสถานะเป็น 'closed' เท่านั้น ถึงจะสร้าง Log
     if new_status == 'closed':
         log_text = f"📝 {current_user.email} changed status to '{new_status.capitalize()}'"
@@ -888,29 +1114,25 @@ def update_conversation_status(user_db_id):
         db.session.add(log_message)
         
         # ส่ง Log เข้าห้องแชทผ่าน SocketIO เฉพาะเมื่อเป็น 'closed'
-        room_name = f"chat_{user.user_id}_{user.line_account_id}"
         message_data_for_socket = format_message_for_api(log_message)
         message_data_for_socket.update({
             'user_id': user.user_id, 'oa_id': user.line_account_id,
         })
-        target_groups = user.line_account.groups
-        if not target_groups:
-            print(f"Warning: LineAccount ID {user.line_account.id} has no groups. Broadcast will not be sent.")
-        for group in target_groups:
-            room_name = f'group_{group.id}'
-            socketio.emit('new_message', message_data_for_socket, to=room_name)
+        target_rooms = oa_rooms.rooms_for(user.line_account_id)
+        if not target_rooms:
+            print(f"Warning: LineAccount ID {user.line_account_id} has no groups. Broadcast will not be sent.")
+        room_events.emit('new_message', message_data_for_socket, to=target_rooms)
 
     # 3. Commit การเปลี่ยนแปลงลง DB (บันทึก status ใหม่เสมอ และบันทึก log ถ้ามี)
     db.session.flush()
 
     fresh_data = _generate_conversation_data(user.user_id, user.line_account_id)
     if fresh_data:
-        target_groups = user.line_account.groups
-        for group in target_groups:
-            room_name = f'group_{group.id}'
-            socketio.emit('render_conversation_update', fresh_data, to=room_name)
+        room_events.emit('render_conversation_update', fresh_data, to=oa_rooms.rooms_for(user.line_account_id))
     
     db.session.commit() # Commit ตอนท้าย
+    if reminder:
+        scheduler.submit(reminder)
     
     return jsonify({"status": "success", "new_status": new_status})
 
@@ -953,6 +1175,30 @@ def handle_update_groups(data):
         join_room(room) # ★★★ แก้ไขแล้ว: เอา socketio. ออก ★★★
         
     print(f'User {current_user.email} updated groups. Left: {old_rooms}, Joined: {new_rooms}')
+    # ack: seq ปัจจุบันของแต่ละห้อง + event ที่พลาดไป (ถ้า client ส่ง cursors มาตอน reconnect)
+    return _replay_rooms(new_rooms, data.get('cursors') or {})
+
+
+def _replay_rooms(rooms, cursors):
+    """cursors = {room: {stream: seq}} คืน {'rooms': {room: {stream: state}}}"""
+    result = {}
+    for room in rooms:
+        room_cursors = {
+            str(stream): int(seq) for stream, seq in (cursors.get(room) or {}).items() if seq is not None
+        }
+        result[room] = room_events.replay(room, room_cursors)
+    return {'rooms': result}
+
+
+@socketio.on('resync_rooms')
+def handle_resync_rooms(data):
+    """client เห็น seq ขาดช่วง: ขอ event ที่พลาดไปของห้องที่อยู่ (เกิน buffer จะได้ resync: true)"""
+    if not current_user.is_authenticated:
+        return None
+    data = data or {}
+    cursors = data.get('cursors') or {}
+    joined = set(_get_user_group_rooms())
+    return _replay_rooms([room for room in cursors if room in joined], cursors)
 
 @bp.post("/upload")
 def upload_media():
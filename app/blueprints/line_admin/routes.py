@@ -1,12 +1,11 @@
-from flask import render_template, redirect, url_for, request, flash , current_app
+from flask import render_template, redirect, url_for, request, flash , current_app, abort
 from flask_login import login_required, current_user
 from app.models import LineAccount , LineMessage
 from app.extensions import db
 from . import bp   # ใช้ bp ที่สร้างใน __init__.py
 import secrets
 from sqlalchemy.orm import joinedload
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
+from app.services import line_registry, oa_rooms
 from app.models import LineAccount, OAGroup
 from app.extensions import socketio
 from flask_socketio import join_room, leave_room
@@ -86,6 +85,8 @@ def add_line_account():
 
     db.session.add(new_account)
     db.session.commit()
+    line_registry.invalidate(line_account_id=new_account.id, webhook_path=new_account.webhook_path)
+    oa_rooms.invalidate()
 
     flash("Line OA added successfully!", "success")
     return redirect(url_for("line_admin.line_admin_index"))
@@ -113,6 +114,8 @@ def edit_line_account(id):
     account.groups = OAGroup.query.filter(OAGroup.id.in_(selected_group_ids)).all()
 
     db.session.commit()
+    line_registry.invalidate(line_account_id=account.id)
+    oa_rooms.invalidate()
     flash("Line OA updated successfully!", "success")
     return redirect(url_for("line_admin.line_admin_index"))
 
@@ -123,8 +126,11 @@ def edit_line_account(id):
 @admin_required
 def delete_line_account(id):
     account = LineAccount.query.get_or_404(id)
+    webhook_path = account.webhook_path
     db.session.delete(account)
     db.session.commit()
+    line_registry.invalidate(line_account_id=id, webhook_path=webhook_path)
+    oa_rooms.invalidate()
     flash("Line OA deleted successfully!", "success")
     return redirect(url_for("line_admin.line_admin_index"))
 
@@ -163,11 +169,13 @@ def reply_message(message_id):
     THAI_TZ = timezone(timedelta(hours=7))
 
     msg = LineMessage.query.get_or_404(message_id)
-    account = LineAccount.query.get_or_404(msg.line_account_id)
+    account = line_registry.get_by_id(msg.line_account_id)
+    if not account:
+        abort(404)
     next_url = request.args.get("next")
 
     reply_type = request.form.get("reply_type", "text")
-    line_bot_api = LineBotApi(account.channel_access_token)
+    line_bot_api = account.api
 
     # เตรียมบันทึก outgoing message
     new_out = LineMessage(
@@ -1,155 +1,321 @@
 from flask import abort, request, current_app, jsonify # เพิ่ม abort
 from flask_login import login_required, current_user
 
-# [เพิ่ม] import เครื่องมือ S3 ของคุณ
-from app.services import s3_client
+from app.services import admission, conversations, idempotency, webhook_ingest, line_registry, media_pipeline, oa_rooms, profile_enricher, query_counter, room_events
+from app.services.bulk_ops import dialect_insert, insert_ignore_conflicts
 
 from flask_socketio import join_room, leave_room
-from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
-from app.models import db, LineAccount, LineMessage, LineUser
+from app.models import db, LineMessage, LineUser
 from . import bp
 import json
 import os
 from datetime import datetime
 
 from app.extensions import socketio
-from app.blueprints.chats.routes import _generate_conversation_data, format_message_for_api
+from app.blueprints.chats.routes import (
+    _generate_conversation_data, _generate_conversations_data, format_message_for_api,
+)
 from linebot.models import (
     FollowEvent, UnfollowEvent, MessageEvent,
-    TextMessage, ImageMessage, StickerMessage
+    TextMessage, ImageMessage, StickerMessage,
+    VideoMessage, AudioMessage, FileMessage,
+)
+
+
+
+def _load_users_for_batch(line_account_id, events):
+    """
+    โหลด/สร้าง LineUser ของทุกคนใน batch ด้วยจำนวน query คงที่
+    คืน (users_by_id, new_user_ids)
+    """
+    all_user_ids = {
+        event.source.user_id for event in events
+        if isinstance(event, (FollowEvent, UnfollowEvent, MessageEvent))
+        and getattr(event.source, "user_id", None)
+    }
+    if not all_user_ids:
+        return {}, set()
+
+    # Unfollow ของคนที่ไม่เคยมีในระบบ ไม่ต้องสร้าง user ใหม่ (เหมือนพฤติกรรมเดิม)
+    creatable_ids = {
+        event.source.user_id for event in events
+        if isinstance(event, (FollowEvent, MessageEvent))
+        and getattr(event.source, "user_id", None)
+    }
+
+    def _select_users():
+        return {
+            u.user_id: u for u in LineUser.query.filter(
+                LineUser.line_account_id == line_account_id,
+                LineUser.user_id.in_(all_user_ids),
+            )
+        }
+
+    users_by_id = _select_users()
+    new_user_ids = creatable_ids - set(users_by_id)
+    if new_user_ids:
+        # INSERT ... ON CONFLICT DO NOTHING บน _line_account_user_uc
+        # กันกรณี 2 webhook สร้าง user เดียวกันพร้อมกันแล้วอีกฝั่งชน unique constraint
+        now = datetime.utcnow()
+        insert_ignore_conflicts(
+            LineUser,
+            [
+                {"line_account_id": line_account_id, "user_id": uid, "created_at": now, "last_message_at": now}
+                for uid in sorted(new_user_ids)
+            ],
+            index_elements=("line_account_id", "user_id"),
+        )
+        users_by_id = _select_users()
+
+    return users_by_id, new_user_ids
+
+
+def _apply_cached_profile(line_account_id, user):
+    """ใส่โปรไฟล์จาก cache ถ้ามี คืน False ถ้าต้องให้ worker ไปดึงจาก LINE"""
+    profile = profile_enricher.cached_profile(line_account_id, user.user_id)
+    if profile is None:
+        return False
+    user.display_name = profile["display_name"]
+    user.picture_url = profile["picture_url"]
+    return True
+
+
+def _handle_events(line_account, events):
+    """บันทึก events ของ webhook ลง DB แล้ว emit ไปยังห้องของกลุ่ม (ใช้ทั้งโหมด sync และ worker)"""
+    # ตัด event ที่ LINE ส่งซ้ำออกก่อน จะได้ไม่ไปดึงโปรไฟล์/ไฟล์สื่อซ้ำ
+    events = idempotency.filter_new_events(line_account.id, events)
+    if not events:
+        return
+
+    users_by_id, new_user_ids = _load_users_for_batch(line_account.id, events)
+    # โปรไฟล์ที่ไม่มีใน cache จะถูกดึงโดย worker หลัง commit (ไม่เพิ่ม round trip ไป LINE ใน request)
+    profiles_to_fetch = set()
+    message_rows = []
+
+    for event in events:
+        user = users_by_id.get(getattr(event.source, "user_id", None))
+        if user is None:
+            continue
+
+        # --- จัดการ Event การบล็อก (Unfollow) ---
+        if isinstance(event, UnfollowEvent):
+            user.is_blocked = True
+            continue
+
+        # --- จัดการ Event การแอดเพื่อน/ปลดบล็อก (Follow) ---
+        if isinstance(event, FollowEvent):
+            user.is_blocked = False
+            if not _apply_cached_profile(line_account.id, user):
+                profiles_to_fetch.add(user.user_id)
+            continue
+
+        # --- จัดการ Event ที่เป็นข้อความ (MessageEvent) ---
+        if isinstance(event, MessageEvent):
+            if user.user_id in new_user_ids and not _apply_cached_profile(line_account.id, user):
+                profiles_to_fetch.add(user.user_id)
+
+            # [ปรับปรุง] อัปเดตสถานะและเวลา
+            previous_status = (user.status or "").strip().lower()
+            should_reset_status = previous_status in ("", "read", "unread") or previous_status == "closed"
+            # สถานะอื่น (เช่น deposit/withdraw/issue) คงไว้เหมือนเดิมเมื่อมีข้อความเข้าใหม่
+            if should_reset_status:
+                user.status = 'unread'
+                user.read_by_admin_id = None
+            user.last_message_at = datetime.utcnow()
+            user.is_blocked = False
+
+            base_row = {
+                "line_account_id": line_account.id,
+                "user_id": user.user_id,
+                "timestamp": datetime.utcnow(),
+                "is_outgoing": False,
+                "line_message_id": event.message.id,
+                "webhook_event_id": getattr(event, "webhook_event_id", None),
+            }
+            if isinstance(event.message, TextMessage):
+                message_rows.append({**base_row, "message_type": "text", "message_text": event.message.text})
+            elif isinstance(event.message, (ImageMessage, VideoMessage, AudioMessage, FileMessage)):
+                message_rows.append(_media_row(base_row, event.message))
+            elif isinstance(event.message, StickerMessage):
+                message_rows.append({
+                    **base_row,
+                    "message_type": "sticker",
+                    "sticker_id": event.message.sticker_id,
+                    "package_id": event.message.package_id,
+                })
+
+    # --- INSERT ข้อความทั้ง batch ในคำสั่งเดียว (multi-VALUES) ---
+    # ON CONFLICT DO NOTHING บน unique ของ webhook_event_id/line_message_id กันกรณีซ้ำที่หลุดมาพร้อมกัน
+    # ไม่ใช้ executemany + sort_by_parameter_order: บน PostgreSQL แถวที่ถูกข้ามทำให้ sentinel ของ insertmanyvalues พัง
+    inserted_messages = []
+    if message_rows:
+        # ทุกแถวใน VALUES ต้องมีคอลัมน์ชุดเดียวกัน (ข้อความ/สติกเกอร์/สื่อ มีคีย์ไม่เท่ากัน)
+        columns = sorted({key for row in message_rows for key in row})
+        stmt = dialect_insert(LineMessage).values(
+            [{column: row.get(column) for column in columns} for row in message_rows]
+        )
+        if hasattr(stmt, "on_conflict_do_nothing"):
+            stmt = stmt.on_conflict_do_nothing()
+        returned = db.session.execute(stmt.returning(LineMessage)).scalars().all()
+        # RETURNING ไม่รับประกันลำดับ เรียงกลับตามลำดับ event ด้วย line_message_id
+        by_line_message_id = {message.line_message_id: message for message in returned}
+        inserted_messages = [
+            by_line_message_id[row["line_message_id"]]
+            for row in message_rows
+            if row["line_message_id"] in by_line_message_id
+        ]
+
+    # bulk insert ไม่ผ่าน ORM flush จึงต้องอัปเดต conversation เอง (ใน transaction เดียวกัน)
+    conversations.record_messages(inserted_messages)
+
+    pending_media_ids = [m.id for m in inserted_messages if m.media_status == media_pipeline.MEDIA_PENDING]
+
+    # ประกอบ payload จากแถวที่เพิ่ง insert ก่อน commit (หลัง commit object จะถูก expire และต้อง query ใหม่)
+    outgoing_events = _build_socket_payloads(line_account, inserted_messages)
+
+    # --- [ปรับปรุง] commit ข้อมูลทั้งหมดลง DB แค่ครั้งเดียวหลังจบ Loop ---
+    db.session.commit()
+    idempotency.remember(events)
+
+    # ★★★ ส่ง Event ทั้งสองตัวไปที่ "ห้องของกลุ่ม" ★★★
+    for event_name, payload, rooms in outgoing_events:
+        room_events.emit(event_name, payload, to=rooms)
+
+    for user_id in profiles_to_fetch:
+        profile_enricher.request_profile(line_account.id, user_id)
+
+    for message_id in pending_media_ids:
+        media_pipeline.submit(message_id)
+
+
+_MEDIA_TYPES = (
+    (ImageMessage, "image"),
+    (VideoMessage, "video"),
+    (AudioMessage, "audio"),
+    (FileMessage, "file"),
 )
-from io import BytesIO
 
 
+def _clip_file_name(file_name):
+    """ตัดชื่อไฟล์ให้พอดีคอลัมน์ file_name โดยเก็บนามสกุลไว้ (media worker ใช้นามสกุลตั้งชื่อไฟล์บน S3)"""
+    limit = LineMessage.__table__.c.file_name.type.length
+    if not file_name or len(file_name) <= limit:
+        return file_name
+    stem, ext = os.path.splitext(file_name)
+    if len(ext) >= limit:
+        return file_name[:limit]
+    return stem[: limit - len(ext)] + ext
+
+
+def _media_row(base_row, message):
+    """แถว LineMessage ของรูป/วิดีโอ/เสียง/ไฟล์ พร้อม metadata ที่ LINE ส่งมากับ event"""
+    message_type = next(name for cls, name in _MEDIA_TYPES if isinstance(message, cls))
+    row = {
+        **base_row,
+        "message_type": message_type,
+        "media_duration_ms": getattr(message, "duration", None),
+        "media_size": getattr(message, "file_size", None),
+        "file_name": _clip_file_name(getattr(message, "file_name", None)),
+    }
+    content_provider = getattr(message, "content_provider", None)
+    if content_provider is not None and content_provider.type == "external":
+        # ไฟล์อยู่บน server ภายนอกอยู่แล้ว ใช้ URL ตรงได้เลยไม่ต้องดึงผ่าน LINE
+        row.update(message_url=content_provider.original_content_url, media_status=media_pipeline.MEDIA_READY)
+    else:
+        # เก็บ placeholder ไว้ก่อน ให้ media worker stream ไฟล์จาก LINE ขึ้น S3 ภายหลัง
+        row["media_status"] = media_pipeline.MEDIA_PENDING
+    return row
+
+
+def _build_socket_payloads(line_account, inserted_messages):
+    """
+    สร้างรายการ (event, payload, rooms) ด้วยจำนวน query คงที่
+    - new_message ทุกข้อความ (สำหรับเสียง/Pop-up/แชทที่เปิดอยู่)
+    - render_conversation_update 1 ครั้งต่อ user แม้จะส่งมาหลายข้อความใน batch เดียว (สำหรับ Sidebar)
+    """
+    if not inserted_messages:
+        return []
+
+    rooms = oa_rooms.rooms_for(line_account.id)
+    if not rooms:
+        return []
+
+    messages_by_user = {}
+    for message in inserted_messages:
+        messages_by_user.setdefault(message.user_id, []).append(message)
+
+    # conversation ถูกอัปเดตแล้วใน transaction นี้ สร้าง payload ของทุก user ในครั้งเดียว
+    summaries = _generate_conversations_data((user_id, line_account.id) for user_id in messages_by_user)
+
+    outgoing = []
+    for user_id, user_messages in messages_by_user.items():
+        for message in user_messages:
+            outgoing.append(('new_message', format_message_for_api(message), rooms))
+        fresh_data = summaries.get((user_id, line_account.id))
+        if fresh_data:
+            outgoing.append(('render_conversation_update', fresh_data, rooms))
+    return outgoing
+
+
+def process_inbox_body(line_account_id, body, signature):
+    """[worker] ประมวลผล body ดิบที่ถูกเก็บไว้ใน webhook_inbox"""
+    line_account = line_registry.get_by_id(line_account_id)
+    if not line_account:
+        # OA ถูกลบไปแล้ว ไม่มีอะไรต้องทำ
+        return
+
+    events = line_account.handler.parser.parse(body, signature)
+    _handle_events(line_account, events)
+
 
 @bp.route("/<string:webhook_path>/callback", methods=["POST"])
 def callback(webhook_path):
     signature = request.headers.get("X-Line-Signature")
     body = request.get_data(as_text=True)
     
-    line_account = LineAccount.query.filter_by(webhook_path=webhook_path).first()
+    # ใช้ registry กลาง ไม่ต้อง query DB / สร้าง client ใหม่ทุก request
+    line_account = line_registry.get_by_webhook_path(webhook_path)
     if not line_account:
         abort(404, description="LineAccount not found")
 
-    handler = WebhookHandler(line_account.channel_secret)
-    line_bot_api = LineBotApi(line_account.channel_access_token)
-
     try:
-        events = handler.parser.parse(body, signature)
-
-        for event in events:
-            # --- จัดการ Event การบล็อก (Unfollow) ---
-            if isinstance(event, UnfollowEvent):
-                user = LineUser.query.filter_by(user_id=event.source.user_id, line_account_id=line_account.id).first()
-                if user:
-                    user.is_blocked = True
-                continue
-
-            # --- จัดการ Event การแอดเพื่อน/ปลดบล็อก (Follow) ---
-            if isinstance(event, FollowEvent):
-                user = LineUser.query.filter_by(user_id=event.source.user_id, line_account_id=line_account.id).first()
-                if not user:
-                    user = LineUser(line_account_id=line_account.id, user_id=event.source.user_id)
-                    db.session.add(user)
-                
-                user.is_blocked = False
-                try:
-                    profile = line_bot_api.get_profile(event.source.user_id)
-                    user.display_name = profile.display_name
-                    user.picture_url = profile.picture_url
-                except Exception as e:
-                    print(f"Could not get profile for follower {event.source.user_id}: {e}")
-                continue
-
-            # --- จัดการ Event ที่เป็นข้อความ (MessageEvent) ---
-            if isinstance(event, MessageEvent):
-                user = LineUser.query.filter_by(line_account_id=line_account.id, user_id=event.source.user_id).first()
-
-                if not user:
-                    user = LineUser(line_account_id=line_account.id, user_id=event.source.user_id)
-                    db.session.add(user)
-                    try:
-                        profile = line_bot_api.get_profile(event.source.user_id)
-                        user.display_name = profile.display_name
-                        user.picture_url = profile.picture_url
-                    except Exception as e:
-                        print(f"Could not get profile for {event.source.user_id}: {e}")
-                
-                # [ปรับปรุง] อัปเดตสถานะและเวลา
-                previous_status = (user.status or "").strip().lower()
-                should_reset_status = previous_status in ("", "read", "unread") or previous_status == "closed"
-                if should_reset_status:
-                    user.status = 'unread'
-                else:
-                    # คงสถานะปัจจุบัน (เช่น deposit/withdraw/issue) เมื่อมีข้อความเข้าใหม่
-                    pass
-                if should_reset_status:
-                    user.read_by_admin_id = None
-                user.last_message_at = datetime.utcnow()
-                user.is_blocked = False
-                # [เอาออก] ไม่มีการจัดการ unread_count ด้วยตนเองอีกต่อไป
-
-                new_msg = None
-                if isinstance(event.message, TextMessage):
-                    new_msg = LineMessage(line_account_id=line_account.id, user_id=user.user_id, message_type="text", message_text=event.message.text, timestamp=datetime.utcnow(), is_outgoing=False)
-                elif isinstance(event.message, ImageMessage):
-                    message_content = line_bot_api.get_message_content(event.message.id)
-                    image_bytes = message_content.content
-                    image_stream = BytesIO(image_bytes)
-                    
-                    # สร้างไฟล์จำลองเพื่ออัปโหลด (อาจจะต้องสร้าง helper class)
-                    class MockFileStorage:
-                        def __init__(self, stream, filename, content_type):
-                            self.stream, self.filename, self.content_type = stream, filename, content_type
-                    
-                    mock_file = MockFileStorage(image_stream, f"{event.message.id}.jpg", message_content.content_type)
-                    s3_url = s3_client.upload_fileobj(mock_file)
-                    if s3_url:
-                        new_msg = LineMessage(line_account_id=line_account.id, user_id=user.user_id, message_type="image", message_url=s3_url, timestamp=datetime.utcnow(), is_outgoing=False)
-                
-                elif isinstance(event.message, StickerMessage):
-                    new_msg = LineMessage(line_account_id=line_account.id, user_id=user.user_id, message_type="sticker", sticker_id=event.message.sticker_id, package_id=event.message.package_id, timestamp=datetime.utcnow(), is_outgoing=False)
-                
-                if new_msg:
-                    db.session.add(new_msg)
-
-        # --- [ปรับปรุง] commit ข้อมูลทั้งหมดลง DB แค่ครั้งเดียวหลังจบ Loop ---
-        db.session.commit()
-
-        # --- [แก้ไข] ย้ายการ Emit ทั้งหมดมาอยู่นอก Loop และใช้ข้อมูลล่าสุด ---
-        # เราจะวน Loop อีกครั้ง แต่ครั้งนี้เพื่อ Emit เท่านั้น
-        for event in events:
-            if isinstance(event, MessageEvent):
-                user = LineUser.query.filter_by(line_account_id=line_account.id, user_id=event.source.user_id).first()
-                
-                # ค้นหาข้อความล่าสุดที่เพิ่งบันทึกไป
-                last_message = LineMessage.query.filter_by(user_id=user.user_id, line_account_id=line_account.id).order_by(LineMessage.timestamp.desc()).first()
-
-                if user and last_message:
-                    message_data_for_socket = format_message_for_api(last_message)
-                    fresh_data = _generate_conversation_data(user.user_id, user.line_account_id)
-
-                    # ★★★ แก้ไขโดยการส่ง Event ทั้งสองตัวไปที่ "ห้องของกลุ่ม" ★★★
-                    if fresh_data and user.line_account and user.line_account.groups:
-                        for group in user.line_account.groups:
-                            group_room_name = f'group_{group.id}'
-                            # 1. ส่ง new_message ไปที่กลุ่ม (สำหรับเสียง/Pop-up/แชทที่เปิดอยู่)
-                            socketio.emit('new_message', message_data_for_socket, to=group_room_name)
-                            # 2. ส่ง render_conversation_update ไปที่กลุ่ม (สำหรับ Sidebar)
-                            socketio.emit('render_conversation_update', fresh_data, to=group_room_name)
-        
-        return "OK", 200
-
+        events = line_account.handler.parser.parse(body, signature)
     except InvalidSignatureError:
         abort(400, description="Invalid signature")
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error in webhook callback: {e}")
-        import traceback
-        traceback.print_exc()
-        abort(500, description="Internal Server Error")
-    
+
+    # --- admission control: เกิน limit ต่อ worker/ต่อ OA ให้ spool ลงดิสก์แทนการรอ DB ---
+    with admission.admit(line_account.id) as admitted:
+        if not admitted:
+            try:
+                admission.spool(line_account.id, body, signature)
+            except OSError as e:
+                print(f"Error spooling webhook for {webhook_path}: {e}")
+                abort(503, description="Service Unavailable")
+            return "OK", 200
+
+        # --- โหมด async: เก็บ body ลงคิวแล้วตอบ LINE ทันที ให้ worker ทำที่เหลือ ---
+        # (load test ที่นับ query ต่อ request ขอให้ทำแบบ sync ได้ ดู query_counter.INGEST_MODE_HEADER)
+        if webhook_ingest.is_async_enabled() and not query_counter.forces_sync_ingest():
+            try:
+                webhook_ingest.enqueue(line_account.id, body, signature)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error enqueueing webhook for {webhook_path}: {e}")
+                abort(500, description="Internal Server Error")
+            return "OK", 200
+
+        try:
+            _handle_events(line_account, events)
+            return "OK", 200
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error in webhook callback: {e}")
+            import traceback
+            traceback.print_exc()
+            abort(500, description="Internal Server Error")
+
 @bp.route("/chats/read", methods=["POST"])
 @login_required
 def mark_chat_as_read():
@@ -179,10 +345,8 @@ def mark_chat_as_read():
         db.session.commit()
 
         fresh_data = _generate_conversation_data(user.user_id, user.line_account_id)
-        if fresh_data and user.line_account and user.line_account.groups:
-            for group in user.line_account.groups:
-                group_room_name = f'group_{group.id}'
-                socketio.emit('render_conversation_update', fresh_data, to=group_room_name)
+        if fresh_data:
+            room_events.emit('render_conversation_update', fresh_data, to=oa_rooms.rooms_for(user.line_account_id))
 
         print(f"✅ Marked chat for user {user_id} as read (triggered by {current_user.email}).")
         return jsonify({'success': True, 'data': fresh_data}), 200
@@ -3,6 +3,7 @@ from flask_login import login_required
 from . import bp
 from app.models import OAGroup
 from app.extensions import db
+from app.services import oa_rooms
 from .forms import GroupForm
 
 @bp.route("/")
@@ -41,5 +42,6 @@ def delete(id):
     group = OAGroup.query.get_or_404(id)
     db.session.delete(group)
     db.session.commit()
+    oa_rooms.invalidate()
     flash("Group deleted successfully!", "danger")
     return redirect(url_for("oa_groups.index"))
\ No newline at end of file
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 
 from . import bp # import bp จาก __init__.py ในโฟลเดอร์เดียวกัน
 from app.models import db, LineUser, Tag , LineAccount
+from app.services import segments
 
 import pytz
 from datetime import datetime, timedelta
@@ -28,57 +29,17 @@ def search_page():
 def search_users_api():
     """API สำหรับค้นหาและกรอง LineUser (เวอร์ชันอัปเดต)"""
     page = request.args.get('page', 1, type=int)
-    query_term = request.args.get('q', '').strip()
-    tag_ids_str = request.args.get('tags', '')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    oa_id = request.args.get('oa_id', type=int)
-    
+
         # สร้าง timezone object เตรียมไว้
     utc_zone = pytz.utc
     bkk_zone = pytz.timezone('Asia/Bangkok')
 
-    # ★★★ สร้าง Query เริ่มต้นที่ Join กับ LineAccount ไว้เลย ★★★
-    # เพื่อให้สามารถดึงชื่อ OA มาใช้ได้เสมอ
-    query = LineUser.query.join(LineAccount, LineUser.line_account_id == LineAccount.id)
-
-    # --- กรองด้วยข้อความ ---
-    if query_term:
-        search_pattern = f"%{query_term}%"
-        query = query.filter(
-            or_(
-                LineUser.display_name.ilike(search_pattern),
-                LineUser.nickname.ilike(search_pattern),
-                LineUser.phone.ilike(search_pattern),
-                LineUser.user_id.ilike(search_pattern)
-            )
-        )
-
-    # --- กรองด้วย Tag ---
-    if tag_ids_str:
-        try:
-            tag_ids = [int(id) for id in tag_ids_str.split(',')]
-            # ต้อง join กับ relationship 'tags'
-            query = query.join(LineUser.tags).filter(Tag.id.in_(tag_ids))
-        except ValueError:
-            return jsonify({"error": "Invalid tag IDs format"}), 400
-
-    # --- กรองด้วย Line OA ---
-    if oa_id:
-        query = query.filter(LineUser.line_account_id == oa_id)
-
-    # --- กรองด้วยวันที่ติดต่อล่าสุด ---
-    if start_date_str:
-        naive_start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        bkk_start_time = bkk_zone.localize(naive_start_date)
-        utc_start_time = bkk_start_time.astimezone(pytz.utc)
-        query = query.filter(LineUser.last_message_at >= utc_start_time)
-    
-    if end_date_str:
-        naive_end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)
-        bkk_end_time = bkk_zone.localize(naive_end_date)
-        utc_end_time = bkk_end_time.astimezone(pytz.utc)
-        query = query.filter(LineUser.last_message_at < utc_end_time)
+    # เงื่อนไขกรอง (ข้อความ / Tag / Line OA / วันที่ติดต่อล่าสุด) อยู่ที่ segments ใช้ชุดเดียวกับ broadcast
+    try:
+        filters = segments.parse_filters(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid tag IDs or date format"}), 400
+    query = segments.user_query(filters)
 
     pagination = query.order_by(LineUser.last_message_at.desc()).paginate(
         page=page, per_page=20, error_out=False
@@ -26,6 +26,10 @@ tags_users = db.Table('tags_users',
 # --- Models ---
 
 from .changelog import ChangeLog, ChangeLogFile  # noqa: E402  # ให้ blueprint อื่นๆ import ได้ง่าย
+from .webhook import WebhookInbox  # noqa: E402
+from .conversation import Conversation  # noqa: E402
+from .broadcast import Broadcast, BroadcastBatch, BroadcastRecipient  # noqa: E402
+from .scheduled import ScheduledMessage  # noqa: E402
 
 
 class User(UserMixin, db.Model):
@@ -86,6 +90,7 @@ class LineUser(db.Model):
 
     display_name = db.Column(db.String(255))
     picture_url = db.Column(db.String(1024))
+    profile_refreshed_at = db.Column(db.DateTime, nullable=True, index=True) # เวลาที่ดึงโปรไฟล์จาก LINE ล่าสุด
     
     # ข้อมูลลูกค้า
     nickname = db.Column(db.String(100))
@@ -123,15 +128,33 @@ class LineMessage(db.Model):
     admin = db.relationship('User')
     message_type = db.Column(db.String(50), nullable=False, default="text", index=True) # <-- [เพิ่ม] เผื่อมีการกรองข้อความตามประเภท
     message_text = db.Column(db.Text)
-    message_url = db.Column(db.String(255))
+    message_url = db.Column(db.String(2000)) # URL ไฟล์บน S3 หรือ originalContentUrl ภายนอก (LINE ยอมให้ยาวได้ถึง 2000 ตัวอักษร)
     media_key = db.Column(db.String(512), index=True, nullable=True)
     sticker_id = db.Column(db.String(50))
     package_id = db.Column(db.String(50))
     is_outgoing = db.Column(db.Boolean, default=False, index=True) # <-- [เพิ่ม] สำหรับกรองข้อความเข้า-ออก
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(BANGKOK_TZ), index=True) # <-- [เพิ่ม] สำคัญมาก! สำหรับเรียงลำดับข้อความ
-    __table_args__ = (db.Index("ix_line_message_user_time", "user_id", "timestamp"),)
+    __table_args__ = (
+        db.Index("ix_line_message_user_time", "user_id", "timestamp"),
+        # keyset pagination ของประวัติแชท (ORDER BY timestamp DESC, id DESC ภายใน conversation)
+        db.Index("ix_line_message_oa_user_time_id", "line_account_id", "user_id", "timestamp", "id"),
+        # คิวส่งข้อความขาออก: หยิบข้อความที่ยังส่งไม่เสร็จที่เก่าที่สุดของ OA (ดู app/services/outbound.py)
+        db.Index("ix_line_message_send_queue", "line_account_id", "send_status", "id"),
+    )
     line_sent_successfully = db.Column(db.Boolean, default=True, nullable=False)
     line_error_message = db.Column(db.String, nullable=True)
+    line_message_id = db.Column(db.String(64), nullable=True, unique=True) # message id ฝั่ง LINE (ใช้ดึงไฟล์สื่อ + กันข้อความซ้ำ)
+    webhook_event_id = db.Column(db.String(64), nullable=True, unique=True) # webhookEventId ของ LINE กัน redelivery บันทึกซ้ำ
+    media_status = db.Column(db.String(20), nullable=True, index=True) # pending/processing/ready/failed สำหรับสื่อที่ดึงเบื้องหลัง
+    media_claimed_at = db.Column(db.DateTime, nullable=True) # processing: เวลาที่ worker จองงาน (UTC) เกิน MEDIA_CLAIM_LEASE_SECONDS ถือว่า worker ตาย
+    media_content_type = db.Column(db.String(100), nullable=True) # content-type ของไฟล์สื่อ (เช่น video/mp4, application/pdf)
+    media_size = db.Column(db.BigInteger, nullable=True) # ขนาดไฟล์ (bytes)
+    media_duration_ms = db.Column(db.Integer, nullable=True) # ความยาววิดีโอ/เสียง (ms) ตามที่ LINE ส่งมา
+    file_name = db.Column(db.String(255), nullable=True) # ชื่อไฟล์ของข้อความประเภท file
+    send_status = db.Column(db.String(20), nullable=True) # pending/sending/sent/failed ของข้อความขาออกที่ส่งผ่านคิว (null = ข้อความขาเข้า/ข้อมูลเก่า)
+    send_attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0") # จำนวนครั้งที่ worker พยายามส่ง
+    send_next_at = db.Column(db.DateTime, nullable=True) # pending: เวลาที่ลองใหม่ได้ (backoff) / sending: หมดเวลาจองของ worker
+    send_retry_key = db.Column(db.String(36), nullable=True) # X-Line-Retry-Key กัน LINE ส่งซ้ำตอนลองใหม่
 
     def __repr__(self):
         return f"<LineMessage {self.user_id}: {self.message_text}>"
@@ -0,0 +1,85 @@
+# app/models/broadcast.py - broadcast ไปยัง segment ของ LineUser: แบ่งเป็น batch ละไม่เกิน 500 คน (LINE multicast) เก็บผลแบบ bulk
+from __future__ import annotations
+
+from sqlalchemy import Index, func
+
+from ..extensions import db
+
+
+class Broadcast(db.Model):
+    __tablename__ = "broadcast"
+
+    id = db.Column(db.Integer, primary_key=True)
+    admin_user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True)
+    # เงื่อนไข segment (JSON) รูปแบบเดียวกับ /api/search/users ดู app/services/segments.py
+    filters = db.Column(db.Text, nullable=False)
+
+    # ข้อความที่ส่ง (ชื่อคอลัมน์เหมือน LineMessage เพื่อใช้ outbound.build_send_message ร่วมกัน)
+    message_type = db.Column(db.String(20), nullable=False, default="text")
+    message_text = db.Column(db.Text, nullable=True)
+    message_url = db.Column(db.String(512), nullable=True)
+    package_id = db.Column(db.String(50), nullable=True)
+    sticker_id = db.Column(db.String(50), nullable=True)
+
+    # resolving -> running -> completed (หรือ cancelled)
+    status = db.Column(db.String(20), nullable=False, default="resolving", server_default="resolving")
+    total_recipients = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    skipped_blocked = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    sent_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    failed_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    # worker ที่กำลังส่งต่ออายุทุก batch ถ้าขาดไปนานเกิน lease ถือว่าตาย ให้ worker อื่น resume ต่อจาก batch ล่าสุด
+    heartbeat_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    admin = db.relationship("User", foreign_keys=[admin_user_id])
+
+    __table_args__ = (
+        Index("ix_broadcast_status", "status"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<Broadcast {self.id} {self.status} {self.sent_count}/{self.total_recipients}>"
+
+
+class BroadcastBatch(db.Model):
+    """ผู้รับไม่เกิน 500 คนของ OA เดียว = multicast 1 ครั้ง (checkpoint ของการ resume)"""
+
+    __tablename__ = "broadcast_batch"
+
+    id = db.Column(db.Integer, primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey("broadcast.id", ondelete="CASCADE"), nullable=False)
+    line_account_id = db.Column(db.Integer, db.ForeignKey("line_account.id", ondelete="CASCADE"), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending", server_default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    recipient_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # X-Line-Retry-Key ของ multicast นี้ (ส่งซ้ำหลัง crash แล้ว LINE ตอบ 409 แทนการส่งซ้ำ)
+    retry_key = db.Column(db.String(36), nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # runner หยิบ batch ถัดไปที่ยังไม่ส่งตามลำดับ seq
+        Index("ix_broadcast_batch_broadcast_status_seq", "broadcast_id", "status", "seq"),
+    )
+
+
+class BroadcastRecipient(db.Model):
+    """ผู้รับแต่ละคน (insert/update ทีละ batch ไม่ใช่ทีละแถว)"""
+
+    __tablename__ = "broadcast_recipient"
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey("broadcast.id", ondelete="CASCADE"), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey("broadcast_batch.id", ondelete="CASCADE"), nullable=False, index=True)
+    line_account_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending", server_default="pending")
+
+    __table_args__ = (
+        db.UniqueConstraint("broadcast_id", "line_account_id", "user_id", name="uq_broadcast_recipient"),
+    )
@@ -0,0 +1,46 @@
+# app/models/conversation.py - read-model ของ sidebar แชท (1 แถวต่อ LINE user ต่อ OA) อัปเดตทุกครั้งที่มีข้อความเข้า/ออก
+from __future__ import annotations
+
+from sqlalchemy import Index, func
+
+from ..extensions import db
+
+
+class Conversation(db.Model):
+    __tablename__ = "conversation"
+
+    id = db.Column(db.Integer, primary_key=True)
+    line_account_id = db.Column(db.Integer, db.ForeignKey("line_account.id", ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(db.String(255), nullable=False)
+    line_user_id = db.Column(db.Integer, db.ForeignKey("line_user.id", ondelete="CASCADE"), nullable=True, index=True)
+
+    # ข้อความล่าสุด (ใช้แสดง preview โดยไม่ต้องแตะ line_message)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_message_type = db.Column(db.String(50), nullable=True)
+    last_message_preview = db.Column(db.String(255), nullable=True)
+    last_message_is_outgoing = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    # สถานะที่ sync มาจาก LineUser
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    status = db.Column(db.String(50), nullable=False, default="read", server_default="read")
+    status_rank = db.Column(db.SmallInteger, nullable=False, default=0, server_default="0")  # 0 = เปิดอยู่, 1 = closed (เรียงไว้ท้าย)
+    read_by_admin_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    # เพิ่มทุกครั้งที่ข้อมูลใน sidebar ของแถวนี้เปลี่ยน (ใช้ตรวจ summary cache ข้าม worker)
+    cache_version = db.Column(db.BigInteger, nullable=False, default=1, server_default="1")
+
+    line_user = db.relationship("LineUser", foreign_keys=[line_user_id])
+    line_account = db.relationship("LineAccount", foreign_keys=[line_account_id])
+    read_by_admin = db.relationship("User", foreign_keys=[read_by_admin_id])
+
+    __table_args__ = (
+        db.UniqueConstraint("line_account_id", "user_id", name="uq_conversation_oa_user"),
+        # sidebar: เรียง เปิดก่อน/ปิดทีหลัง แล้วตามเวลาข้อความล่าสุด
+        Index("ix_conversation_rank_last_message", "status_rank", "last_message_at", "id"),
+        Index("ix_conversation_oa_rank_last_message", "line_account_id", "status_rank", "last_message_at", "id"),
+        Index("ix_conversation_status_last_message", "status", "last_message_at", "id"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<Conversation oa={self.line_account_id} {self.user_id} unread={self.unread_count}>"
@@ -0,0 +1,51 @@
+# app/models/scheduled.py - ข้อความตั้งเวลาส่ง (หา LineUser คนเดียว หรือ broadcast ตาม segment) รอ dispatcher หยิบตาม due_at
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import Index
+
+from ..extensions import db
+
+
+class ScheduledMessage(db.Model):
+    __tablename__ = "scheduled_message"
+
+    id = db.Column(db.Integer, primary_key=True)
+    admin_user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True)
+
+    # ปลายทาง: (line_account_id, user_id) = ส่งหาคนเดียว, filters (JSON แบบ segments) = broadcast
+    line_account_id = db.Column(db.Integer, db.ForeignKey("line_account.id", ondelete="CASCADE"), nullable=True)
+    user_id = db.Column(db.String(255), nullable=True)
+    filters = db.Column(db.Text, nullable=True)
+
+    # ข้อความที่ส่ง (ชื่อคอลัมน์เหมือน LineMessage / Broadcast)
+    message_type = db.Column(db.String(20), nullable=False, default="text")
+    message_text = db.Column(db.Text, nullable=True)
+    message_url = db.Column(db.String(512), nullable=True)
+    package_id = db.Column(db.String(50), nullable=True)
+    sticker_id = db.Column(db.String(50), nullable=True)
+
+    due_at = db.Column(db.DateTime, nullable=False)  # เวลาที่ต้องส่ง (UTC naive แบบเดียวกับ LineMessage.send_next_at)
+    # scheduled -> dispatched (ส่งต่อให้ outbound/broadcast แล้ว) / cancelled / failed
+    status = db.Column(db.String(20), nullable=False, default="scheduled", server_default="scheduled")
+    # สร้างอัตโนมัติจากสถานะแชทนี้ (เช่น deposit) ถูกยกเลิกเมื่อแอดมินเปลี่ยนสถานะไปเป็นอย่างอื่น
+    trigger_status = db.Column(db.String(50), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    line_message_id = db.Column(db.Integer, db.ForeignKey("line_message.id", ondelete="SET NULL"), nullable=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey("broadcast.id", ondelete="SET NULL"), nullable=True)
+
+    admin = db.relationship("User", foreign_keys=[admin_user_id])
+
+    __table_args__ = (
+        # dispatcher โหลดเฉพาะช่วงเวลาข้างหน้า: WHERE status = 'scheduled' AND due_at < :horizon
+        Index("ix_scheduled_message_status_due", "status", "due_at"),
+        # รายการที่ตั้งเวลาไว้ของแชทหนึ่ง (และยกเลิกตอนเปลี่ยนสถานะแชท)
+        Index("ix_scheduled_message_oa_user_status", "line_account_id", "user_id", "status"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<ScheduledMessage {self.id} {self.status} {self.due_at}>"
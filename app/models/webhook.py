@@ -0,0 +1,28 @@
+# app/models/webhook.py - โมเดลคิว webhook ขาเข้า (outbox) สำหรับประมวลผลเบื้องหลัง
+from __future__ import annotations
+
+from sqlalchemy import Index, func
+
+from ..extensions import db
+
+
+class WebhookInbox(db.Model):
+    __tablename__ = "webhook_inbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    line_account_id = db.Column(db.Integer, db.ForeignKey("line_account.id", ondelete="CASCADE"), nullable=False)
+    signature = db.Column(db.String(255), nullable=True)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending", server_default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    claimed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # worker ดึงงานถัดไปของแต่ละ OA ตามลำดับ id
+        Index("ix_webhook_inbox_oa_status_id", "line_account_id", "status", "id"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<WebhookInbox {self.id} oa={self.line_account_id} {self.status}>"
@@ -0,0 +1,309 @@
+# app/services/admission.py - จำกัดจำนวน webhook ที่กำลังประมวลผล (ต่อ worker / ต่อ OA) และ spool ลงดิสก์เมื่อเกิน
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, suppress
+from typing import Dict, Iterator, Optional
+
+from flask import Flask, current_app
+from linebot.exceptions import InvalidSignatureError
+
+from app.extensions import db, socketio
+from app.services import metrics
+
+_lock = threading.Lock()
+_in_flight_total = 0
+_in_flight_by_oa: Dict[int, int] = defaultdict(int)
+# จำนวนไฟล์ที่ยังค้างใน spool ต่อ OA (ถ้ายังมีค้าง request ใหม่ของ OA นั้นต้อง spool ตามเพื่อรักษาลำดับ)
+# นับจากไฟล์ในโฟลเดอร์ spool (ใช้ร่วมกันทุก process) ไม่ใช่ตัวนับใน process เพราะ process อื่นอาจเป็นคน drain
+_spooled_by_oa: Dict[int, int] = {}
+_spool_scanned_at = 0.0
+# สแกนโฟลเดอร์ใหม่ได้บ่อยสุดเท่านี้ (hot path ของ webhook)
+_SPOOL_SCAN_SECONDS = 1.0
+# drainer จองไฟล์ด้วยการ rename เป็น <ชื่อ>.claim-<pid>-<สุ่ม> ถ้า process ตายระหว่างทำ ไฟล์จะถูกคืนหลังจากนี้
+CLAIM_LEASE_SECONDS = 300.0
+_CLAIM_MARK = ".claim-"
+_drainer_started = False
+_wakeup = threading.Event()
+
+
+def _spool_dir(app: Optional[Flask] = None) -> str:
+    app = app or current_app
+    return app.config["WEBHOOK_SPOOL_DIR"]
+
+
+def _publish_gauges() -> None:
+    metrics.set_gauge("webhook_in_flight", _in_flight_total)
+    metrics.set_gauge("webhook_spool_backlog", sum(_spooled_by_oa.values()))
+
+
+def _try_acquire(line_account_id: int) -> Optional[str]:
+    """จองที่ว่าง คืน None ถ้าได้ หรือคืนเหตุผลที่ถูก shed"""
+    global _in_flight_total
+    max_total = int(current_app.config.get("WEBHOOK_MAX_IN_FLIGHT", 64))
+    max_per_oa = int(current_app.config.get("WEBHOOK_MAX_IN_FLIGHT_PER_OA", 16))
+    if time.monotonic() - _spool_scanned_at > _SPOOL_SCAN_SECONDS:
+        _scan_spool(_spool_dir())
+    with _lock:
+        if _spooled_by_oa.get(line_account_id):
+            return "spool_backlog"
+        if _in_flight_total >= max_total:
+            return "worker_limit"
+        if _in_flight_by_oa[line_account_id] >= max_per_oa:
+            return "oa_limit"
+        _in_flight_total += 1
+        _in_flight_by_oa[line_account_id] += 1
+        metrics.set_gauge("webhook_in_flight_oa", _in_flight_by_oa[line_account_id], oa=line_account_id)
+        _publish_gauges()
+    return None
+
+
+def _release(line_account_id: int) -> None:
+    global _in_flight_total
+    with _lock:
+        _in_flight_total -= 1
+        _in_flight_by_oa[line_account_id] -= 1
+        metrics.set_gauge("webhook_in_flight_oa", _in_flight_by_oa[line_account_id], oa=line_account_id)
+        if not _in_flight_by_oa[line_account_id]:
+            del _in_flight_by_oa[line_account_id]
+        _publish_gauges()
+
+
+@contextmanager
+def admit(line_account_id: int) -> Iterator[bool]:
+    """
+    ใช้ครอบการประมวลผล webhook:
+        with admission.admit(oa_id) as admitted:
+            if not admitted: spool(...)
+    ได้ False เมื่อเกิน limit (ห้ามแตะ DB ต่อ ให้ spool ลงดิสก์แทน)
+    """
+    _ensure_drainer(current_app._get_current_object())
+    reason = _try_acquire(line_account_id)
+    if reason is not None:
+        metrics.incr("webhook_shed_total", oa=line_account_id, reason=reason)
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        _release(line_account_id)
+
+
+def spool(line_account_id: int, body: str, signature: Optional[str]) -> None:
+    """เขียน body ดิบลงดิสก์ (ไม่ใช้ DB connection) ให้ drainer นำกลับมาประมวลผลทีหลัง"""
+    directory = _spool_dir()
+    os.makedirs(directory, exist_ok=True)
+    # ชื่อไฟล์ขึ้นต้นด้วยเวลา เรียงตามชื่อ = เรียงตามลำดับที่รับเข้า
+    name = f"{time.time_ns():020d}-{line_account_id}-{uuid.uuid4().hex[:8]}.json"
+    tmp_path = os.path.join(directory, name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"line_account_id": line_account_id, "body": body, "signature": signature}, f)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+    with _lock:
+        _spooled_by_oa[line_account_id] = _spooled_by_oa.get(line_account_id, 0) + 1
+        _publish_gauges()
+    metrics.incr("webhook_spooled_total", oa=line_account_id)
+    _wakeup.set()
+
+
+# ---- drainer: อ่าน spool กลับเข้าระบบทีละไฟล์ (หลาย process drain โฟลเดอร์เดียวกันได้) ----
+
+def _ensure_drainer(app: Flask) -> None:
+    global _drainer_started
+    if _drainer_started:
+        return
+    with _lock:
+        if _drainer_started:
+            return
+        _drainer_started = True
+    # นับไฟล์ที่ค้างจากรอบก่อน (เช่นรีสตาร์ทระหว่างที่ยังมี backlog)
+    _scan_spool(_spool_dir(app))
+    socketio.start_background_task(_drain_loop, app)
+
+
+def _list_spool(directory: str):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.listdir(directory))
+
+
+def _is_spool_file(name: str) -> bool:
+    return name.endswith(".json")
+
+
+def _is_claim_file(name: str) -> bool:
+    return _CLAIM_MARK in name and not name.endswith((".bad", ".tmp"))
+
+
+def _scan_spool(directory: str, names=None) -> None:
+    """นับ backlog ต่อ OA จากไฟล์ในโฟลเดอร์ (ไฟล์ที่รอ + ไฟล์ที่ drainer ตัวใดตัวหนึ่งจองอยู่)"""
+    global _spool_scanned_at
+    counts: Dict[int, int] = defaultdict(int)
+    for name in _list_spool(directory) if names is None else names:
+        if _is_spool_file(name) or _is_claim_file(name):
+            line_account_id = _spool_oa_id(name)
+            if line_account_id is not None:
+                counts[line_account_id] += 1
+    with _lock:
+        _spooled_by_oa.clear()
+        _spooled_by_oa.update(counts)
+        _spool_scanned_at = time.monotonic()
+        _publish_gauges()
+
+
+def _drain_loop(app: Flask) -> None:
+    interval = float(app.config.get("WEBHOOK_SPOOL_POLL_SECONDS", 2))
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        try:
+            _drain_pass(app, interval)
+        except Exception:
+            # error ที่ไม่คาดคิดต้องไม่ทำให้ drainer ตาย (ไม่งั้น backlog จะค้างจนรีสตาร์ท)
+            traceback.print_exc()
+            socketio.sleep(interval)
+
+
+def _drain_pass(app: Flask, interval: float) -> None:
+    directory = _spool_dir(app)
+    names = _list_spool(directory)
+    _release_stale_claims(directory, names)
+
+    # OA ที่ drainer ตัวอื่นกำลังทำอยู่: ข้ามไฟล์ถัดไปของ OA นั้นทั้งหมดเพื่อรักษาลำดับ
+    busy = {_spool_oa_id(name) for name in names if _is_claim_file(name)}
+    for name in names:
+        if not _is_spool_file(name):
+            continue
+        line_account_id = _spool_oa_id(name)
+        if line_account_id in busy:
+            continue
+        claimed = _claim(os.path.join(directory, name))
+        if claimed is None:
+            # process อื่นหยิบไปก่อน
+            busy.add(line_account_id)
+            continue
+        if not _drain_file(app, claimed, line_account_id):
+            # DB ยังไม่พร้อม คืนไฟล์แล้วหยุดรอบนี้ไว้ก่อน (ไม่ข้ามไฟล์เพื่อรักษาลำดับ)
+            _unclaim(claimed)
+            socketio.sleep(interval)
+            break
+
+    _scan_spool(directory)
+
+
+def _claim(path: str) -> Optional[str]:
+    """จองไฟล์ด้วย rename (atomic) คืน path ใหม่ หรือ None ถ้ามีคนจองไปแล้ว"""
+    claimed = f"{path}{_CLAIM_MARK}{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return None
+    # rename ไม่เปลี่ยน mtime ตั้งใหม่ให้เป็นเวลาที่จอง (ใช้วัด lease)
+    with suppress(FileNotFoundError):
+        os.utime(claimed, None)
+    return claimed
+
+
+def _original_path(claimed: str) -> str:
+    return claimed.rsplit(_CLAIM_MARK, 1)[0]
+
+
+def _unclaim(claimed: str) -> None:
+    with suppress(FileNotFoundError):
+        os.rename(claimed, _original_path(claimed))
+
+
+def _release_stale_claims(directory: str, names) -> None:
+    """คืนไฟล์ที่ถูกจองไว้นานเกิน lease (drainer ที่จองตายไปแล้ว)"""
+    now = time.time()
+    for name in names:
+        if not _is_claim_file(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > CLAIM_LEASE_SECONDS:
+                os.rename(path, _original_path(path))
+                metrics.incr("webhook_spool_claims_released_total")
+        except FileNotFoundError:
+            pass
+
+
+def _spool_oa_id(path: str) -> Optional[int]:
+    try:
+        return int(os.path.basename(path).split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _set_aside(claimed: str) -> None:
+    """แยกไฟล์ที่ประมวลผลไม่ได้ไว้ตรวจสอบ (<ชื่อเดิม>.bad)"""
+    with suppress(FileNotFoundError):
+        os.replace(claimed, _original_path(claimed) + ".bad")
+
+
+def _record_attempt(claimed: str, job: dict, attempts: int) -> None:
+    """บันทึกจำนวนครั้งที่ล้มเหลวลงในไฟล์ที่จองอยู่ (เขียน .tmp แล้ว replace เหมือนตอน spool)"""
+    tmp_path = claimed + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**job, "attempts": attempts}, f)
+        os.replace(tmp_path, claimed)
+    except OSError:
+        traceback.print_exc()
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+
+def _drain_file(app: Flask, path: str, line_account_id: Optional[int]) -> bool:
+    """ประมวลผลไฟล์ spool ที่จองแล้ว 1 ไฟล์ คืน False ถ้าควรหยุดรอแล้วลองใหม่"""
+    # import ภายในฟังก์ชันกันวงกลม (routes import service นี้)
+    from app.blueprints.line_webhook.routes import process_inbox_body
+    from app.services import webhook_ingest
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            job = json.load(f)
+    except FileNotFoundError:
+        # lease หมดแล้วถูกคืนให้ drainer อื่น
+        return True
+    except (OSError, ValueError):
+        traceback.print_exc()
+        _set_aside(path)
+        metrics.incr("webhook_spool_errors_total", reason="unreadable")
+        return True
+
+    with app.app_context():
+        try:
+            if webhook_ingest.is_async_enabled(app):
+                webhook_ingest.enqueue(job["line_account_id"], job["body"], job["signature"])
+            else:
+                process_inbox_body(job["line_account_id"], job["body"], job["signature"])
+        except InvalidSignatureError:
+            # channel secret ถูกเปลี่ยนระหว่างที่ไฟล์ค้างอยู่ ลองใหม่ก็ไม่ผ่าน แยกไฟล์ไว้ตรวจสอบ
+            _set_aside(path)
+            metrics.incr("webhook_spool_errors_total", reason="signature")
+        except Exception as e:
+            db.session.rollback()
+            traceback.print_exc()
+            attempts = int(job.get("attempts", 0)) + 1
+            if attempts >= int(app.config.get("WEBHOOK_MAX_ATTEMPTS", 5)):
+                # body นี้ล้มเหลวซ้ำ ๆ แยกออกไปก่อน ไม่ให้ขวาง webhook ถัดไปของ OA นี้ไปตลอด
+                print(f"Giving up on spooled webhook {os.path.basename(path)} after {attempts} attempts: {e}")
+                _set_aside(path)
+                metrics.incr("webhook_spool_errors_total", reason="max_attempts")
+                return True
+            _record_attempt(path, job, attempts)
+            metrics.incr("webhook_spool_errors_total", reason="process")
+            return False
+        else:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            metrics.incr("webhook_spool_replayed_total", oa=line_account_id)
+    return True
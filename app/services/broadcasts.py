@@ -0,0 +1,346 @@
+# app/services/broadcasts.py - ส่งข้อความหา segment ของ LineUser ผ่าน LINE multicast (batch ละไม่เกิน 500) พร้อม checkpoint/resume
+from __future__ import annotations
+
+import json
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import List, Optional
+
+from flask import Flask, current_app
+from linebot.exceptions import LineBotApiError
+from sqlalchemy import insert, or_
+
+from app.extensions import db, socketio
+from app.models import Broadcast, BroadcastBatch, BroadcastRecipient, LineUser
+from app.services import circuit_breaker, metrics, rate_limit, segments
+
+STATUS_RESOLVING = "resolving"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_CANCELLED = "cancelled"
+
+BATCH_PENDING = "pending"
+BATCH_SENT = "sent"
+BATCH_FAILED = "failed"
+
+MESSAGE_TYPES = ("text", "image", "sticker")
+# LINE multicast รับผู้รับได้ไม่เกิน 500 คนต่อครั้ง
+MAX_MULTICAST_RECIPIENTS = 500
+# runner ต่ออายุ heartbeat ทุก batch ถ้าหายไปนานเกินนี้ถือว่าตาย resume ต่อได้
+HEARTBEAT_LEASE = timedelta(minutes=2)
+
+_lock = threading.Lock()
+_recovered = False
+
+
+def create(filters: dict, message: dict, admin_user_id: Optional[int] = None) -> Broadcast:
+    """
+    บันทึก broadcast ใหม่แล้วเริ่ม runner เบื้องหลัง (รายชื่อผู้รับจะถูก resolve ใน runner ไม่ใช่ใน request)
+    message = {'type': 'text', 'text': ...} / {'type': 'image', 'url': ...} / {'type': 'sticker', 'package_id', 'sticker_id'}
+    raise ValueError ถ้าข้อความไม่ครบ
+    """
+    broadcast = build(filters, message, admin_user_id)
+    db.session.add(broadcast)
+    db.session.commit()
+    start(broadcast.id)
+    return broadcast
+
+
+def build(filters: dict, message: dict, admin_user_id: Optional[int] = None) -> Broadcast:
+    """ตรวจข้อความแล้วสร้าง Broadcast (ยังไม่ add/commit) ให้ผู้เรียก commit ร่วมกับงานของตัวเองแล้วค่อย start()"""
+    validate_message(message)
+    return Broadcast(
+        admin_user_id=admin_user_id,
+        filters=json.dumps(filters, ensure_ascii=False),
+        message_type=message.get("type") or "text",
+        message_text=message.get("text"),
+        message_url=message.get("url"),
+        package_id=message.get("package_id"),
+        sticker_id=message.get("sticker_id"),
+        status=STATUS_RESOLVING,
+    )
+
+
+def validate_message(message: dict) -> None:
+    """raise ValueError ถ้าข้อความ (รูปแบบเดียวกับ create) ไม่ครบหรือไม่รองรับ"""
+    message_type = message.get("type") or "text"
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f"Unsupported message type: {message_type}")
+    if message_type == "text" and not (message.get("text") or "").strip():
+        raise ValueError("Missing message text")
+    if message_type == "image" and not message.get("url"):
+        raise ValueError("Missing image url")
+    if message_type == "sticker" and not (message.get("package_id") and message.get("sticker_id")):
+        raise ValueError("Missing sticker")
+
+
+def start(broadcast_id: int) -> None:
+    """เริ่ม (หรือ resume) runner ของ broadcast นี้ ถ้ามี worker อื่นถือ lease อยู่ runner จะออกเอง"""
+    app = current_app._get_current_object()
+    _recover_once(app)
+    socketio.start_background_task(_run, app, broadcast_id)
+
+
+def cancel(broadcast_id: int) -> bool:
+    """หยุด broadcast (batch ที่ยังไม่ส่งคงไว้เป็น pending) คืน False ถ้าจบไปแล้ว"""
+    cancelled = Broadcast.query.filter(
+        Broadcast.id == broadcast_id,
+        Broadcast.status.in_((STATUS_RESOLVING, STATUS_RUNNING)),
+    ).update({"status": STATUS_CANCELLED, "heartbeat_at": None}, synchronize_session=False)
+    db.session.commit()
+    return bool(cancelled)
+
+
+def resume_stalled() -> int:
+    """resume ทุก broadcast ที่ค้าง (process ตาย/รีสตาร์ท) คืนจำนวนที่สั่ง resume"""
+    stale_ids = [
+        broadcast_id for (broadcast_id,) in db.session.query(Broadcast.id).filter(
+            Broadcast.status.in_((STATUS_RESOLVING, STATUS_RUNNING)),
+            _lease_expired(),
+        )
+    ]
+    for broadcast_id in stale_ids:
+        start(broadcast_id)
+    return len(stale_ids)
+
+
+def progress(broadcast: Broadcast) -> dict:
+    pending = broadcast.total_recipients - broadcast.sent_count - broadcast.failed_count
+    return {
+        "id": broadcast.id,
+        "status": broadcast.status,
+        "message_type": broadcast.message_type,
+        "filters": json.loads(broadcast.filters),
+        "total_recipients": broadcast.total_recipients,
+        "skipped_blocked": broadcast.skipped_blocked,
+        "sent": broadcast.sent_count,
+        "failed": broadcast.failed_count,
+        "pending": max(0, pending),
+        "last_error": broadcast.last_error,
+        "created_at": broadcast.created_at.isoformat() if broadcast.created_at else None,
+        "finished_at": broadcast.finished_at.isoformat() if broadcast.finished_at else None,
+    }
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _lease_expired():
+    return or_(Broadcast.heartbeat_at.is_(None), Broadcast.heartbeat_at < _now() - HEARTBEAT_LEASE)
+
+
+def _recover_once(app: Flask) -> None:
+    global _recovered
+    if _recovered:
+        return
+    with _lock:
+        if _recovered:
+            return
+        _recovered = True
+    socketio.start_background_task(_recover, app)
+
+
+def _recover(app: Flask) -> None:
+    with app.app_context():
+        try:
+            resume_stalled()
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+
+
+def _claim(broadcast_id: int) -> bool:
+    """จอง lease ของ broadcast แบบ atomic (กันสอง worker ส่ง batch ซ้ำกัน)"""
+    claimed = Broadcast.query.filter(
+        Broadcast.id == broadcast_id,
+        Broadcast.status.in_((STATUS_RESOLVING, STATUS_RUNNING)),
+        _lease_expired(),
+    ).update({"heartbeat_at": _now()}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def _run(app: Flask, broadcast_id: int) -> None:
+    with app.app_context():
+        try:
+            if not _claim(broadcast_id):
+                return
+            broadcast = db.session.get(Broadcast, broadcast_id)
+            if broadcast.status == STATUS_RESOLVING:
+                _resolve(broadcast)
+            _send_batches(broadcast_id)
+        except Exception as e:
+            db.session.rollback()
+            traceback.print_exc()
+            # ปล่อย lease ไว้ให้หมดอายุเอง แล้ว resume_stalled (cron) จะกลับมาทำต่อจาก batch ล่าสุด
+            Broadcast.query.filter_by(id=broadcast_id).update(
+                {"last_error": f"{type(e).__name__}: {e}"[:2000]}, synchronize_session=False
+            )
+            db.session.commit()
+
+
+def _batch_size() -> int:
+    return max(1, min(MAX_MULTICAST_RECIPIENTS, int(current_app.config.get("BROADCAST_BATCH_SIZE", 500))))
+
+
+def _resolve(broadcast: Broadcast) -> None:
+    """
+    แปลงเงื่อนไขเป็นรายชื่อผู้รับ แบ่ง batch ต่อ OA แล้ว insert แบบ bulk ใน transaction เดียว
+    (crash กลางทาง = ยังเป็น resolving และเริ่ม resolve ใหม่ทั้งก้อน)
+    """
+    filters = json.loads(broadcast.filters)
+    base = segments.user_query(filters)
+    skipped = (
+        base.filter(LineUser.is_blocked == True)
+        .with_entities(LineUser.line_account_id, LineUser.user_id)
+        .distinct()
+        .count()
+    )
+    rows = (
+        base.filter(or_(LineUser.is_blocked == False, LineUser.is_blocked.is_(None)))
+        .with_entities(LineUser.line_account_id, LineUser.user_id)
+        .distinct()
+        .order_by(LineUser.line_account_id, LineUser.user_id)
+        .all()
+    )
+
+    BroadcastRecipient.query.filter_by(broadcast_id=broadcast.id).delete(synchronize_session=False)
+    BroadcastBatch.query.filter_by(broadcast_id=broadcast.id).delete(synchronize_session=False)
+    batch_size = _batch_size()
+    seq = 0
+    total = 0
+    for oa_id, group in groupby(rows, key=lambda row: row[0]):
+        user_ids = [user_id for _, user_id in group]
+        for offset in range(0, len(user_ids), batch_size):
+            chunk = user_ids[offset:offset + batch_size]
+            seq += 1
+            batch = BroadcastBatch(
+                broadcast_id=broadcast.id,
+                line_account_id=oa_id,
+                seq=seq,
+                recipient_count=len(chunk),
+                retry_key=str(uuid.uuid4()),
+            )
+            db.session.add(batch)
+            db.session.flush()
+            db.session.execute(
+                insert(BroadcastRecipient),
+                [
+                    {"broadcast_id": broadcast.id, "batch_id": batch.id, "line_account_id": oa_id, "user_id": user_id}
+                    for user_id in chunk
+                ],
+            )
+            total += len(chunk)
+
+    broadcast.total_recipients = total
+    broadcast.skipped_blocked = skipped
+    broadcast.status = STATUS_RUNNING
+    broadcast.started_at = _now()
+    broadcast.heartbeat_at = _now()
+    db.session.commit()
+    metrics.incr("broadcast_recipients_resolved_total", total)
+
+
+def _send_batches(broadcast_id: int) -> None:
+    # import ภายในฟังก์ชันกันวงกลม
+    from app.services import line_registry, outbound
+
+    max_attempts = int(current_app.config.get("BROADCAST_MAX_ATTEMPTS", 5))
+    while True:
+        broadcast = db.session.get(Broadcast, broadcast_id)
+        db.session.refresh(broadcast)
+        if broadcast.status != STATUS_RUNNING:
+            return
+
+        batch = (
+            BroadcastBatch.query.filter_by(broadcast_id=broadcast_id, status=BATCH_PENDING)
+            .order_by(BroadcastBatch.seq.asc())
+            .first()
+        )
+        if batch is None:
+            broadcast.status = STATUS_COMPLETED
+            broadcast.finished_at = _now()
+            broadcast.heartbeat_at = None
+            db.session.commit()
+            return
+
+        account = line_registry.get_by_id(batch.line_account_id)
+        if account is None:
+            _finish_batch(batch, BATCH_FAILED, "OA not found")
+            continue
+
+        user_ids: List[str] = [
+            user_id for (user_id,) in db.session.query(BroadcastRecipient.user_id).filter_by(batch_id=batch.id)
+        ]
+        try:
+            line_registry.with_retry_key(account.api, batch.retry_key).multicast(
+                user_ids, outbound.build_send_message(broadcast)
+            )
+        except rate_limit.RateLimited as e:
+            # budget multicast ของ OA หมด: รอแล้วส่ง batch เดิม (ไม่นับ attempt)
+            _heartbeat(broadcast_id)
+            socketio.sleep(min(e.retry_after, HEARTBEAT_LEASE.total_seconds() / 2))
+            continue
+        except circuit_breaker.CircuitOpen as e:
+            if e.token_rejected:
+                _finish_batch(batch, BATCH_FAILED, f"LINE OA unavailable: {e.reason}")
+            else:
+                # OA ใช้งานไม่ได้ชั่วคราว: รอ probe แล้วส่ง batch เดิม (ไม่นับ attempt)
+                _heartbeat(broadcast_id)
+                socketio.sleep(min(e.retry_after, HEARTBEAT_LEASE.total_seconds() / 2))
+            continue
+        except LineBotApiError as e:
+            if e.status_code == 409:
+                # retry key นี้ LINE รับไปแล้ว (ส่งสำเร็จก่อน crash)
+                _finish_batch(batch, BATCH_SENT)
+            elif (e.status_code == 429 or e.status_code >= 500) and batch.attempts + 1 < max_attempts:
+                _retry_later(batch, f"LINE API Error: {e.error.message}")
+            else:
+                _finish_batch(batch, BATCH_FAILED, f"LINE API Error: {e.error.message}")
+            continue
+        except Exception as e:
+            db.session.rollback()
+            traceback.print_exc()
+            if batch.attempts + 1 < max_attempts:
+                _retry_later(batch, f"An unexpected error occurred: {str(e)}")
+            else:
+                _finish_batch(batch, BATCH_FAILED, f"An unexpected error occurred: {str(e)}")
+            continue
+        _finish_batch(batch, BATCH_SENT)
+
+
+def _heartbeat(broadcast_id: int) -> None:
+    Broadcast.query.filter_by(id=broadcast_id).update({"heartbeat_at": _now()}, synchronize_session=False)
+    db.session.commit()
+
+
+def _retry_later(batch: BroadcastBatch, error_message: str) -> None:
+    batch.attempts += 1
+    batch.last_error = error_message
+    db.session.commit()
+    metrics.incr("broadcast_batch_retries_total")
+    _heartbeat(batch.broadcast_id)
+    # backoff ต้องสั้นกว่า lease ไม่งั้น worker อื่นจะคิดว่า runner นี้ตายแล้ว
+    socketio.sleep(min(HEARTBEAT_LEASE.total_seconds() / 2, 2 ** batch.attempts))
+
+
+def _finish_batch(batch: BroadcastBatch, status: str, error_message: Optional[str] = None) -> None:
+    """checkpoint: สถานะ batch + ผู้รับทั้ง batch + ตัวนับของ broadcast อยู่ใน commit เดียว"""
+    batch.status = status
+    batch.attempts += 1
+    batch.last_error = error_message
+    if status == BATCH_SENT:
+        batch.sent_at = _now()
+    BroadcastRecipient.query.filter_by(batch_id=batch.id).update({"status": status}, synchronize_session=False)
+    counter = Broadcast.sent_count if status == BATCH_SENT else Broadcast.failed_count
+    values = {counter.key: counter + batch.recipient_count, "heartbeat_at": _now()}
+    if error_message:
+        values["last_error"] = error_message
+    Broadcast.query.filter_by(id=batch.broadcast_id).update(values, synchronize_session=False)
+    db.session.commit()
+    metrics.incr("broadcast_batches_total", status=status)
+    metrics.incr("broadcast_recipients_total", batch.recipient_count, status=status)
@@ -0,0 +1,31 @@
+# app/services/bulk_ops.py - ตัวช่วย INSERT แบบกลุ่ม (ON CONFLICT) ที่ใช้ได้ทั้ง PostgreSQL และ SQLite
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Sequence
+
+from sqlalchemy import insert as generic_insert
+
+from app.services.extensions import db
+
+
+def dialect_insert(table):
+    """คืน insert() ของ dialect ที่ใช้อยู่ เพื่อให้เรียก on_conflict_* ได้ (รับได้ทั้ง Table และ ORM model)"""
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return generic_insert(table)
+    return insert(table)
+
+
+def insert_ignore_conflicts(model, rows: Sequence[Dict[str, Any]], index_elements: Iterable[str]) -> None:
+    """INSERT หลายแถวในคำสั่งเดียว แถวที่ชน unique key จะถูกข้าม (กัน race ระหว่าง request)"""
+    if not rows:
+        return
+    stmt = dialect_insert(model.__table__)
+    if hasattr(stmt, "on_conflict_do_nothing"):
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(index_elements))
+    db.session.execute(stmt, list(rows))
+
@@ -0,0 +1,198 @@
+# app/services/circuit_breaker.py - circuit breaker ต่อ OA: token ถูกเพิกถอน / LINE ล่ม แล้วไม่ต้องรอ round trip ทุกคำขอ
+#
+# closed    -> ส่งตามปกติ นับ error ติดกัน (5xx / network) ครบ CIRCUIT_FAILURE_THRESHOLD หรือเจอ 401 ครั้งเดียว -> open
+# open      -> ทุกคำขอของ OA นี้ raise CircuitOpen ทันที จนพักครบ cooldown
+# half_open -> ปล่อยคำขอเดียวผ่านไปเป็น probe สำเร็จ -> closed, ล้มเหลว -> open (cooldown x2 ไม่เกิน CIRCUIT_MAX_COOLDOWN_SECONDS)
+#
+# ผล health check (oa_checker) เปิด/ปิดวงจรได้ด้วย สถานะอยู่ใน process (process อื่นรับรู้จาก LineAccount ตอนโหลด registry)
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from flask import current_app
+
+from app.services import metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# probe ที่ค้างนานเกินนี้ (เช่น worker ตายกลางคำขอ) ถือว่าหาย ปล่อย probe ใหม่ได้
+PROBE_LEASE_SECONDS = 60.0
+
+
+class CircuitOpen(Exception):
+    """
+    วงจรของ OA เปิดอยู่ ไม่ได้ยิงไป LINE
+    token_rejected = เปิดเพราะ LINE ปฏิเสธ token (ส่งซ้ำไปก็ไม่สำเร็จจนกว่าจะแก้ token) ผู้เรียกควร fail ทันที
+    นอกนั้น (LINE ล่ม/network) ผู้เรียกเลื่อนงานไป retry_after วินาทีได้
+    """
+
+    def __init__(self, line_account_id: int, retry_after: float, reason: Optional[str], token_rejected: bool):
+        super().__init__(f"LINE OA {line_account_id} unavailable ({reason}), retry in {retry_after:.0f}s")
+        self.line_account_id = line_account_id
+        self.retry_after = retry_after
+        self.reason = reason
+        self.token_rejected = token_rejected
+
+
+@dataclass
+class _Breaker:
+    state: str = STATE_CLOSED
+    failures: int = 0  # error ติดกัน
+    opened_at: float = 0.0  # time.monotonic()
+    cooldown: float = 0.0
+    probe_started: Optional[float] = None
+    reason: Optional[str] = None
+    token_rejected: bool = False
+    observed_at: float = 0.0  # time.time() ของผลล่าสุด (กันผล health check เก่าทับผลจริง)
+    opened_total: int = 0
+
+
+_lock = threading.Lock()
+_breakers: Dict[int, _Breaker] = {}
+
+
+def before_request(line_account_id: int) -> None:
+    """raise CircuitOpen ถ้าวงจรเปิดอยู่; พักครบ cooldown แล้วปล่อยคำขอนี้ไปเป็น probe (half-open)"""
+    breaker = _breakers.get(line_account_id)
+    if breaker is None or breaker.state == STATE_CLOSED:
+        return
+    with _lock:
+        now = time.monotonic()
+        if breaker.state == STATE_OPEN:
+            retry_after = breaker.opened_at + breaker.cooldown - now
+            if retry_after <= 0:
+                breaker.state = STATE_HALF_OPEN
+                breaker.probe_started = now
+                metrics.incr("circuit_probes_total", oa=line_account_id)
+                return
+        elif breaker.state == STATE_HALF_OPEN:
+            retry_after = breaker.probe_started + PROBE_LEASE_SECONDS - now
+            if retry_after <= 0:
+                breaker.probe_started = now
+                metrics.incr("circuit_probes_total", oa=line_account_id)
+                return
+        else:
+            return
+        reason, token_rejected = breaker.reason, breaker.token_rejected
+    metrics.incr("circuit_rejected_total", oa=line_account_id)
+    raise CircuitOpen(line_account_id, retry_after, reason, token_rejected)
+
+
+def record_response(line_account_id: int, status_code: int) -> None:
+    """
+    ผลของคำขอที่ได้ response จาก LINE: 401 = token ใช้ไม่ได้, 5xx = LINE ล่ม, 429 ไม่นับ (rate_limit ดูแล)
+    403 อื่น ๆ (เช่น OA ไม่มีสิทธิ์ใช้ API นั้น) เป็น error ของคำขอนั้นเอง token ยังใช้ได้ ไม่เปิดวงจร
+    """
+    if status_code == 401:
+        _record_failure(line_account_id, f"HTTP {status_code}", token_rejected=True)
+    elif status_code >= 500:
+        _record_failure(line_account_id, f"HTTP {status_code}")
+    elif status_code != 429:
+        _record_success(line_account_id)
+
+
+def record_error(line_account_id: int, error: Exception) -> None:
+    """คำขอที่ไม่ได้ response (timeout / connection error)"""
+    _record_failure(line_account_id, type(error).__name__)
+
+
+def record_health(
+    line_account_id: int, token_ok: Optional[bool], reason: Optional[str], checked_at: Optional[datetime]
+) -> None:
+    """
+    ผล health check ของ token (oa_checker หรือค่าใน LineAccount ตอนโหลด registry) None = สรุปไม่ได้ ไม่เปลี่ยนสถานะ
+    ไม่สนผลที่เก่ากว่าสิ่งที่วงจรเห็นเองล่าสุด (เช่น probe สำเร็จหลังจาก health check)
+    """
+    if checked_at is None or token_ok is None:
+        return
+    if checked_at.tzinfo is None:
+        checked_at = checked_at.replace(tzinfo=timezone.utc)
+    checked_ts = checked_at.timestamp()
+    breaker = _breakers.get(line_account_id)
+    if breaker is not None and checked_ts <= breaker.observed_at:
+        return
+    if token_ok:
+        _record_success(line_account_id, observed_at=checked_ts)
+    else:
+        _record_failure(line_account_id, reason or "health check failed", token_rejected=True, observed_at=checked_ts)
+
+
+def reset(line_account_id: int) -> None:
+    """ลืมสถานะของ OA (เช่น แอดมินแก้ token) คำขอถัดไปยิงตามปกติ"""
+    with _lock:
+        _breakers.pop(int(line_account_id), None)
+
+
+def snapshot() -> Dict[int, dict]:
+    """สถานะวงจรต่อ OA ของ process นี้ (OA ที่ไม่มีในนี้ = closed ไม่เคยมี error)"""
+    now = time.monotonic()
+    with _lock:
+        return {
+            line_account_id: {
+                "state": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "reason": breaker.reason,
+                "token_rejected": breaker.token_rejected,
+                "retry_in": (
+                    max(0.0, round(breaker.opened_at + breaker.cooldown - now, 1))
+                    if breaker.state == STATE_OPEN else None
+                ),
+                "opened_total": breaker.opened_total,
+            }
+            for line_account_id, breaker in _breakers.items()
+        }
+
+
+def _record_success(line_account_id: int, observed_at: Optional[float] = None) -> None:
+    breaker = _breakers.get(line_account_id)
+    if breaker is None:
+        return
+    with _lock:
+        if breaker.state != STATE_CLOSED:
+            metrics.incr("circuit_closed_total", oa=line_account_id)
+        breaker.state = STATE_CLOSED
+        breaker.failures = 0
+        breaker.cooldown = 0.0
+        breaker.probe_started = None
+        breaker.reason = None
+        breaker.token_rejected = False
+        breaker.observed_at = observed_at or time.time()
+
+
+def _record_failure(
+    line_account_id: int, reason: str, token_rejected: bool = False, observed_at: Optional[float] = None
+) -> None:
+    threshold = int(current_app.config.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+    base_cooldown = float(current_app.config.get("CIRCUIT_COOLDOWN_SECONDS", 30))
+    max_cooldown = float(current_app.config.get("CIRCUIT_MAX_COOLDOWN_SECONDS", 600))
+    with _lock:
+        breaker = _breakers.setdefault(line_account_id, _Breaker())
+        breaker.failures += 1
+        breaker.observed_at = observed_at or time.time()
+        if breaker.state == STATE_HALF_OPEN:
+            # probe ล้มเหลว: พักนานขึ้นเรื่อย ๆ
+            cooldown = min(max_cooldown, max(base_cooldown, breaker.cooldown * 2))
+        elif breaker.state == STATE_CLOSED and (token_rejected or breaker.failures >= threshold):
+            cooldown = base_cooldown
+        elif breaker.state == STATE_OPEN and token_rejected:
+            # เปิดเพราะ LINE ล่มอยู่แล้ว แต่รู้เพิ่มว่า token ใช้ไม่ได้: ให้ผู้เรียก fail ทันทีแทนการรอ
+            breaker.reason = reason
+            breaker.token_rejected = True
+            return
+        else:
+            # เปิดอยู่แล้ว (คำขอที่ยิงออกไปก่อนวงจรเปิด) หรือยังไม่ครบ threshold
+            return
+        breaker.state = STATE_OPEN
+        breaker.opened_at = time.monotonic()
+        breaker.cooldown = cooldown
+        breaker.probe_started = None
+        breaker.reason = reason
+        breaker.token_rejected = token_rejected
+        breaker.opened_total += 1
+    metrics.incr("circuit_opened_total", oa=line_account_id)
@@ -0,0 +1,334 @@
+# app/services/conversations.py - ดูแลตาราง conversation (read-model ของ sidebar) ให้ตรงกับ line_message / line_user
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import Flask
+from sqlalchemy import bindparam, case, event, func, inspect, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Conversation, LineAccount, LineMessage, LineUser, Tag, tags_users
+from app.services import metrics, summary_cache
+from app.services.bulk_ops import dialect_insert
+
+# ข้อความประเภทนี้เก็บ preview เป็นตัวหนังสือ ประเภทอื่นแสดงเป็น [Image], [Sticker] ฯลฯ
+PREVIEW_TYPES = ("text", "event")
+# ฟิลด์ของ LineUser ที่ต้อง sync ไปยัง conversation
+_SYNCED_USER_FIELDS = ("status", "read_by_admin_id", "last_read_timestamp")
+# ฟิลด์ที่ไม่ได้เก็บใน conversation แต่แสดงใน sidebar (เปลี่ยนแล้วต้องล้าง summary cache)
+_SUMMARY_USER_FIELDS = ("display_name", "nickname", "picture_url", "tags")
+
+_listening = False
+
+
+def status_rank(status: Optional[str]) -> int:
+    """ลำดับใน sidebar: 0 = เปิดอยู่, 1 = closed (อยู่ท้ายรายการ)"""
+    return 1 if (status or "").strip().lower() == "closed" else 0
+
+
+def _preview(message_type: Optional[str], text: Optional[str]) -> Optional[str]:
+    if message_type in PREVIEW_TYPES and text:
+        return text[:255]
+    return None
+
+
+def _as_utc_naive(value: Optional[datetime]) -> datetime:
+    # timestamp ในระบบมีทั้ง utcnow() (naive) และค่า default ที่มี timezone ให้เทียบกันได้
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def record_messages(messages: Iterable[LineMessage], connection=None) -> None:
+    """
+    อัปเดต conversation จากข้อความที่เพิ่ง insert (ทั้งขาเข้าและขาออก)
+    - ข้อความล่าสุดจะถูกแทนที่เมื่อเวลาใหม่กว่าของเดิมเท่านั้น
+    - unread_count (ทั้ง conversation และ LineUser) บวกเพิ่มตามจำนวนข้อความขาเข้า
+    """
+    latest: Dict[Tuple[int, str], LineMessage] = {}
+    inbound: Dict[Tuple[int, str], int] = defaultdict(int)
+    for message in messages:
+        key = (message.line_account_id, message.user_id)
+        current = latest.get(key)
+        if current is None or (_as_utc_naive(message.timestamp), message.id) >= (
+            _as_utc_naive(current.timestamp), current.id
+        ):
+            latest[key] = message
+        if not message.is_outgoing:
+            inbound[key] += 1
+    if not latest:
+        return
+
+    connection = connection or db.session.connection()
+    users = {
+        (oa_id, user_id): (line_user_id, status, read_by_admin_id)
+        for line_user_id, oa_id, user_id, status, read_by_admin_id in connection.execute(
+            select(
+                LineUser.id, LineUser.line_account_id, LineUser.user_id,
+                LineUser.status, LineUser.read_by_admin_id,
+            ).where(tuple_(LineUser.line_account_id, LineUser.user_id).in_(list(latest)))
+        )
+    }
+
+    rows = []
+    for key, message in latest.items():
+        line_user_id, status, read_by_admin_id = users.get(key, (None, "read", None))
+        rows.append({
+            "line_account_id": key[0],
+            "user_id": key[1],
+            "line_user_id": line_user_id,
+            "last_message_id": message.id,
+            "last_message_at": _as_utc_naive(message.timestamp),
+            "last_message_type": message.message_type,
+            "last_message_preview": _preview(message.message_type, message.message_text),
+            "last_message_is_outgoing": bool(message.is_outgoing),
+            "unread_count": inbound.get(key, 0),
+            "status": status or "read",
+            "status_rank": status_rank(status),
+            "read_by_admin_id": read_by_admin_id,
+        })
+    _upsert(connection, rows)
+    _increment_user_unread(connection, users, inbound)
+    summary_cache.mark_dirty(latest)
+
+
+def _increment_user_unread(connection, users, inbound) -> None:
+    """เพิ่ม LineUser.unread_count แบบ atomic (unread_count = unread_count + n) ไม่ต้อง COUNT ใหม่"""
+    params = [
+        {"b_id": users[key][0], "b_n": count}
+        for key, count in inbound.items()
+        if count and key in users
+    ]
+    if not params:
+        return
+    table = LineUser.__table__
+    connection.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(unread_count=table.c.unread_count + bindparam("b_n")),
+        params,
+    )
+
+
+def reconcile_unread_counts(batch_size: int = 500) -> Dict[str, int]:
+    """
+    [cron] นับ unread จริงจาก line_message แล้วซ่อมตัวนับที่คลาดเคลื่อน (ทั้ง conversation และ LineUser)
+    ใช้ compare-and-set กันทับค่าที่ถูกเพิ่มระหว่างที่กำลังนับ
+    """
+    conv = Conversation.__table__
+    line_user = LineUser.__table__
+    message = LineMessage.__table__
+    actual = (
+        select(func.count(message.c.id))
+        .where(
+            message.c.line_account_id == conv.c.line_account_id,
+            message.c.user_id == conv.c.user_id,
+            message.c.is_outgoing.is_(False),
+            or_(
+                line_user.c.last_read_timestamp.is_(None),
+                message.c.timestamp > line_user.c.last_read_timestamp,
+            ),
+        )
+        .scalar_subquery()
+    )
+
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            select(
+                conv.c.id, conv.c.line_account_id, conv.c.user_id, conv.c.unread_count,
+                line_user.c.id, line_user.c.unread_count, actual,
+            )
+            .join(line_user, line_user.c.id == conv.c.line_user_id)
+            .where(conv.c.id > last_id)
+            .order_by(conv.c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        checked += len(batch)
+
+        for conv_id, oa_id, user_id, conv_count, line_user_id, user_count, true_count in batch:
+            if conv_count != true_count:
+                result = db.session.execute(
+                    update(conv)
+                    .where(conv.c.id == conv_id, conv.c.unread_count == conv_count)
+                    .values(unread_count=true_count, cache_version=conv.c.cache_version + 1)
+                )
+                repaired += result.rowcount
+                if result.rowcount:
+                    summary_cache.mark_dirty([(oa_id, user_id)])
+            if user_count != true_count:
+                result = db.session.execute(
+                    update(line_user)
+                    .where(line_user.c.id == line_user_id, line_user.c.unread_count == user_count)
+                    .values(unread_count=true_count)
+                )
+                repaired += result.rowcount
+        db.session.commit()
+
+    metrics.incr("unread_counters_checked_total", checked)
+    metrics.incr("unread_counters_repaired_total", repaired)
+    return {"checked": checked, "repaired": repaired}
+
+
+def _upsert(connection, rows) -> None:
+    table = Conversation.__table__
+    stmt = dialect_insert(table)
+    if not hasattr(stmt, "on_conflict_do_update"):
+        _upsert_row_by_row(connection, rows)
+        return
+
+    excluded = stmt.excluded
+    is_newer = or_(table.c.last_message_at.is_(None), excluded.last_message_at >= table.c.last_message_at)
+
+    def newer(column: str):
+        return case((is_newer, excluded[column]), else_=table.c[column])
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["line_account_id", "user_id"],
+        set_={
+            "line_user_id": func.coalesce(excluded.line_user_id, table.c.line_user_id),
+            "last_message_id": newer("last_message_id"),
+            "last_message_at": newer("last_message_at"),
+            "last_message_type": newer("last_message_type"),
+            "last_message_preview": newer("last_message_preview"),
+            "last_message_is_outgoing": newer("last_message_is_outgoing"),
+            "unread_count": table.c.unread_count + excluded.unread_count,
+            "status": excluded.status,
+            "status_rank": excluded.status_rank,
+            "read_by_admin_id": excluded.read_by_admin_id,
+            "updated_at": func.now(),
+            "cache_version": table.c.cache_version + 1,
+        },
+    )
+    connection.execute(stmt, rows)
+
+
+def _upsert_row_by_row(connection, rows) -> None:
+    """สำรองสำหรับ DB ที่ไม่มี ON CONFLICT (UPDATE ก่อน ไม่เจอค่อย INSERT)"""
+    table = Conversation.__table__
+    for row in rows:
+        is_newer = or_(table.c.last_message_at.is_(None), table.c.last_message_at <= row["last_message_at"])
+        message_fields = {
+            column: case((is_newer, row[column]), else_=table.c[column])
+            for column in ("last_message_id", "last_message_at", "last_message_type",
+                           "last_message_preview", "last_message_is_outgoing")
+        }
+        result = connection.execute(
+            update(table)
+            .where(table.c.line_account_id == row["line_account_id"], table.c.user_id == row["user_id"])
+            .values(
+                **message_fields,
+                unread_count=table.c.unread_count + row["unread_count"],
+                status=row["status"],
+                status_rank=row["status_rank"],
+                read_by_admin_id=row["read_by_admin_id"],
+                updated_at=func.now(),
+                cache_version=table.c.cache_version + 1,
+            )
+        )
+        if not result.rowcount:
+            connection.execute(table.insert().values(**row))
+
+
+def sync_user_state(line_user: LineUser, mark_read: bool = False, connection=None, session=None) -> None:
+    """คัดลอกสถานะ/ผู้อ่านล่าสุดจาก LineUser ไปยัง conversation (mark_read=True จะล้าง unread_count)"""
+    table = Conversation.__table__
+    values = {
+        "status": line_user.status or "read",
+        "status_rank": status_rank(line_user.status),
+        "read_by_admin_id": line_user.read_by_admin_id,
+        "updated_at": func.now(),
+        "cache_version": table.c.cache_version + 1,
+    }
+    if mark_read:
+        values["unread_count"] = 0
+    connection = connection or db.session.connection()
+    connection.execute(
+        update(table)
+        .where(table.c.line_account_id == line_user.line_account_id, table.c.user_id == line_user.user_id)
+        .values(**values)
+    )
+    summary_cache.mark_dirty([(line_user.line_account_id, line_user.user_id)], session)
+
+
+def touch(condition, connection=None, session=None) -> None:
+    """
+    เพิ่ม cache_version ของ conversation ที่ตรงเงื่อนไข (ข้อมูลใน sidebar เปลี่ยนแต่ไม่ได้อยู่ในตาราง conversation
+    เช่น ชื่อ/รูปลูกค้า, tag, ชื่อ OA) เพื่อให้ summary cache ทุก worker โหลดใหม่
+    """
+    table = Conversation.__table__
+    connection = connection or db.session.connection()
+    keys = connection.execute(select(table.c.line_account_id, table.c.user_id).where(condition)).all()
+    if not keys:
+        return
+    connection.execute(
+        update(table)
+        .where(tuple_(table.c.line_account_id, table.c.user_id).in_(keys))
+        .values(cache_version=table.c.cache_version + 1)
+    )
+    summary_cache.mark_dirty(keys, session)
+
+
+def _tag_condition(tag_ids):
+    table = Conversation.__table__
+    return table.c.line_user_id.in_(
+        select(tags_users.c.line_user_id).where(tags_users.c.tag_id.in_(list(tag_ids)))
+    )
+
+
+def _before_flush(session: Session, flush_context, instances) -> None:
+    """tag ที่ถูกลบ: ต้องหา conversation ที่ใช้ tag นี้ก่อนแถวใน tags_users จะถูกลบไปพร้อมกัน"""
+    deleted_tag_ids = [obj.id for obj in session.deleted if isinstance(obj, Tag) and obj.id is not None]
+    if deleted_tag_ids:
+        touch(_tag_condition(deleted_tag_ids), session.connection(), session)
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    """เก็บการเขียนผ่าน ORM ทุกจุด (ส่งข้อความ, log event, เปลี่ยนสถานะ, อ่านแชท) ใน transaction เดียวกัน"""
+    changed_users, touched_user_ids, renamed_oa_ids, edited_tag_ids = [], [], [], []
+    for obj in session.dirty:
+        if isinstance(obj, LineUser):
+            attrs = inspect(obj).attrs
+            if any(attrs[name].history.has_changes() for name in _SYNCED_USER_FIELDS):
+                changed_users.append((obj, attrs.last_read_timestamp.history.has_changes()))
+            elif any(attrs[name].history.has_changes() for name in _SUMMARY_USER_FIELDS):
+                touched_user_ids.append(obj.id)
+        elif isinstance(obj, LineAccount) and inspect(obj).attrs.name.history.has_changes():
+            renamed_oa_ids.append(obj.id)
+        elif isinstance(obj, Tag):
+            attrs = inspect(obj).attrs
+            if attrs.name.history.has_changes() or attrs.color.history.has_changes():
+                edited_tag_ids.append(obj.id)
+    new_messages = [obj for obj in session.new if isinstance(obj, LineMessage)]
+    if not (changed_users or touched_user_ids or renamed_oa_ids or edited_tag_ids or new_messages):
+        return
+
+    connection = session.connection()
+    table = Conversation.__table__
+    for line_user, mark_read in changed_users:
+        sync_user_state(line_user, mark_read=mark_read, connection=connection, session=session)
+    if touched_user_ids:
+        touch(table.c.line_user_id.in_(touched_user_ids), connection, session)
+    if renamed_oa_ids:
+        touch(table.c.line_account_id.in_(renamed_oa_ids), connection, session)
+    if edited_tag_ids:
+        touch(_tag_condition(edited_tag_ids), connection, session)
+    if new_messages:
+        record_messages(new_messages, connection)
+
+
+def init_app(app: Flask) -> None:
+    global _listening
+    if not _listening:
+        event.listen(Session, "before_flush", _before_flush)
+        event.listen(Session, "after_flush", _after_flush)
+        _listening = True
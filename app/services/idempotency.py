@@ -0,0 +1,101 @@
+# app/services/idempotency.py - กัน webhook event ซ้ำ (LINE redelivery) ด้วย LRU ใน memory + unique index ใน DB
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from flask import current_app
+from linebot.models import MessageEvent
+from sqlalchemy import or_
+
+from app.models import LineMessage
+from app.services import metrics
+from app.services.extensions import db
+
+_lock = threading.Lock()
+_seen: "OrderedDict[str, None]" = OrderedDict()
+
+
+def event_keys(event) -> List[str]:
+    """คีย์ idempotency ของ event: webhookEventId และ message id (ถ้าเป็นข้อความ)"""
+    keys = []
+    webhook_event_id = getattr(event, "webhook_event_id", None)
+    if webhook_event_id:
+        keys.append(f"evt:{webhook_event_id}")
+    if isinstance(event, MessageEvent) and getattr(event.message, "id", None):
+        keys.append(f"msg:{event.message.id}")
+    return keys
+
+
+def _is_seen(keys: Iterable[str]) -> bool:
+    with _lock:
+        for key in keys:
+            if key in _seen:
+                _seen.move_to_end(key)
+                return True
+    return False
+
+
+def remember(events) -> None:
+    """จำคีย์ของ event ที่ commit แล้ว (เรียกหลัง commit เท่านั้น)"""
+    max_size = int(current_app.config.get("WEBHOOK_DEDUP_LRU_SIZE", 50000))
+    with _lock:
+        for event in events:
+            for key in event_keys(event):
+                _seen[key] = None
+                _seen.move_to_end(key)
+        while len(_seen) > max_size:
+            _seen.popitem(last=False)
+
+
+def _is_redelivery(event) -> bool:
+    delivery_context = getattr(event, "delivery_context", None)
+    return bool(getattr(delivery_context, "is_redelivery", False))
+
+
+def filter_new_events(line_account_id: int, events) -> list:
+    """
+    ตัด event ที่เคยประมวลผลแล้วออก ก่อนจะไปดึงโปรไฟล์/ไฟล์สื่อ
+    1) เช็ค LRU ใน memory (ไม่ต้องยิง DB)
+    2) เช็ค webhook_event_id / line_message_id ที่มีอยู่แล้วใน line_message ด้วย query เดียว
+    """
+    fresh = []
+    for event in events:
+        metrics.incr("webhook_events_total", oa=line_account_id)
+        if _is_redelivery(event):
+            metrics.incr("webhook_redeliveries_total", oa=line_account_id)
+        if _is_seen(event_keys(event)):
+            metrics.incr("webhook_duplicates_skipped_total", oa=line_account_id, source="lru")
+            continue
+        fresh.append(event)
+
+    event_ids = {getattr(e, "webhook_event_id", None) for e in fresh} - {None}
+    message_ids = {e.message.id for e in fresh if isinstance(e, MessageEvent)}
+    if not event_ids and not message_ids:
+        return fresh
+
+    conditions = []
+    if event_ids:
+        conditions.append(LineMessage.webhook_event_id.in_(event_ids))
+    if message_ids:
+        conditions.append(LineMessage.line_message_id.in_(message_ids))
+    existing_event_ids, existing_message_ids = set(), set()
+    for webhook_event_id, line_message_id in db.session.query(
+        LineMessage.webhook_event_id, LineMessage.line_message_id
+    ).filter(or_(*conditions)):
+        if webhook_event_id:
+            existing_event_ids.add(webhook_event_id)
+        if line_message_id:
+            existing_message_ids.add(line_message_id)
+
+    result = []
+    for event in fresh:
+        message_id: Optional[str] = event.message.id if isinstance(event, MessageEvent) else None
+        if getattr(event, "webhook_event_id", None) in existing_event_ids or (
+            message_id is not None and message_id in existing_message_ids
+        ):
+            metrics.incr("webhook_duplicates_skipped_total", oa=line_account_id, source="db")
+            continue
+        result.append(event)
+    return result
@@ -0,0 +1,197 @@
+# app/services/line_registry.py - cache กลางของ LineAccount + LINE SDK client ต่อ OA (ใช้ร่วมกันทั้ง process)
+from __future__ import annotations
+
+import copy
+import functools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import requests
+from flask import current_app
+from linebot import LineBotApi, WebhookHandler
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from requests.adapters import HTTPAdapter
+
+from app.models import LineAccount
+from app.services import circuit_breaker, oa_checker, rate_limit
+
+_lock = threading.RLock()
+_by_id: Dict[int, "LineClients"] = {}
+_by_path: Dict[str, "LineClients"] = {}
+_http_session: Optional[requests.Session] = None
+
+
+@dataclass(frozen=True)
+class LineClients:
+    """ข้อมูล OA ที่จำเป็นบน hot path พร้อม handler/api ที่สร้างไว้แล้ว"""
+
+    id: int
+    name: str
+    webhook_path: str
+    channel_secret: str
+    channel_access_token: str
+    handler: WebhookHandler
+    api: LineBotApi
+    loaded_at: float
+
+
+def _shared_http_session() -> requests.Session:
+    """requests.Session ตัวเดียวทั้ง process เพื่อ reuse connection (keep-alive) ไปยัง api.line.me"""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                pool_size = int(current_app.config.get("LINE_HTTP_POOL_MAXSIZE", 50))
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                sess.mount("https://", adapter)
+                sess.mount("http://", adapter)
+                _http_session = sess
+    return _http_session
+
+
+class PooledRequestsHttpClient(RequestsHttpClient):
+    """
+    RequestsHttpClient ที่ยิงผ่าน session กลางแทน requests.get/post แบบเปิด connection ใหม่ทุกครั้ง
+    และขอ budget จาก rate_limit ของ OA ก่อนทุกคำขอ (อาจรอ หรือ raise rate_limit.RateLimited)
+    ถ้าวงจรของ OA เปิดอยู่ raise circuit_breaker.CircuitOpen ทันทีโดยไม่ยิงไป LINE
+    """
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, line_account_id: Optional[int] = None):
+        super().__init__(timeout=timeout)
+        self.line_account_id = line_account_id
+
+    def _send(self, method: str, url: str, **kwargs) -> RequestsHttpResponse:
+        endpoint = None
+        if self.line_account_id is not None:
+            circuit_breaker.before_request(self.line_account_id)
+            endpoint = rate_limit.endpoint_for(url)
+            rate_limit.acquire(self.line_account_id, endpoint)
+        timeout = kwargs.pop("timeout", None)
+        try:
+            response = getattr(_shared_http_session(), method)(
+                url, timeout=self.timeout if timeout is None else timeout, **kwargs
+            )
+        except requests.RequestException as e:
+            if endpoint is not None:
+                circuit_breaker.record_error(self.line_account_id, e)
+            raise
+        if endpoint is not None:
+            rate_limit.record_response(self.line_account_id, endpoint, response.status_code)
+            circuit_breaker.record_response(self.line_account_id, response.status_code)
+        return RequestsHttpResponse(response)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._send("get", url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._send("post", url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._send("delete", url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._send("put", url, headers=headers, data=data, timeout=timeout)
+
+
+def _build(account: LineAccount) -> LineClients:
+    # ผล health check ล่าสุดใน DB (อาจมาจาก process อื่น/cron) เปิดวงจรของ process นี้ได้ด้วย
+    token_ok, token_msg = oa_checker.stored_token_verdict(account)
+    circuit_breaker.record_health(account.id, token_ok, token_msg, account.last_check_timestamp)
+    return LineClients(
+        id=account.id,
+        name=account.name,
+        webhook_path=account.webhook_path,
+        channel_secret=account.channel_secret,
+        channel_access_token=account.channel_access_token,
+        handler=WebhookHandler(account.channel_secret),
+        api=LineBotApi(
+            account.channel_access_token,
+            endpoint=current_app.config.get("LINE_API_ENDPOINT") or LineBotApi.DEFAULT_API_ENDPOINT,
+            data_endpoint=current_app.config.get("LINE_API_DATA_ENDPOINT") or LineBotApi.DEFAULT_API_DATA_ENDPOINT,
+            http_client=functools.partial(PooledRequestsHttpClient, line_account_id=account.id),
+        ),
+        loaded_at=time.monotonic(),
+    )
+
+
+def with_retry_key(api: LineBotApi, retry_key: str) -> LineBotApi:
+    """
+    สำเนาตื้นของ api ที่ใส่ X-Line-Retry-Key เฉพาะคำขอนี้
+    (SDK legacy เขียน retry_key ลง self.headers แล้วไม่ลบออก ถ้าส่งผ่าน api กลางตรง ๆ ทุกคำขอหลังจากนั้นของ OA จะติด key เดิมไปด้วย)
+    """
+    scoped = copy.copy(api)
+    scoped.headers = {**api.headers, "X-Line-Retry-Key": retry_key}
+    return scoped
+
+
+def content_transcoding_status(api: LineBotApi, line_message_id: str) -> Optional[str]:
+    """
+    สถานะการเตรียมไฟล์วิดีโอ/เสียงฝั่ง LINE: processing / succeeded / failed
+    (SDK legacy ไม่มีเมธอดนี้ เรียกผ่าน _get ของ api เพื่อให้ผ่าน rate limit + circuit breaker เหมือนคำขออื่น)
+    """
+    response = api._get(
+        f"/v2/bot/message/{line_message_id}/content/transcoding", endpoint=api.data_endpoint
+    )
+    return (response.json or {}).get("status")
+
+
+def _is_fresh(entry: Optional[LineClients]) -> bool:
+    if entry is None:
+        return False
+    # TTL กันกรณีแก้ OA จาก worker process อื่นที่ invalidate ข้าม process ไม่ได้
+    ttl = float(current_app.config.get("LINE_REGISTRY_TTL_SECONDS", 300))
+    return (time.monotonic() - entry.loaded_at) < ttl
+
+
+def _store(account: Optional[LineAccount]) -> Optional[LineClients]:
+    if account is None:
+        return None
+    entry = _build(account)
+    with _lock:
+        _by_id[entry.id] = entry
+        _by_path[entry.webhook_path] = entry
+    return entry
+
+
+def get_by_webhook_path(webhook_path: str) -> Optional[LineClients]:
+    """หา OA จาก webhook_path (ใช้ใน callback) คืน None ถ้าไม่มี"""
+    entry = _by_path.get(webhook_path)
+    if _is_fresh(entry):
+        return entry
+    return _store(LineAccount.query.filter_by(webhook_path=webhook_path).first())
+
+
+def get_by_id(line_account_id) -> Optional[LineClients]:
+    """หา OA จาก id (ใช้ใน route ส่งข้อความ) คืน None ถ้าไม่มี"""
+    try:
+        line_account_id = int(line_account_id)
+    except (TypeError, ValueError):
+        return None
+    entry = _by_id.get(line_account_id)
+    if _is_fresh(entry):
+        return entry
+    return _store(LineAccount.query.get(line_account_id))
+
+
+def invalidate(line_account_id: Optional[int] = None, webhook_path: Optional[str] = None) -> None:
+    """ล้าง cache ของ OA ที่ถูกเพิ่ม/แก้ไข/ลบ"""
+    if line_account_id is not None:
+        # อาจแก้ token แล้ว ให้คำขอถัดไปยิงจริงแทนการรอ probe
+        circuit_breaker.reset(int(line_account_id))
+    with _lock:
+        entry = _by_id.pop(int(line_account_id), None) if line_account_id is not None else None
+        if entry is not None:
+            _by_path.pop(entry.webhook_path, None)
+        if webhook_path is not None:
+            stale = _by_path.pop(webhook_path, None)
+            if stale is not None:
+                _by_id.pop(stale.id, None)
+
+
+def clear() -> None:
+    with _lock:
+        _by_id.clear()
+        _by_path.clear()
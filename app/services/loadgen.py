@@ -0,0 +1,226 @@
+# app/services/loadgen.py - สร้าง/เซ็น/ยิง webhook จำลองของ LINE สำหรับ load test + fake LINE API ในเครื่อง
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+EVENT_KINDS = ("text", "image", "sticker", "follow", "unfollow")
+DEFAULT_EVENT_MIX = {"text": 70, "image": 10, "sticker": 10, "follow": 7, "unfollow": 3}
+
+
+@dataclass
+class TargetAccount:
+    webhook_path: str
+    channel_secret: str
+
+
+@dataclass
+class ReplayReport:
+    latencies_ms: List[float] = field(default_factory=list)
+    query_counts: List[int] = field(default_factory=list)
+    status_counts: Dict[str, int] = field(default_factory=dict)
+    elapsed_seconds: float = 0.0
+
+    def percentile(self, values: Sequence[float], pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[index]
+
+    def summary(self) -> Dict[str, object]:
+        total = sum(self.status_counts.values())
+        return {
+            "requests": total,
+            "status": dict(sorted(self.status_counts.items())),
+            "elapsed_s": round(self.elapsed_seconds, 2),
+            "throughput_rps": round(total / self.elapsed_seconds, 2) if self.elapsed_seconds else 0.0,
+            "latency_ms": {
+                "p50": round(self.percentile(self.latencies_ms, 50), 1),
+                "p95": round(self.percentile(self.latencies_ms, 95), 1),
+                "p99": round(self.percentile(self.latencies_ms, 99), 1),
+                "max": round(max(self.latencies_ms), 1) if self.latencies_ms else 0.0,
+            },
+            "db_queries_per_request": {
+                "mean": round(sum(self.query_counts) / len(self.query_counts), 2) if self.query_counts else None,
+                "p95": self.percentile(self.query_counts, 95) if self.query_counts else None,
+                "max": max(self.query_counts) if self.query_counts else None,
+            },
+        }
+
+
+# ---- สร้าง body ของ webhook ----
+
+def _fake_user_id(index: int) -> str:
+    return "U" + hashlib.md5(f"loadtest-{index}".encode()).hexdigest()
+
+
+def build_event(kind: str, user_id: str, redelivery: bool = False) -> Dict[str, object]:
+    """สร้าง event 1 ตัวตามรูปแบบ webhook จริงของ LINE"""
+    event: Dict[str, object] = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": uuid.uuid4().hex,
+    }
+    message_id = str(random.randint(10 ** 17, 10 ** 18 - 1))
+    if kind == "text":
+        event["message"] = {"id": message_id, "type": "text", "text": f"loadtest {random.randint(1, 10 ** 6)}"}
+    elif kind == "image":
+        event["message"] = {"id": message_id, "type": "image", "contentProvider": {"type": "line"}}
+    elif kind == "sticker":
+        event["message"] = {"id": message_id, "type": "sticker", "packageId": "11537", "stickerId": "52002734"}
+    elif kind in ("follow", "unfollow"):
+        event["type"] = kind
+        if kind == "unfollow":
+            event.pop("replyToken")
+    else:
+        raise ValueError(f"Unknown event kind: {kind}")
+    return event
+
+
+def build_body(user_pool: int, events_per_body: int, mix: Optional[Dict[str, int]] = None) -> str:
+    mix = mix or DEFAULT_EVENT_MIX
+    kinds = random.choices(list(mix), weights=list(mix.values()), k=events_per_body)
+    events = [build_event(kind, _fake_user_id(random.randrange(user_pool))) for kind in kinds]
+    return json.dumps({"destination": "Uloadtest", "events": events}, separators=(",", ":"))
+
+
+def sign(channel_secret: str, body: str) -> str:
+    """X-Line-Signature = base64(HMAC-SHA256(channel_secret, body))"""
+    digest = hmac.new(channel_secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+# ---- ยิง webhook ----
+
+def replay(
+    base_url: str,
+    accounts: Sequence[TargetAccount],
+    total_requests: int,
+    rate_per_second: float,
+    concurrency: int,
+    user_pool: int = 1000,
+    events_per_body: int = 3,
+    timeout: float = 10.0,
+    ingest_mode: Optional[str] = "sync",
+) -> ReplayReport:
+    """
+    ยิง webhook ที่เซ็นแล้วตามอัตราที่กำหนด แล้วเก็บ latency / status / จำนวน query ต่อ request
+    ingest_mode="sync" ขอให้ server ประมวลผลใน request (X-DB-Query-Count นับ query ของการประมวลผลทั้งหมด)
+    None = ใช้โหมดของ server (ถ้า async จำนวน query จะนับแค่การเขียนลงคิว)
+    """
+    if not accounts:
+        raise ValueError("No LineAccount to target")
+
+    report = ReplayReport()
+    report_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(concurrency)
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=concurrency))
+    session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+    base_url = base_url.rstrip("/")
+
+    def _send(account: TargetAccount) -> None:
+        try:
+            body = build_body(user_pool, events_per_body)
+            headers = {"Content-Type": "application/json", "X-Line-Signature": sign(account.channel_secret, body)}
+            if ingest_mode:
+                headers["X-Loadtest-Ingest-Mode"] = ingest_mode
+            started = time.perf_counter()
+            try:
+                resp = session.post(f"{base_url}/{account.webhook_path}/callback", data=body.encode("utf-8"),
+                                    headers=headers, timeout=timeout)
+                status = str(resp.status_code)
+                query_count = resp.headers.get("X-DB-Query-Count")
+            except requests.RequestException as e:
+                status, query_count = type(e).__name__, None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with report_lock:
+                report.latencies_ms.append(elapsed_ms)
+                report.status_counts[status] = report.status_counts.get(status, 0) + 1
+                if query_count is not None:
+                    report.query_counts.append(int(query_count))
+        finally:
+            in_flight.release()
+
+    interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total_requests):
+            if interval:
+                delay = started_at + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_flight.acquire()
+            pool.submit(_send, accounts[i % len(accounts)])
+    report.elapsed_seconds = time.perf_counter() - started_at
+    return report
+
+
+# ---- fake LINE API (profile / content / push) ----
+
+class _FakeLineHandler(BaseHTTPRequestHandler):
+    image_bytes = b""
+    latency_seconds = 0.0
+
+    def log_message(self, format, *args):  # ปิด log ต่อ request ของ http.server
+        return
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/v2/bot/profile/"):
+            user_id = path.rsplit("/", 1)[-1]
+            profile = {"userId": user_id, "displayName": f"Load {user_id[-6:]}", "pictureUrl": None}
+            self._reply(200, json.dumps(profile).encode())
+        elif path.startswith("/v2/bot/message/") and path.endswith("/content/transcoding"):
+            self._reply(200, b'{"status":"succeeded"}')
+        elif path.startswith("/v2/bot/message/") and path.endswith("/content"):
+            self._reply(200, self.image_bytes, "image/jpeg")
+        elif path == "/v2/bot/info":
+            self._reply(200, b'{"userId":"Uloadtest","basicId":"@loadtest"}')
+        else:
+            self._reply(404, b'{"message":"Not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self._reply(200, b"{}")
+
+
+def start_fake_line_api(port: int, image_kb: int = 200, latency_ms: int = 0) -> ThreadingHTTPServer:
+    """สตาร์ท fake LINE API บน thread แยก (ให้แอปชี้ LINE_API_ENDPOINT / LINE_API_DATA_ENDPOINT มาที่นี่)"""
+    handler = type("FakeLineHandler", (_FakeLineHandler,), {
+        "image_bytes": random.randbytes(image_kb * 1024),
+        "latency_seconds": latency_ms / 1000.0,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,262 @@
+# app/services/media_pipeline.py - ดึงไฟล์สื่อขาเข้าจาก LINE แล้ว stream ขึ้น S3 นอก request
+from __future__ import annotations
+
+import mimetypes
+import os
+import queue
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from typing import Dict
+
+from flask import Flask, current_app
+from linebot.exceptions import LineBotApiError
+
+from app.extensions import db, socketio
+from app.models import LineMessage
+from app.services import circuit_breaker, oa_rooms, rate_limit, room_events, s3_client
+
+MEDIA_PENDING = "pending"
+MEDIA_PROCESSING = "processing"
+MEDIA_READY = "ready"
+MEDIA_FAILED = "failed"
+
+# วิดีโอ/เสียงที่ LINE ยังแปลงไฟล์ไม่เสร็จ ดาวน์โหลดไม่ได้จนกว่าสถานะจะเป็น succeeded
+_TRANSCODED_TYPES = ("video", "audio")
+
+_lock = threading.Lock()
+_queue: "queue.Queue[tuple[int, int]]" = queue.Queue()
+_started = False
+# จำนวนครั้งที่รอ LINE แปลงไฟล์ของแต่ละข้อความ (ไม่นับเป็น attempt ของการดาวน์โหลด)
+_transcoding_polls: Dict[int, int] = {}
+
+
+class _StillTranscoding(Exception):
+    pass
+
+
+def init_app(app: Flask) -> None:
+    """สตาร์ท worker และกู้งานค้างตอน request แรก (ไม่สตาร์ทตอนรันคำสั่ง CLI)"""
+
+    @app.before_request
+    def _start_media_workers():
+        _ensure_workers(app)
+
+
+def submit(message_id: int) -> None:
+    """ส่ง LineMessage ที่เป็น placeholder (media_status=pending) ให้ worker ไปดึงไฟล์"""
+    _ensure_workers(current_app._get_current_object())
+    _queue.put((message_id, 1))
+
+
+def _ensure_workers(app: Flask) -> None:
+    """สตาร์ท worker หลายตัว เพื่อให้รูปหลายรูปใน batch เดียวดาวน์โหลดพร้อมกันได้"""
+    global _started
+    if _started:
+        return
+    with _lock:
+        if _started:
+            return
+        for _ in range(max(1, int(app.config.get("MEDIA_WORKER_COUNT", 4)))):
+            socketio.start_background_task(_worker_loop, app)
+        socketio.start_background_task(_recover_loop, app)
+        _started = True
+
+
+def _worker_loop(app: Flask) -> None:
+    while True:
+        message_id, attempt = _queue.get()
+        with app.app_context():
+            try:
+                _process(message_id)
+            except _StillTranscoding:
+                _wait_for_transcoding(message_id, attempt)
+            except rate_limit.RateLimited as e:
+                # budget ของ OA หมด: ลองใหม่ภายหลังโดยไม่นับ attempt
+                db.session.rollback()
+                _release(message_id)
+                socketio.start_background_task(_retry_later, message_id, attempt, e.retry_after)
+            except circuit_breaker.CircuitOpen as e:
+                db.session.rollback()
+                if e.token_rejected:
+                    _handle_failure(message_id, attempt, e)
+                else:
+                    # OA ใช้งานไม่ได้ชั่วคราว: รอหลัง cooldown โดยไม่นับ attempt
+                    _release(message_id)
+                    socketio.start_background_task(_retry_later, message_id, attempt, e.retry_after)
+            except Exception as e:
+                db.session.rollback()
+                traceback.print_exc()
+                _handle_failure(message_id, attempt, e)
+
+
+def _recover_loop(app: Flask) -> None:
+    """
+    ตอนสตาร์ท: ส่งงาน pending ที่ค้างจากรอบก่อนกลับเข้าคิว
+    หลังจากนั้น: คืนงานที่ lease หมด (worker/process ตายระหว่างดาวน์โหลด) ทุก MEDIA_CLAIM_LEASE_SECONDS
+    """
+    lease_seconds = float(app.config.get("MEDIA_CLAIM_LEASE_SECONDS", 600))
+    _recover_pending(app, include_pending=True)
+    while True:
+        socketio.sleep(lease_seconds)
+        _recover_pending(app, include_pending=False)
+
+
+def _recover_pending(app: Flask, include_pending: bool) -> None:
+    with app.app_context():
+        try:
+            stale_before = datetime.utcnow() - timedelta(
+                seconds=float(current_app.config.get("MEDIA_CLAIM_LEASE_SECONDS", 600))
+            )
+            expired = (LineMessage.media_status == MEDIA_PROCESSING) & (LineMessage.media_claimed_at < stale_before)
+            condition = (LineMessage.media_status == MEDIA_PENDING) | expired if include_pending else expired
+            pending_ids = [
+                message_id for (message_id,) in db.session.query(LineMessage.id)
+                .filter(condition)
+                .order_by(LineMessage.id.asc())
+                .limit(1000)
+            ]
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            return
+    # งานที่ process อื่นกำลังทำอยู่จะจองไม่ได้ (_claim) จึงไม่ถูกดาวน์โหลดซ้ำ
+    for message_id in pending_ids:
+        _queue.put((message_id, 1))
+
+
+def _claim(message_id: int) -> bool:
+    """จองงานแบบ atomic: pending (หรือ processing ที่ lease หมด) -> processing คืน False ถ้ามีคนอื่นจองไป/เสร็จไปแล้ว"""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=float(current_app.config.get("MEDIA_CLAIM_LEASE_SECONDS", 600)))
+    claimed = (
+        LineMessage.query.filter(
+            LineMessage.id == message_id,
+            (LineMessage.media_status == MEDIA_PENDING)
+            | ((LineMessage.media_status == MEDIA_PROCESSING) & (LineMessage.media_claimed_at < stale_before)),
+        )
+        .update(
+            {"media_status": MEDIA_PROCESSING, "media_claimed_at": now},
+            synchronize_session=False,
+        )
+    )
+    db.session.commit()
+    return bool(claimed)
+
+
+def _release(message_id: int, status: str = MEDIA_PENDING) -> None:
+    """คืนงานที่จองไว้ (ลองใหม่ภายหลัง) หรือปิดเป็น failed"""
+    LineMessage.query.filter_by(id=message_id, media_status=MEDIA_PROCESSING).update(
+        {"media_status": status, "media_claimed_at": None}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _process(message_id: int) -> None:
+    # import ภายในฟังก์ชันกันวงกลม
+    from app.blueprints.chats.routes import format_message_for_api
+    from app.services import line_registry
+
+    if not _claim(message_id):
+        return
+    message = db.session.get(LineMessage, message_id)
+    if message is None or not message.line_message_id:
+        return
+
+    account = line_registry.get_by_id(message.line_account_id)
+    if account is None:
+        _release(message_id, MEDIA_FAILED)
+        return
+
+    if message.message_type in _TRANSCODED_TYPES:
+        _check_transcoding(account, message)
+
+    chunk_size = int(current_app.config.get("MEDIA_STREAM_CHUNK_BYTES", 256 * 1024))
+    content = account.api.get_message_content(message.line_message_id)
+    content_type = (content.content_type or "application/octet-stream").split(";")[0].strip()
+    ext = _file_extension(message.file_name) or mimetypes.guess_extension(content_type) or ".bin"
+
+    # นับขนาดระหว่าง stream (ไม่ต้องถือไฟล์ทั้งก้อนไว้ใน memory)
+    size = 0
+
+    def counted(chunks):
+        nonlocal size
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+    url, key = s3_client.upload_stream(
+        counted(content.iter_content(chunk_size=chunk_size)),
+        f"{message.line_message_id}{ext}",
+        content_type,
+    )
+
+    message.message_url = url
+    message.media_key = key
+    message.media_content_type = content_type
+    message.media_size = size
+    message.media_status = MEDIA_READY
+    message.media_claimed_at = None
+    db.session.commit()
+    with _lock:
+        _transcoding_polls.pop(message_id, None)
+
+    payload = format_message_for_api(message)
+    room_events.emit("message_updated", payload, to=oa_rooms.rooms_for(message.line_account_id))
+
+
+def _check_transcoding(account, message: LineMessage) -> None:
+    """raise _StillTranscoding ถ้า LINE ยังแปลงวิดีโอ/เสียงไม่เสร็จ, raise RuntimeError ถ้าแปลงไม่สำเร็จ"""
+    from app.services import line_registry
+
+    try:
+        status = line_registry.content_transcoding_status(account.api, message.line_message_id)
+    except LineBotApiError as e:
+        if e.status_code == 429 or e.status_code >= 500:
+            raise
+        # ข้อความที่ไม่มีสถานะให้ตรวจ ลองดาวน์โหลดตรง ๆ
+        return
+    if status == "processing":
+        raise _StillTranscoding()
+    if status == "failed":
+        raise RuntimeError("LINE could not transcode the content")
+
+
+def _wait_for_transcoding(message_id: int, attempt: int) -> None:
+    """รอ LINE แปลงไฟล์ทุก MEDIA_TRANSCODING_POLL_SECONDS ไม่เกิน MEDIA_TRANSCODING_MAX_WAIT_SECONDS"""
+    poll_seconds = float(current_app.config.get("MEDIA_TRANSCODING_POLL_SECONDS", 10))
+    max_wait = float(current_app.config.get("MEDIA_TRANSCODING_MAX_WAIT_SECONDS", 900))
+    with _lock:
+        polls = _transcoding_polls[message_id] = _transcoding_polls.get(message_id, 0) + 1
+    if polls * poll_seconds > max_wait:
+        with _lock:
+            _transcoding_polls.pop(message_id, None)
+        print(f"Media download failed for message {message_id}: still transcoding after {max_wait:.0f}s")
+        _release(message_id, MEDIA_FAILED)
+        return
+    _release(message_id)
+    socketio.start_background_task(_retry_later, message_id, attempt, poll_seconds)
+
+
+def _file_extension(file_name) -> str:
+    return os.path.splitext(file_name)[1].lower() if file_name else ""
+
+
+def _handle_failure(message_id: int, attempt: int, error: Exception) -> None:
+    max_attempts = int(current_app.config.get("MEDIA_MAX_ATTEMPTS", 3))
+    if attempt < max_attempts:
+        _release(message_id)
+        socketio.start_background_task(_retry_later, message_id, attempt + 1, min(30, 2 ** attempt))
+        return
+
+    print(f"Media download failed for message {message_id}: {error}")
+    with _lock:
+        _transcoding_polls.pop(message_id, None)
+    _release(message_id, MEDIA_FAILED)
+
+
+def _retry_later(message_id: int, attempt: int, delay_seconds: float) -> None:
+    socketio.sleep(delay_seconds)
+    _queue.put((message_id, attempt))
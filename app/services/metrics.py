@@ -0,0 +1,36 @@
+# app/services/metrics.py - ตัวนับ/เกจแบบ in-process สำหรับดูสถานะระบบ (แยกตาม worker process)
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+
+
+def _key(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    joined = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{joined}}}"
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    """เพิ่มค่า counter (เช่น incr('webhook_events_total', oa=3))"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """ตั้งค่า gauge ณ เวลาปัจจุบัน (เช่น ความยาวคิว)"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
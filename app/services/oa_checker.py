@@ -4,6 +4,12 @@ import os
 import requests
 from requests.adapters import HTTPAdapter, Retry
 from app.extensions import db  # เผื่อในอนาคตใช้ commit ภายใน service (ตอนนี้ไม่จำเป็น)
+from app.services import circuit_breaker, rate_limit
+
+# health check เป็นงานที่แอดมินสั่ง ยอมรอ budget นานกว่าปกติแทนการรายงานว่า OA ใช้งานไม่ได้
+RATE_LIMIT_MAX_WAIT_SECONDS = 30
+# ผลตรวจ token ที่แปลว่า LINE ไม่รับ token นี้ (ไม่ใช่ปัญหาเครือข่าย/rate limit ชั่วคราว)
+_TOKEN_REJECTED_PREFIXES = ("Channel Access Token is missing", "API Error 401", "API Error 403")
 
 def _requests_session(timeout=(5, 10)):
     """
@@ -23,6 +29,14 @@ def _requests_session(timeout=(5, 10)):
     sess.request_timeout = timeout
     return sess
 
+def _limited_get(sess, account, url, headers):
+    """GET ไป LINE โดยใช้ budget กลุ่ม info ของ OA เดียวกับคำขออื่นใน rate_limit"""
+    endpoint = rate_limit.endpoint_for(url)
+    rate_limit.acquire(account.id, endpoint, max_wait=RATE_LIMIT_MAX_WAIT_SECONDS)
+    resp = sess.get(url, headers=headers, timeout=sess.request_timeout)
+    rate_limit.record_response(account.id, endpoint, resp.status_code)
+    return resp
+
 def check_single_oa_status(account):
     """
     ตรวจสอบสถานะ Token กับ LINE Messaging API (SYNC)
@@ -37,7 +51,7 @@ def check_single_oa_status(account):
 
     sess = _requests_session()
     try:
-        resp = sess.get(api_url, headers=headers, timeout=sess.request_timeout)
+        resp = _limited_get(sess, account, api_url, headers)
         if resp.status_code == 200:
             return True, "OK"
         else:
@@ -47,6 +61,8 @@ def check_single_oa_status(account):
             except Exception:
                 err = resp.text[:200] if resp.text else "Unknown API Error"
             return False, f"API Error {resp.status_code}: {err}"
+    except rate_limit.RateLimited as e:
+        return False, f"Rate limited: retry in {e.retry_after:.0f}s"
     except requests.RequestException as e:
         return False, f"Network Error: {type(e).__name__}"
 
@@ -76,7 +92,7 @@ def check_single_oa_webhook(account):
 
     sess = _requests_session()
     try:
-        resp = sess.get(line_api_url, headers=headers, timeout=sess.request_timeout)
+        resp = _limited_get(sess, account, line_api_url, headers)
         if resp.status_code == 200:
             # ตัวอย่างตามโค้ดเดิมของคุณ: คาดว่าได้ {"active": bool, "endpoint": "..."}
             try:
@@ -105,14 +121,33 @@ def check_single_oa_webhook(account):
                 err = resp.text[:200] if resp.text else "Unknown API Error"
             return False, f"API Error {resp.status_code}: {err}"
 
+    except rate_limit.RateLimited as e:
+        return False, f"Rate limited: retry in {e.retry_after:.0f}s"
     except requests.RequestException as e:
         return False, f"Network Error: {type(e).__name__}"
 
+def token_verdict(token_msg):
+    """True = LINE รับ token, False = ปฏิเสธ token, None = สรุปไม่ได้ (network / rate limit)"""
+    if token_msg == "OK":
+        return True
+    if (token_msg or "").startswith(_TOKEN_REJECTED_PREFIXES):
+        return False
+    return None
+
+def stored_token_verdict(account):
+    """อ่านผลตรวจ token ล่าสุดจาก last_check_status_message ("Token: ..., Webhook: ...") คืน (verdict, ข้อความ)"""
+    message = account.last_check_status_message or ""
+    if not message.startswith("Token: "):
+        return None, None
+    token_msg = message[len("Token: "):].split(", Webhook: ")[0]
+    return token_verdict(token_msg), token_msg
+
 def run_full_health_check(account):
     """
     ฟังก์ชันหลักสำหรับเรียกตรวจสอบ OA (SYNC) และอัปเดตข้อมูลลงใน object (แต่ไม่ commit)
     - รวมผล Token + Webhook
     - อัปเดต: is_active, last_check_status_message, last_check_timestamp
+    - แจ้งผลตรวจ token ให้ circuit_breaker ของ OA
     """
     token_ok, token_msg = check_single_oa_status(account)
     webhook_ok, webhook_msg = check_single_oa_webhook(account)
@@ -124,6 +159,9 @@ def run_full_health_check(account):
 
     account.last_check_timestamp = datetime.now(timezone.utc)
 
+    # token ถูกปฏิเสธ -> เปิดวงจรของ OA (ข้อความขาออก fail ทันที), token ใช้ได้ -> ปิดวงจร
+    circuit_breaker.record_health(account.id, token_verdict(token_msg), token_msg, account.last_check_timestamp)
+
     print(
         f"  -> Health check for '{account.name}' completed. "
         f"Overall Status: {'Active' if account.is_active else 'Inactive'}"
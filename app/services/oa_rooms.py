@@ -0,0 +1,55 @@
+# app/services/oa_rooms.py - cache กลางของ OA -> ห้อง group_{id} ที่ต้องส่ง event ไป (ไม่ต้องแตะ DB ทุกครั้งที่ emit)
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from app.extensions import db
+from app.models import oa_group_association
+
+_lock = threading.Lock()
+_rooms_by_oa: Optional[Dict[int, Tuple[str, ...]]] = None
+_loaded_at = 0.0
+
+
+def room_name(group_id: int) -> str:
+    return f"group_{group_id}"
+
+
+def _is_fresh() -> bool:
+    if _rooms_by_oa is None:
+        return False
+    # TTL กันกรณีแก้กลุ่มจาก worker process อื่นที่ invalidate ข้าม process ไม่ได้
+    ttl = float(current_app.config.get("OA_ROOMS_TTL_SECONDS", 60))
+    return (time.monotonic() - _loaded_at) < ttl
+
+
+def _load() -> Dict[int, Tuple[str, ...]]:
+    """โหลดตาราง oa_group_association ทั้งหมดใน query เดียว (ตารางเล็ก: จำนวน OA x กลุ่ม)"""
+    global _rooms_by_oa, _loaded_at
+    mapping: Dict[int, List[str]] = {}
+    rows = db.session.query(
+        oa_group_association.c.line_account_id, oa_group_association.c.oa_group_id
+    ).order_by(oa_group_association.c.oa_group_id)
+    for line_account_id, group_id in rows:
+        mapping.setdefault(line_account_id, []).append(room_name(group_id))
+    with _lock:
+        _rooms_by_oa = {oa_id: tuple(rooms) for oa_id, rooms in mapping.items()}
+        _loaded_at = time.monotonic()
+        return _rooms_by_oa
+
+
+def rooms_for(line_account_id) -> Tuple[str, ...]:
+    """ชื่อห้อง group_{id} ของทุกกลุ่มที่ OA นี้สังกัด (ไม่ซ้ำ เรียงตาม id กลุ่ม)"""
+    mapping = _rooms_by_oa if _is_fresh() else _load()
+    return mapping.get(int(line_account_id), ())
+
+
+def invalidate() -> None:
+    """ล้าง cache หลังเพิ่ม/แก้/ลบ OA หรือกลุ่ม (โหลดใหม่ทั้งก้อนตอนใช้ครั้งถัดไป)"""
+    global _rooms_by_oa
+    with _lock:
+        _rooms_by_oa = None
@@ -0,0 +1,297 @@
+# app/services/outbound.py - คิวส่งข้อความขาออก: บันทึกลง DB เป็น pending ก่อน แล้วให้ worker ส่งไป LINE เบื้องหลัง
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from flask import Flask, current_app
+from linebot.exceptions import LineBotApiError
+from linebot.models import AudioSendMessage, ImageSendMessage, StickerSendMessage, TextSendMessage
+from sqlalchemy import or_
+
+from app.extensions import db, socketio
+from app.models import LineMessage
+from app.services import circuit_breaker, metrics, oa_rooms, rate_limit, room_events
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# worker จองข้อความไว้นานเท่านี้ ถ้าตายระหว่างส่ง worker อื่น (หรือตอนรีสตาร์ท) จะหยิบไปส่งต่อ
+# ส่งซ้ำได้ปลอดภัยเพราะใช้ retry key เดิม (LINE ตอบ 409 ถ้าเคยรับไปแล้ว)
+CLAIM_LEASE = timedelta(minutes=2)
+
+_AUDIO_TYPES = ("audio/mp4", "audio/x-m4a", "audio/m4a")
+
+_lock = threading.Lock()
+_shards: List[queue.Queue] = []
+# OA ที่ข้อความหัวคิวกำลังรอ backoff อยู่ (มี task รอ dispatch แล้ว ไม่ต้องตั้งซ้ำ)
+_waiting: Set[int] = set()
+
+
+def init_app(app: Flask) -> None:
+    """สตาร์ท worker pool ตอน request แรก (ไม่สตาร์ทตอนรันคำสั่ง CLI) ให้ข้อความค้างจากรอบก่อนถูกส่งโดยไม่ต้องรอข้อความใหม่"""
+
+    @app.before_request
+    def _start_outbound_workers():
+        _ensure_workers(app)
+
+
+def prepare(message: LineMessage) -> None:
+    """ตั้งสถานะ pending + retry key ให้ข้อความขาออกก่อน commit (แล้วค่อยเรียก submit หลัง commit)"""
+    message.send_status = STATUS_PENDING
+    message.send_attempts = 0
+    message.send_next_at = None
+    message.send_retry_key = str(uuid.uuid4())
+
+
+def submit(line_account_id: int) -> None:
+    """ปลุก worker ของ OA นี้ให้ส่งข้อความ pending ที่ commit แล้ว (ตามลำดับ id)"""
+    _ensure_workers(current_app._get_current_object())
+    _dispatch(int(line_account_id))
+
+
+def build_send_message(message: LineMessage):
+    """
+    สร้าง SendMessage จากแถว LineMessage (ไม่ต้องเก็บ payload แยก):
+    - รูป -> ImageSendMessage, เสียง m4a ที่รู้ความยาว -> AudioSendMessage
+    - นอกนั้น (วิดีโอที่ไม่มีภาพ preview, PDF ฯลฯ) LINE bot ส่งเป็นไฟล์ไม่ได้ จึงส่งเป็นลิงก์แทน
+    """
+    if message.message_type == "text":
+        return TextSendMessage(text=message.message_text)
+    if message.message_type == "sticker":
+        return StickerSendMessage(package_id=message.package_id, sticker_id=message.sticker_id)
+    url = message.message_url
+    if message.message_type == "image":
+        return ImageSendMessage(original_content_url=url, preview_image_url=url)
+    if (
+        message.message_type == "audio"
+        and message.media_duration_ms
+        and message.media_content_type in _AUDIO_TYPES
+    ):
+        return AudioSendMessage(original_content_url=url, duration=message.media_duration_ms)
+    return TextSendMessage(text=f"{message.file_name}\n{url}")
+
+
+def _dispatch(line_account_id: int) -> None:
+    # OA เดียวกันตกอยู่ shard เดิมเสมอ ข้อความจึงออกตามลำดับที่แอดมินกดส่ง
+    _shards[line_account_id % len(_shards)].put(line_account_id)
+    _publish_queue_depth()
+
+
+def _publish_queue_depth() -> None:
+    metrics.set_gauge("outbound_queue_depth", sum(inbox.qsize() for inbox in _shards))
+
+
+def _ensure_workers(app: Flask) -> None:
+    """สตาร์ท worker pool และรอบกวาดข้อความค้าง (ครั้งเดียวต่อ process)"""
+    if _shards:
+        return
+    with _lock:
+        if _shards:
+            return
+        count = max(1, int(app.config.get("OUTBOUND_WORKER_COUNT", 4)))
+        shards = [queue.Queue() for _ in range(count)]
+        for inbox in shards:
+            socketio.start_background_task(_worker_loop, app, inbox)
+        _shards.extend(shards)
+        socketio.start_background_task(_sweep_loop, app)
+
+
+def _worker_loop(app: Flask, inbox: queue.Queue) -> None:
+    while True:
+        line_account_id = inbox.get()
+        _publish_queue_depth()
+        try:
+            with app.app_context():
+                _drain_account(line_account_id)
+        except Exception:
+            traceback.print_exc()
+
+
+def _sweep_loop(app: Flask) -> None:
+    interval = float(app.config.get("OUTBOUND_SWEEP_SECONDS", 30))
+    while True:
+        _recover_pending(app)
+        socketio.sleep(interval)
+
+
+def _recover_pending(app: Flask) -> None:
+    """
+    ส่ง OA ที่มีข้อความถึงเวลาส่งกลับเข้าคิว: pending ที่ backoff ครบแล้ว และ sending ที่ lease หมด (worker/process ตาย)
+    รันทุก OUTBOUND_SWEEP_SECONDS จึงครอบคลุม timer backoff ที่หายไปตอนรีสตาร์ทด้วย
+    """
+    with app.app_context():
+        try:
+            now = datetime.utcnow()
+            account_ids = [
+                oa_id for (oa_id,) in db.session.query(LineMessage.line_account_id)
+                .filter(
+                    LineMessage.send_status.in_((STATUS_PENDING, STATUS_SENDING)),
+                    or_(LineMessage.send_next_at.is_(None), LineMessage.send_next_at <= now),
+                )
+                .distinct()
+            ]
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            return
+
+    for oa_id in account_ids:
+        _dispatch(oa_id)
+
+
+def _claim_next(line_account_id: int) -> Tuple[Optional[int], float]:
+    """
+    จองข้อความหัวคิวของ OA แบบ atomic คืน (id, 0)
+    ถ้าหัวคิวยังไม่ถึงเวลา (backoff / worker อื่นจองอยู่) คืน (None, วินาทีที่ต้องรอ) ไม่ข้ามไปส่งข้อความถัดไปเพื่อรักษาลำดับ
+    """
+    while True:
+        head = (
+            db.session.query(LineMessage.id, LineMessage.send_attempts, LineMessage.send_next_at)
+            .filter(
+                LineMessage.line_account_id == line_account_id,
+                LineMessage.send_status.in_((STATUS_PENDING, STATUS_SENDING)),
+            )
+            .order_by(LineMessage.id.asc())
+            .first()
+        )
+        if head is None:
+            return None, 0.0
+
+        now = datetime.utcnow()
+        if head.send_next_at is not None and head.send_next_at > now:
+            return None, (head.send_next_at - now).total_seconds()
+
+        # เทียบ send_attempts ด้วย กันสอง worker (คนละ process) จองแถวเดียวกัน
+        claimed = (
+            LineMessage.query.filter(
+                LineMessage.id == head.id,
+                LineMessage.send_attempts == head.send_attempts,
+                or_(LineMessage.send_next_at.is_(None), LineMessage.send_next_at <= now),
+            )
+            .update(
+                {
+                    "send_status": STATUS_SENDING,
+                    "send_attempts": LineMessage.send_attempts + 1,
+                    "send_next_at": now + CLAIM_LEASE,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        if claimed:
+            return head.id, 0.0
+
+
+def _drain_account(line_account_id: int) -> None:
+    while True:
+        message_id, wait_seconds = _claim_next(line_account_id)
+        if message_id is None:
+            if wait_seconds > 0:
+                _redispatch_later(line_account_id, wait_seconds)
+            return
+        _deliver(message_id)
+
+
+def _deliver(message_id: int) -> None:
+    # import ภายในฟังก์ชันกันวงกลม
+    from app.services import line_registry
+
+    message = db.session.get(LineMessage, message_id)
+    account = line_registry.get_by_id(message.line_account_id)
+    if account is None:
+        _finish(message, STATUS_FAILED, "OA not found")
+        return
+
+    started = time.monotonic()
+    try:
+        line_registry.with_retry_key(account.api, message.send_retry_key).push_message(
+            message.user_id, build_send_message(message)
+        )
+    except rate_limit.RateLimited as e:
+        # budget ของ OA หมด: เลื่อนไปโดยไม่นับเป็นความพยายามส่ง
+        _defer(message, e.retry_after)
+    except circuit_breaker.CircuitOpen as e:
+        if e.token_rejected:
+            # token ถูกเพิกถอน: แจ้งแอดมินทันที ไม่ต้องรอ round trip ไป LINE ทุกข้อความ
+            _finish(message, STATUS_FAILED, f"LINE OA unavailable: {e.reason}")
+        else:
+            # LINE/เครือข่ายมีปัญหา: เก็บไว้ในคิวจนกว่า probe จะผ่าน (ไม่นับ attempt)
+            _defer(message, e.retry_after)
+    except LineBotApiError as e:
+        if e.status_code == 409:
+            # retry key นี้ LINE รับไปแล้วจากรอบก่อน (เช่น timeout ฝั่งเรา) ถือว่าส่งสำเร็จ
+            _finish(message, STATUS_SENT)
+        elif e.status_code == 429 or e.status_code >= 500:
+            _retry_or_fail(message, f"LINE API Error: {e.error.message}")
+        else:
+            _finish(message, STATUS_FAILED, f"LINE API Error: {e.error.message}")
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+        _retry_or_fail(message, f"An unexpected error occurred: {str(e)}")
+    else:
+        _finish(message, STATUS_SENT)
+    finally:
+        metrics.incr("outbound_push_seconds_total", time.monotonic() - started)
+
+
+def _defer(message: LineMessage, delay_seconds: float) -> None:
+    message.send_status = STATUS_PENDING
+    message.send_attempts = LineMessage.send_attempts - 1
+    message.send_next_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
+    db.session.commit()
+    metrics.incr("outbound_deferred_total", oa=message.line_account_id)
+
+
+def _retry_or_fail(message: LineMessage, error_message: str) -> None:
+    max_attempts = int(current_app.config.get("OUTBOUND_MAX_ATTEMPTS", 6))
+    if message.send_attempts >= max_attempts:
+        _finish(message, STATUS_FAILED, error_message)
+        return
+
+    max_backoff = float(current_app.config.get("OUTBOUND_MAX_BACKOFF_SECONDS", 60))
+    message.send_status = STATUS_PENDING
+    message.send_next_at = datetime.utcnow() + timedelta(seconds=min(max_backoff, 2 ** message.send_attempts))
+    message.line_error_message = error_message
+    db.session.commit()
+    metrics.incr("outbound_retries_total", oa=message.line_account_id)
+
+
+def _finish(message: LineMessage, status: str, error_message: Optional[str] = None) -> None:
+    # import ภายในฟังก์ชันกันวงกลม (routes import service นี้)
+    from app.blueprints.chats.routes import format_message_for_api
+
+    message.send_status = status
+    message.send_next_at = None
+    message.line_sent_successfully = status == STATUS_SENT
+    message.line_error_message = error_message
+    db.session.commit()
+    metrics.incr("outbound_messages_total", status=status)
+
+    room_events.emit(
+        "message_updated", format_message_for_api(message), to=oa_rooms.rooms_for(message.line_account_id)
+    )
+
+
+def _redispatch_later(line_account_id: int, delay_seconds: float) -> None:
+    with _lock:
+        if line_account_id in _waiting:
+            return
+        _waiting.add(line_account_id)
+    socketio.start_background_task(_sleep_then_dispatch, line_account_id, delay_seconds)
+
+
+def _sleep_then_dispatch(line_account_id: int, delay_seconds: float) -> None:
+    socketio.sleep(delay_seconds)
+    with _lock:
+        _waiting.discard(line_account_id)
+    _dispatch(line_account_id)
@@ -0,0 +1,231 @@
+# app/services/profile_enricher.py - ดึงโปรไฟล์ LINE (ชื่อ/รูป) เบื้องหลัง พร้อม cache แบบ TTL ต่อ (OA, user_id)
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, current_app
+
+from app.extensions import db, socketio
+from app.models import Conversation, LineUser
+from app.services import circuit_breaker, conversations, oa_rooms, rate_limit, room_events
+
+ProfileKey = Tuple[int, str]
+
+
+class _TTLCache:
+    """LRU ที่จำกัดจำนวน entry และหมดอายุตาม TTL (thread-safe)"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[ProfileKey, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: ProfileKey) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: ProfileKey, value: dict) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+_lock = threading.Lock()
+_queue: "queue.Queue[ProfileKey]" = queue.Queue()
+_pending: set = set()
+_cache: Optional[_TTLCache] = None
+_oa_slots: Dict[int, threading.BoundedSemaphore] = {}
+_started = False
+
+
+def _get_cache() -> _TTLCache:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = _TTLCache(
+                    max_entries=int(current_app.config.get("PROFILE_CACHE_MAX_ENTRIES", 10000)),
+                    ttl_seconds=float(current_app.config.get("PROFILE_CACHE_TTL_SECONDS", 6 * 3600)),
+                )
+    return _cache
+
+
+def cached_profile(line_account_id: int, user_id: str) -> Optional[dict]:
+    """คืนโปรไฟล์จาก cache ถ้ายังไม่หมดอายุ ({'display_name', 'picture_url'})"""
+    return _get_cache().get((int(line_account_id), user_id))
+
+
+def request_profile(line_account_id: int, user_id: str) -> None:
+    """ขอให้ worker ดึงโปรไฟล์ของ user นี้ (ไม่บล็อก request; งานซ้ำจะถูกรวมเป็นงานเดียว)"""
+    key = (int(line_account_id), user_id)
+    with _lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    _ensure_workers(current_app._get_current_object())
+    _queue.put(key)
+
+
+def refresh_stale_profiles(limit: int = 500) -> int:
+    """ส่ง user ที่โปรไฟล์เก่ากว่า PROFILE_REFRESH_AFTER_HOURS เข้าคิว คืนจำนวนที่ส่ง"""
+    hours = float(current_app.config.get("PROFILE_REFRESH_AFTER_HOURS", 24 * 7))
+    stale_before = datetime.utcnow() - timedelta(hours=hours)
+    rows = (
+        db.session.query(LineUser.line_account_id, LineUser.user_id)
+        .filter(LineUser.is_blocked == False)
+        .filter(
+            (LineUser.profile_refreshed_at == None)
+            | (LineUser.profile_refreshed_at < stale_before)
+        )
+        .order_by(LineUser.profile_refreshed_at.asc().nullsfirst())
+        .limit(limit)
+        .all()
+    )
+    for oa_id, user_id in rows:
+        request_profile(oa_id, user_id)
+    return len(rows)
+
+
+def _oa_slot(line_account_id: int) -> threading.BoundedSemaphore:
+    with _lock:
+        slot = _oa_slots.get(line_account_id)
+        if slot is None:
+            limit = max(1, int(current_app.config.get("PROFILE_FETCH_PER_OA_CONCURRENCY", 2)))
+            slot = _oa_slots[line_account_id] = threading.BoundedSemaphore(limit)
+        return slot
+
+
+def _ensure_workers(app: Flask) -> None:
+    global _started
+    if _started:
+        return
+    with _lock:
+        if _started:
+            return
+        for _ in range(max(1, int(app.config.get("PROFILE_WORKER_COUNT", 4)))):
+            socketio.start_background_task(_worker_loop, app)
+        _started = True
+
+
+def _worker_loop(app: Flask) -> None:
+    while True:
+        key = _queue.get()
+        try:
+            with app.app_context():
+                with _oa_slot(key[0]):
+                    _enrich(*key)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with _lock:
+                _pending.discard(key)
+
+
+def _fetch(line_account_id: int, user_id: str) -> Optional[dict]:
+    # import ภายในฟังก์ชันกันวงกลม (registry import models)
+    from app.services import line_registry
+
+    cached = cached_profile(line_account_id, user_id)
+    if cached is not None:
+        return cached
+
+    account = line_registry.get_by_id(line_account_id)
+    if account is None:
+        return None
+    try:
+        profile = account.api.get_profile(user_id)
+    except (rate_limit.RateLimited, circuit_breaker.CircuitOpen) as e:
+        if isinstance(e, circuit_breaker.CircuitOpen) and e.token_rejected:
+            # token ใช้ไม่ได้ ส่งซ้ำไปก็ไม่สำเร็จจนกว่าจะแก้ token
+            print(f"Could not get profile for {user_id}: {e}")
+            _mark_failed(line_account_id, user_id)
+            return None
+        # budget ของ OA หมด / วงจรเปิดชั่วคราว: ส่งกลับเข้าคิวหลังจาก retry_after
+        socketio.start_background_task(
+            _request_later, current_app._get_current_object(), line_account_id, user_id, e.retry_after
+        )
+        return None
+    except Exception as e:
+        print(f"Could not get profile for {user_id}: {e}")
+        _mark_failed(line_account_id, user_id)
+        return None
+
+    value = {"display_name": profile.display_name, "picture_url": profile.picture_url}
+    _get_cache().set((line_account_id, user_id), value)
+    return value
+
+
+def _mark_failed(line_account_id: int, user_id: str) -> None:
+    """
+    เลื่อน profile_refreshed_at ให้ refresh_stale_profiles หยิบ user นี้อีกครั้งหลัง PROFILE_FAILED_RETRY_HOURS
+    (ถ้าปล่อยเป็น NULL user ที่ดึงไม่ได้จะอยู่หัวคิว nullsfirst และกินทุกช่องของ limit ทุกรอบ)
+    """
+    refresh_after = float(current_app.config.get("PROFILE_REFRESH_AFTER_HOURS", 24 * 7))
+    retry_after = float(current_app.config.get("PROFILE_FAILED_RETRY_HOURS", 24))
+    refreshed_at = datetime.utcnow() - timedelta(hours=max(0.0, refresh_after - retry_after))
+    LineUser.query.filter_by(line_account_id=line_account_id, user_id=user_id).update(
+        {"profile_refreshed_at": refreshed_at}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _request_later(app: Flask, line_account_id: int, user_id: str, delay_seconds: float) -> None:
+    socketio.sleep(delay_seconds)
+    with app.app_context():
+        request_profile(line_account_id, user_id)
+
+
+def _enrich(line_account_id: int, user_id: str) -> None:
+    profile = _fetch(line_account_id, user_id)
+    if profile is None:
+        return
+
+    changed = LineUser.query.filter(
+        LineUser.line_account_id == line_account_id,
+        LineUser.user_id == user_id,
+        (LineUser.display_name.is_distinct_from(profile["display_name"]))
+        | (LineUser.picture_url.is_distinct_from(profile["picture_url"])),
+    ).update(
+        {**profile, "profile_refreshed_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+    if changed:
+        # update แบบ bulk ไม่ผ่าน after_flush จึงต้องแจ้ง summary cache เอง
+        conversations.touch(
+            (Conversation.line_account_id == line_account_id) & (Conversation.user_id == user_id)
+        )
+    else:
+        LineUser.query.filter_by(line_account_id=line_account_id, user_id=user_id).update(
+            {"profile_refreshed_at": datetime.utcnow()}, synchronize_session=False
+        )
+    db.session.commit()
+
+    if changed:
+        _emit_conversation_update(line_account_id, user_id)
+
+
+def _emit_conversation_update(line_account_id: int, user_id: str) -> None:
+    """แจ้ง sidebar ให้แสดงชื่อ/รูปใหม่ (เฉพาะ conversation ที่มีข้อความแล้ว)"""
+    from app.blueprints.chats.routes import _generate_conversation_data
+
+    fresh_data = _generate_conversation_data(user_id, line_account_id)
+    if not fresh_data or not fresh_data.get("last_message_iso_timestamp"):
+        return
+    room_events.emit("render_conversation_update", fresh_data, to=oa_rooms.rooms_for(line_account_id))
@@ -0,0 +1,41 @@
+# app/services/query_counter.py - นับจำนวน SQL ต่อ request แล้วส่งกลับใน header X-DB-Query-Count (ใช้ตอน load test)
+from __future__ import annotations
+
+from flask import Flask, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_listening = False
+
+# replay-webhooks ส่ง header นี้ให้ webhook ประมวลผลใน request (แบบ sync) แม้ server เปิดโหมด async
+# เพื่อให้ X-DB-Query-Count นับ query ของการประมวลผลจริง ไม่ใช่แค่ query ที่เขียนลงคิว webhook_inbox
+INGEST_MODE_HEADER = "X-Loadtest-Ingest-Mode"
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    # นับเฉพาะ query ที่เกิดใน request (worker เบื้องหลังไม่นับ)
+    if has_request_context():
+        g._db_query_count = g.get("_db_query_count", 0) + 1
+
+
+def forces_sync_ingest() -> bool:
+    """True ถ้า request นี้ขอให้ประมวลผล webhook แบบ sync (มีผลเฉพาะตอนเปิด ENABLE_QUERY_COUNT_HEADER)"""
+    return (
+        bool(current_app.config.get("ENABLE_QUERY_COUNT_HEADER"))
+        and request.headers.get(INGEST_MODE_HEADER, "").lower() == "sync"
+    )
+
+
+def init_app(app: Flask) -> None:
+    """เปิดเมื่อ ENABLE_QUERY_COUNT_HEADER=1 เท่านั้น"""
+    global _listening
+    if not app.config.get("ENABLE_QUERY_COUNT_HEADER"):
+        return
+    if not _listening:
+        event.listen(Engine, "before_cursor_execute", _count_query)
+        _listening = True
+
+    @app.after_request
+    def _add_query_count_header(response):
+        response.headers["X-DB-Query-Count"] = str(g.get("_db_query_count", 0))
+        return response
@@ -0,0 +1,340 @@
+# app/services/rate_limit.py - token bucket ต่อ (OA, กลุ่ม endpoint) สำหรับทุกคำขอที่ยิงไป LINE Messaging API
+#
+# LINE_RATE_LIMIT_BACKEND:
+#   local                               -> bucket อยู่ใน process (ค่าเดิม) ใช้ได้เมื่อรัน worker เดียว
+#   redis://host:6379/0                 -> production หลาย worker/หลายเครื่องใช้ bucket ร่วมกัน (package redis อยู่ใน requirements.txt)
+#   sqlite:////abs/path/rate_limit.db   -> ตัวแทนในเครื่องสำหรับ dev/ทดสอบหลาย worker บนเครื่องเดียว
+#
+# LINE_RATE_LIMITS: "กลุ่ม=ต่อวินาที[:burst],..." ทับค่าใน DEFAULT_LIMITS เฉพาะกลุ่มที่ระบุ
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from flask import current_app
+
+from app.extensions import socketio
+from app.services import metrics
+
+ENDPOINT_PUSH = "push"            # push/reply
+ENDPOINT_MULTICAST = "multicast"  # multicast/broadcast/narrowcast (LINE จำกัดต่ำกว่า push มาก)
+ENDPOINT_PROFILE = "profile"      # โปรไฟล์ user / สมาชิกกลุ่ม
+ENDPOINT_CONTENT = "content"      # ดาวน์โหลดไฟล์สื่อ (api-data.line.me)
+ENDPOINT_INFO = "info"            # bot info / webhook endpoint (health check)
+ENDPOINT_DEFAULT = "default"
+
+# (คำขอต่อวินาที, burst) ตั้งต่ำกว่าเพดานของ LINE ไว้เผื่อหลายระบบใช้ token เดียวกัน
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    ENDPOINT_PUSH: (1000.0, 1000.0),
+    ENDPOINT_MULTICAST: (100.0, 100.0),
+    ENDPOINT_PROFILE: (500.0, 500.0),
+    ENDPOINT_CONTENT: (500.0, 500.0),
+    ENDPOINT_INFO: (20.0, 20.0),
+    ENDPOINT_DEFAULT: (500.0, 500.0),
+}
+
+
+class RateLimited(Exception):
+    """budget ของ OA/endpoint หมด และต้องรอนานกว่าที่ผู้เรียกยอมรอ (ให้เลื่อนงานไป retry_after วินาที)"""
+
+    def __init__(self, line_account_id: int, endpoint: str, retry_after: float):
+        super().__init__(f"LINE rate limit: OA {line_account_id} {endpoint}, retry in {retry_after:.2f}s")
+        self.line_account_id = line_account_id
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def endpoint_for(url: str) -> str:
+    """จัดกลุ่ม URL ของ LINE API ให้เป็น bucket"""
+    path = urlparse(url).path
+    if path.startswith("/v2/bot/message/"):
+        if path.endswith("/content") or "/content/" in path:
+            return ENDPOINT_CONTENT
+        if path.endswith(("/multicast", "/broadcast", "/narrowcast")):
+            return ENDPOINT_MULTICAST
+        if path.endswith(("/push", "/reply")):
+            return ENDPOINT_PUSH
+    if path.startswith("/v2/bot/profile/") or "/member/" in path:
+        return ENDPOINT_PROFILE
+    if path == "/v2/bot/info" or path.startswith("/v2/bot/channel/webhook"):
+        return ENDPOINT_INFO
+    return ENDPOINT_DEFAULT
+
+
+def _take(tokens: float, elapsed: float, rate: float, burst: float, cost: float,
+          max_wait: float) -> Tuple[bool, float, float]:
+    """
+    เติม token ตามเวลาที่ผ่านไปแล้วจอง cost คืน (ได้จองไหม, วินาทีที่ต้องรอ, token ที่เหลือ)
+    จองล่วงหน้าได้ (token ติดลบ) ถ้ารอไม่เกิน max_wait ผู้เรียกที่มาทีหลังจึงต่อคิวตามเวลาอย่างยุติธรรม
+    """
+    tokens = min(burst, tokens + max(0.0, elapsed) * rate)
+    wait = (cost - tokens) / rate if tokens < cost else 0.0
+    if wait > max_wait:
+        return False, wait, tokens
+    return True, wait, tokens - cost
+
+
+def _penalty(tokens: float, elapsed: float, rate: float, burst: float, seconds: float) -> float:
+    # โดน 429 จาก LINE: ทิ้ง token ที่เหลือและติดลบไว้ seconds วินาที
+    return min(0.0, min(burst, tokens + max(0.0, elapsed) * rate)) - rate * seconds
+
+
+class LocalBackend:
+    """bucket ใน memory ของ process นี้"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, เวลาที่อัปเดต)
+
+    def reserve(self, key: str, rate: float, burst: float, cost: float, max_wait: float):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            granted, wait, tokens = _take(tokens, now - updated, rate, burst, cost, max_wait)
+            self._buckets[key] = (tokens, now)
+        return granted, wait, tokens
+
+    def penalize(self, key: str, rate: float, burst: float, seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            self._buckets[key] = (_penalty(tokens, now - updated, rate, burst, seconds), now)
+
+    def peek(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + (now - updated) * rate)
+
+
+class SQLiteBackend:
+    """bucket ร่วมกันผ่านไฟล์ SQLite (worker บนเครื่องเดียวกัน) ล็อกด้วย BEGIN IMMEDIATE"""
+
+    def __init__(self, url: str):
+        self.path = url[len("sqlite:///"):]
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS line_rate_bucket ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _update(self, key: str, burst: float, fn):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM line_rate_bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            result, new_tokens = fn(tokens, now - updated)
+            conn.execute(
+                "INSERT OR REPLACE INTO line_rate_bucket (key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, new_tokens, now),
+            )
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def reserve(self, key: str, rate: float, burst: float, cost: float, max_wait: float):
+        def fn(tokens, elapsed):
+            result = _take(tokens, elapsed, rate, burst, cost, max_wait)
+            return result, result[2]
+        return self._update(key, burst, fn)
+
+    def penalize(self, key: str, rate: float, burst: float, seconds: float) -> None:
+        self._update(key, burst, lambda tokens, elapsed: (None, _penalty(tokens, elapsed, rate, burst, seconds)))
+
+    def peek(self, key: str, rate: float, burst: float) -> float:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM line_rate_bucket WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return burst
+        return min(burst, row[0] + (time.time() - row[1]) * rate)
+
+
+# ใช้นาฬิกาของ redis (TIME) ทุก worker จึงเห็นเวลาเดียวกัน, คืนเป็น string กัน redis ตัดทศนิยม
+_REDIS_RESERVE = """
+local rate, burst, cost, max_wait = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens < cost then wait = (cost - tokens) / rate end
+local granted = 0
+if wait <= max_wait then
+  tokens = tokens - cost
+  granted = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return {granted, tostring(wait), tostring(tokens)}
+"""
+
+_REDIS_PENALIZE = """
+local rate, burst, seconds = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(0, math.min(burst, tokens + math.max(0, now - ts) * rate)) - rate * seconds
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return tostring(tokens)
+"""
+
+
+class RedisBackend:
+    """bucket ร่วมกันทุก worker/ทุกเครื่องผ่าน redis (Lua script ทำ refill + จองใน round trip เดียว)"""
+
+    def __init__(self, url: str, prefix: str = "line-rate:"):
+        import redis  # import เฉพาะเมื่อเลือก backend นี้ (backend อื่นไม่ต้องติดตั้ง redis)
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._reserve = self.client.register_script(_REDIS_RESERVE)
+        self._penalize = self.client.register_script(_REDIS_PENALIZE)
+
+    def reserve(self, key: str, rate: float, burst: float, cost: float, max_wait: float):
+        granted, wait, tokens = self._reserve(keys=[self.prefix + key], args=[rate, burst, cost, max_wait])
+        return bool(int(granted)), float(wait), float(tokens)
+
+    def penalize(self, key: str, rate: float, burst: float, seconds: float) -> None:
+        self._penalize(keys=[self.prefix + key], args=[rate, burst, seconds])
+
+    def peek(self, key: str, rate: float, burst: float) -> float:
+        tokens, ts = self.client.hmget(self.prefix + key, "tokens", "ts")
+        if tokens is None:
+            return burst
+        now_s, now_us = self.client.time()
+        return min(burst, float(tokens) + max(0.0, now_s + now_us / 1e6 - float(ts)) * rate)
+
+
+_lock = threading.Lock()
+_backend = None
+_limits: Optional[Dict[str, Tuple[float, float]]] = None
+# (OA, endpoint) ที่ process นี้เคยใช้ -> สถิติ throttle สำหรับหน้า admin
+_stats: Dict[Tuple[int, str], Dict[str, float]] = {}
+
+
+def _parse_limits(raw: str) -> Dict[str, Tuple[float, float]]:
+    limits = dict(DEFAULT_LIMITS)
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = (s.strip() for s in part.split("=", 1))
+        rate, _, burst = value.partition(":")
+        limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+
+def _get_backend():
+    global _backend, _limits
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                url = current_app.config.get("LINE_RATE_LIMIT_BACKEND") or "local"
+                _limits = _parse_limits(current_app.config.get("LINE_RATE_LIMITS", ""))
+                if url.startswith("sqlite:///"):
+                    _backend = SQLiteBackend(url)
+                elif url.startswith(("redis://", "rediss://")):
+                    _backend = RedisBackend(url)
+                else:
+                    _backend = LocalBackend()
+    return _backend
+
+
+def limit_for(endpoint: str) -> Tuple[float, float]:
+    _get_backend()
+    return _limits.get(endpoint) or _limits[ENDPOINT_DEFAULT]
+
+
+def _key(line_account_id: int, endpoint: str) -> str:
+    return f"{line_account_id}:{endpoint}"
+
+
+def _stats_for(line_account_id: int, endpoint: str) -> Dict[str, float]:
+    # เรียกภายใต้ _lock
+    return _stats.setdefault(
+        (line_account_id, endpoint), {"waits": 0, "wait_seconds": 0.0, "deferred": 0, "throttled": 0}
+    )
+
+
+def acquire(line_account_id, endpoint: str, cost: float = 1, max_wait: Optional[float] = None) -> None:
+    """
+    ขอ budget ก่อนยิง LINE: ถ้าหมดจะรอ (ไม่เกิน LINE_RATE_MAX_WAIT_SECONDS หรือ max_wait)
+    รอนานกว่านั้นจะ raise RateLimited ให้งานเบื้องหลังเลื่อนตัวเองไปแทนการยิงแล้วโดน 429
+    """
+    line_account_id = int(line_account_id)
+    backend = _get_backend()
+    rate, burst = limit_for(endpoint)
+    if max_wait is None:
+        max_wait = float(current_app.config.get("LINE_RATE_MAX_WAIT_SECONDS", 5))
+    granted, wait, tokens = backend.reserve(_key(line_account_id, endpoint), rate, burst, cost, max_wait)
+    metrics.set_gauge("line_rate_tokens", round(max(0.0, tokens), 2), oa=line_account_id, endpoint=endpoint)
+    with _lock:
+        stats = _stats_for(line_account_id, endpoint)
+        if not granted:
+            stats["deferred"] += 1
+        elif wait > 0:
+            stats["waits"] += 1
+            stats["wait_seconds"] += wait
+    if not granted:
+        metrics.incr("line_rate_deferred_total", oa=line_account_id, endpoint=endpoint)
+        raise RateLimited(line_account_id, endpoint, wait)
+    if wait > 0:
+        metrics.incr("line_rate_waits_total", oa=line_account_id, endpoint=endpoint)
+        metrics.incr("line_rate_wait_seconds_total", wait, oa=line_account_id, endpoint=endpoint)
+        socketio.sleep(wait)
+
+
+def record_response(line_account_id, endpoint: str, status_code: int) -> None:
+    """LINE ตอบ 429 แปลว่า budget จริงน้อยกว่าที่ตั้งไว้ (หรือมีระบบอื่นใช้ token เดียวกัน) พัก bucket นี้ไว้ครู่หนึ่ง"""
+    if status_code != 429:
+        return
+    line_account_id = int(line_account_id)
+    rate, burst = limit_for(endpoint)
+    seconds = float(current_app.config.get("LINE_RATE_429_COOLDOWN_SECONDS", 1))
+    _get_backend().penalize(_key(line_account_id, endpoint), rate, burst, seconds)
+    with _lock:
+        _stats_for(line_account_id, endpoint)["throttled"] += 1
+    metrics.incr("line_api_429_total", oa=line_account_id, endpoint=endpoint)
+
+
+def snapshot() -> Dict[int, Dict[str, dict]]:
+    """budget คงเหลือ + สถิติ throttle ของทุก (OA, endpoint) ที่ process นี้เคยใช้"""
+    backend = _get_backend()
+    with _lock:
+        seen = {key: dict(stats) for key, stats in _stats.items()}
+    result: Dict[int, Dict[str, dict]] = {}
+    for (line_account_id, endpoint), stats in sorted(seen.items()):
+        rate, burst = limit_for(endpoint)
+        tokens = backend.peek(_key(line_account_id, endpoint), rate, burst)
+        result.setdefault(line_account_id, {})[endpoint] = {
+            "remaining": round(max(0.0, tokens), 2),
+            "rate_per_second": rate,
+            "burst": burst,
+            **stats,
+        }
+    return result
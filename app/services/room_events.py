@@ -0,0 +1,229 @@
+# app/services/room_events.py - ใส่เลขลำดับ (seq) ให้ event ของห้องกลุ่ม + ring buffer สำหรับส่ง event ที่พลาดไปตอน reconnect
+# และรวม emit ที่เกิดถี่ ๆ ในช่วงสั้น ๆ (ต่อชุดห้อง ต่อ conversation) ให้เหลือน้อยครั้งที่สุด
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Union
+
+from flask import Flask, current_app
+
+from app.extensions import socketio
+from app.services import metrics
+
+# seq นับแยกต่อ process (1 stream ต่อ worker และเปลี่ยนทุกครั้งที่รีสตาร์ท) client จำ seq ล่าสุดแยกตาม (room, stream)
+STREAM_ID = uuid.uuid4().hex[:12]
+# จำนวน stream ต่อห้องที่เก็บ buffer ไว้ (worker ที่ตายไปแล้วจะค่อย ๆ ถูกตัดออก)
+MAX_STREAMS_PER_ROOM = 32
+
+_lock = threading.Lock()
+
+
+class _RoomLog:
+    __slots__ = ("seq", "events", "touched_at")
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.events: Deque[Tuple[int, str, dict]] = deque(maxlen=size)
+        self.touched_at = time.monotonic()
+
+    def append(self, seq: int, event_name: str, envelope: dict) -> None:
+        self.seq = seq
+        self.events.append((seq, event_name, envelope))
+        self.touched_at = time.monotonic()
+
+
+# room -> stream -> log (stream ของ worker อื่นได้มาจาก message queue ดู socket_fanout)
+_rooms: Dict[str, Dict[str, _RoomLog]] = {}
+_remote_buffer_size = 200
+
+# งานที่รอส่ง: ชุดห้อง -> OrderedDict[(ชนิด, key ของ conversation/ข้อความ) -> [event_name, payload หรือ list ของ payload]]
+_pending: "Dict[Tuple[str, ...], OrderedDict[tuple, list]]" = {}
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+
+
+def _buffer_size() -> int:
+    return max(1, int(current_app.config.get("ROOM_EVENT_BUFFER_SIZE", 200)))
+
+
+def _coalesce_seconds() -> float:
+    return max(0.0, float(current_app.config.get("ROOM_EMIT_COALESCE_MS", 100)) / 1000.0)
+
+
+def _log_for(room: str, stream: str, buffer_size: int) -> _RoomLog:
+    # เรียกภายใต้ _lock
+    streams = _rooms.setdefault(room, {})
+    log = streams.get(stream)
+    if log is None:
+        log = streams[stream] = _RoomLog(buffer_size)
+        while len(streams) > MAX_STREAMS_PER_ROOM:
+            oldest = min((s for s in streams if s != STREAM_ID), key=lambda s: streams[s].touched_at)
+            del streams[oldest]
+    return log
+
+
+def _publish(event_name: str, payload: dict, rooms: Tuple[str, ...], buffer_size: int) -> None:
+    """
+    emit ครั้งเดียวถึงทุกห้องในชุด (Socket.IO ส่งให้ client ละครั้งแม้จะอยู่หลายห้องที่ OA สังกัด)
+    โดยแต่ละห้องได้ seq ของตัวเองใน envelope['seqs']
+    """
+    with _lock:
+        logs = {room: _log_for(room, STREAM_ID, buffer_size) for room in rooms}
+        envelope = {**payload, "seqs": {room: log.seq + 1 for room, log in logs.items()}, "stream": STREAM_ID}
+        for room, log in logs.items():
+            log.append(envelope["seqs"][room], event_name, envelope)
+        # emit ภายใน lock ให้ client ได้รับตามลำดับ seq (ไม่งั้นจะเห็นเป็นช่องว่างแล้ว resync โดยไม่จำเป็น)
+        socketio.emit(event_name, envelope, to=list(rooms))
+    metrics.incr("room_emits_total", event=event_name)
+    metrics.incr("room_emit_bytes_total", len(json.dumps(envelope, default=str)), event=event_name)
+
+
+def _normalize_rooms(to: Union[str, Iterable[str]]) -> Tuple[str, ...]:
+    if isinstance(to, str):
+        return (to,)
+    return tuple(sorted(set(to)))
+
+
+def _conversation_key(payload: dict) -> tuple:
+    return (payload.get("line_account_id") or payload.get("oa_id"), payload.get("user_id"))
+
+
+def _pending_key(event_name: str, payload: dict) -> Optional[tuple]:
+    if event_name == "render_conversation_update":
+        return ("summary",) + _conversation_key(payload)
+    if event_name == "new_message":
+        return ("messages",) + _conversation_key(payload)
+    if event_name == "message_updated" and payload.get("id") is not None:
+        return ("updated", payload["id"])
+    return None
+
+
+def emit(event_name: str, payload: dict, to: Union[str, Iterable[str]]) -> None:
+    """
+    ส่ง event เข้าห้อง group_* (ใช้แทน socketio.emit) พร้อม seqs/stream ใน payload
+    to = ห้องเดียวหรือหลายห้อง (เช่น oa_rooms.rooms_for(oa_id)) หลายห้องจะถูกส่งเป็น emit เดียว
+    ถ้าเปิด ROOM_EMIT_COALESCE_MS จะพักไว้ช่วงสั้น ๆ แล้วรวม:
+    - render_conversation_update ของ conversation เดียวกัน เหลือตัวล่าสุดตัวเดียว
+    - new_message ของ conversation เดียวกัน รวมเป็น new_messages {'messages': [...]}
+    - message_updated ของข้อความเดียวกัน เหลือตัวล่าสุด
+    """
+    global _flush_scheduled
+    rooms = _normalize_rooms(to)
+    if not rooms:
+        return
+    window = _coalesce_seconds()
+    key = _pending_key(event_name, payload)
+    if not window or key is None:
+        _publish(event_name, payload, rooms, _buffer_size())
+        return
+
+    with _pending_lock:
+        room_pending = _pending.setdefault(rooms, OrderedDict())
+        entry = room_pending.get(key)
+        if entry is None:
+            room_pending[key] = [event_name, [payload] if key[0] == "messages" else payload]
+        elif key[0] == "messages":
+            entry[1].append(payload)
+            metrics.incr("room_emits_coalesced_total", event=event_name)
+        else:
+            # ตัวใหม่แทนตัวเก่า (ตำแหน่งเดิม ให้ลำดับข้อความ -> sidebar ยังเหมือนเดิม)
+            entry[1] = payload
+            metrics.incr("room_emits_superseded_total", event=event_name)
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    socketio.start_background_task(_flush_later, current_app._get_current_object(), window)
+
+
+def _flush_later(app: Flask, delay_seconds: float) -> None:
+    socketio.sleep(delay_seconds)
+    with app.app_context():
+        flush()
+
+
+def flush() -> None:
+    """ส่ง event ที่พักไว้ทั้งหมดทันที"""
+    global _flush_scheduled
+    with _pending_lock:
+        batches = list(_pending.items())
+        _pending.clear()
+        _flush_scheduled = False
+    buffer_size = _buffer_size()
+    for rooms, room_pending in batches:
+        for event_name, body in room_pending.values():
+            if isinstance(body, list):
+                if len(body) == 1:
+                    _publish(event_name, body[0], rooms, buffer_size)
+                else:
+                    _publish("new_messages", _batch_payload(body), rooms, buffer_size)
+            else:
+                _publish(event_name, body, rooms, buffer_size)
+
+
+def _batch_payload(messages: List[dict]) -> dict:
+    first = messages[0]
+    return {
+        "user_id": first.get("user_id"),
+        "oa_id": first.get("oa_id") or first.get("line_account_id"),
+        "messages": messages,
+    }
+
+
+def record_remote(event_name: str, envelope) -> None:
+    """เก็บ event ที่ worker อื่นส่งผ่าน message queue ลง buffer ด้วย เพื่อให้ worker ไหนก็ตอบ replay ได้"""
+    if not isinstance(envelope, dict) or envelope.get("stream") in (None, STREAM_ID):
+        return
+    seqs = envelope.get("seqs")
+    if not isinstance(seqs, dict):
+        return
+    with _lock:
+        for room, seq in seqs.items():
+            _log_for(room, envelope["stream"], _remote_buffer_size).append(seq, event_name, envelope)
+
+
+def configure(app: Flask) -> None:
+    """อ่านค่าที่ใช้นอก app context (listener ของ message queue)"""
+    global _remote_buffer_size
+    _remote_buffer_size = max(1, int(app.config.get("ROOM_EVENT_BUFFER_SIZE", 200)))
+
+
+def _replay_log(log: Optional[_RoomLog], last_seq: Optional[int]) -> dict:
+    seq = log.seq if log else 0
+    if last_seq is None:
+        # ยังไม่เคยเห็น stream นี้ แค่บอก seq ปัจจุบัน
+        return {"seq": seq, "events": []}
+    if log is None or last_seq > seq:
+        # stream ที่ไม่รู้จัก (worker รีสตาร์ท / buffer ถูกตัด) ไม่มีทางรู้ว่าพลาดอะไรไป
+        metrics.incr("room_resync_total", reason="stream")
+        return {"seq": seq, "resync": True}
+    oldest = log.events[0][0] if log.events else seq + 1
+    if last_seq + 1 < oldest:
+        metrics.incr("room_resync_total", reason="gap")
+        return {"seq": seq, "resync": True}
+    events = [
+        {"event": event_name, "data": envelope}
+        for event_seq, event_name, envelope in log.events
+        if event_seq > last_seq
+    ]
+    metrics.incr("room_events_replayed_total", len(events))
+    return {"seq": seq, "events": events}
+
+
+def replay(room: str, cursors: Optional[Dict[str, int]]) -> Dict[str, dict]:
+    """
+    event ที่ client ยังไม่ได้รับ แยกตาม stream: cursors = {stream: seq ล่าสุดที่เห็น}
+    คืน {stream: {'seq', 'events': [{'event', 'data'}]}} หรือ {stream: {'seq', 'resync': True}}
+    เมื่อช่องว่างเกิน buffer หรือ stream ไม่รู้จักแล้ว
+    """
+    cursors = cursors or {}
+    with _lock:
+        streams = dict(_rooms.get(room, {}))
+        streams.setdefault(STREAM_ID, None)
+        return {
+            stream: _replay_log(streams.get(stream), cursors.get(stream))
+            for stream in set(streams) | set(cursors)
+        }
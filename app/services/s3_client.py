@@ -1,9 +1,11 @@
+import io
 import os
 import mimetypes
 from datetime import datetime
 from uuid import uuid4
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config as BotoConfig
 from flask import current_app
 from werkzeug.utils import secure_filename
@@ -46,9 +48,58 @@ def upload_fileobj(file_storage) -> str:
         Key=key,
         ExtraArgs={
             'ContentType': content_type
-        }
+        },
+        Config=_transfer_config(),
     )
 
     region = current_app.config["AWS_DEFAULT_REGION"]
     return f"https://{_bucket()}.s3.{region}.amazonaws.com/{key}"
 
+
+
+class _IterStream(io.RawIOBase):
+    """ห่อ iterator ของ bytes (เช่น iter_content) ให้อ่านแบบไฟล์ได้ โดยไม่ต้องโหลดทั้งก้อนเข้า memory"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _transfer_config() -> TransferConfig:
+    # ไฟล์ใหญ่กว่า threshold จะถูกอัปโหลดแบบ multipart ทีละ chunk (memory ต่อไฟล์ ≈ chunksize x concurrency)
+    chunk = int(current_app.config.get("S3_MULTIPART_CHUNK_BYTES", 8 * 1024 * 1024))
+    return TransferConfig(
+        multipart_threshold=chunk,
+        multipart_chunksize=chunk,
+        max_concurrency=int(current_app.config.get("S3_MULTIPART_CONCURRENCY", 2)),
+    )
+
+
+def upload_stream(chunks, filename: str, content_type: str | None = None) -> tuple[str, str]:
+    """อัปโหลดข้อมูลแบบ stream (iterable ของ bytes) ขึ้น S3 คืน (url, key)"""
+    key = _build_key(filename)
+    stream = io.BufferedReader(_IterStream(chunks), buffer_size=64 * 1024)
+    _client().upload_fileobj(
+        Fileobj=stream,
+        Bucket=_bucket(),
+        Key=key,
+        ExtraArgs={'ContentType': content_type or _ctype(filename)},
+        Config=_transfer_config(),
+    )
+
+    region = current_app.config["AWS_DEFAULT_REGION"]
+    return f"https://{_bucket()}.s3.{region}.amazonaws.com/{key}", key
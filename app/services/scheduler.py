@@ -0,0 +1,415 @@
+# app/services/scheduler.py - ข้อความตั้งเวลาส่ง: timer wheel ในหน่วยความจำ เติมจาก index (status, due_at) ทีละช่วงเวลาข้างหน้า
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from flask import Flask, current_app
+
+from app.extensions import db, socketio
+from app.models import LineMessage, LineUser, ScheduledMessage
+from app.services import broadcasts, metrics, oa_rooms, outbound, room_events
+
+STATUS_SCHEDULED = "scheduled"
+STATUS_DISPATCHED = "dispatched"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+
+BANGKOK_TZ = timezone(timedelta(hours=7))
+# ถ้าโหลดช่วงเวลาข้างหน้าไม่สำเร็จ (DB ล่ม) ลองใหม่หลังจากนี้ ไม่รอครึ่ง window
+_LOAD_RETRY_SECONDS = 30.0
+
+_lock = threading.Lock()
+_wheel: Optional["TimerWheel"] = None
+
+
+class TimerWheel:
+    """
+    hashed timer wheel: วงของช่อง (slot) ช่องละ tick_seconds งานที่ไกลเกินหนึ่งรอบรออยู่ช่องเดิมจน tick ถึง
+    add/remove O(1) และแต่ละ tick ดูแค่ช่องเดียว (ไม่ต้อง sort หรือ query DB ทุกวินาที)
+    ไม่ thread-safe เอง ผู้เรียกถือ _lock
+    """
+
+    def __init__(self, slots: int, tick_seconds: float, now: float):
+        self.tick_seconds = tick_seconds
+        self._slots: List[Dict[int, int]] = [{} for _ in range(max(1, slots))]
+        self._due_tick: Dict[int, int] = {}
+        self._next_tick = int(now // tick_seconds)  # tick ถัดไปที่ยังไม่ได้ advance
+
+    def __len__(self) -> int:
+        return len(self._due_tick)
+
+    def add(self, item_id: int, due_ts: float) -> None:
+        """ใส่ (หรือย้าย) งานไปช่องของเวลา due_ts ไม่ยิงก่อนเวลา; เลยเวลาแล้วจะยิงใน tick ถัดไป"""
+        self.remove(item_id)
+        due_tick = max(math.ceil(due_ts / self.tick_seconds), self._next_tick)
+        self._slots[due_tick % len(self._slots)][item_id] = due_tick
+        self._due_tick[item_id] = due_tick
+
+    def remove(self, item_id: int) -> None:
+        due_tick = self._due_tick.pop(item_id, None)
+        if due_tick is not None:
+            self._slots[due_tick % len(self._slots)].pop(item_id, None)
+
+    def advance(self, now: float) -> List[int]:
+        """เดินเข็มถึงเวลา now คืน id ที่ถึงเวลาแล้ว (ถ้าหยุดไปนานเกินหนึ่งรอบ ตรวจทุกช่องครั้งเดียวพอ)"""
+        now_tick = int(now // self.tick_seconds)
+        due: List[int] = []
+        last_tick = min(now_tick, self._next_tick + len(self._slots) - 1)
+        for tick in range(self._next_tick, last_tick + 1):
+            slot = self._slots[tick % len(self._slots)]
+            ready = [item_id for item_id, due_tick in slot.items() if due_tick <= now_tick]
+            for item_id in ready:
+                del slot[item_id]
+                del self._due_tick[item_id]
+            due.extend(ready)
+        self._next_tick = max(self._next_tick, now_tick + 1)
+        return due
+
+
+def init_app(app: Flask) -> None:
+    """สตาร์ท dispatcher ตอน request แรก (ไม่สตาร์ทตอนรันคำสั่ง CLI เช่น flask db upgrade)"""
+
+    @app.before_request
+    def _start_scheduler():
+        _ensure_started(app)
+
+
+def parse_due_at(raw: Optional[str]) -> datetime:
+    """แปลงเวลา ISO8601 จาก client (ไม่มี timezone = เวลาไทย) เป็น UTC naive; raise ValueError ถ้าไม่ถูกต้อง/เลยมาแล้ว"""
+    if not raw:
+        raise ValueError("Missing send_at")
+    cleaned = raw.strip()
+    if cleaned.endswith("Z"):
+        cleaned = cleaned[:-1] + "+00:00"
+    due = datetime.fromisoformat(cleaned)
+    if due.tzinfo is None:
+        due = due.replace(tzinfo=BANGKOK_TZ)
+    due = due.astimezone(timezone.utc).replace(tzinfo=None)
+    if due < datetime.utcnow() - timedelta(minutes=1):
+        raise ValueError("send_at is in the past")
+    return due
+
+
+def schedule_message(
+    line_user: LineUser,
+    message: dict,
+    due_at: datetime,
+    admin_user_id: Optional[int] = None,
+    trigger_status: Optional[str] = None,
+) -> ScheduledMessage:
+    """
+    ตั้งเวลาส่งข้อความหา LineUser คนเดียว (message รูปแบบเดียวกับ broadcasts.create)
+    add เข้า session แต่ยังไม่ commit ผู้เรียก commit แล้วค่อย submit()
+    """
+    broadcasts.validate_message(message)
+    schedule = ScheduledMessage(
+        admin_user_id=admin_user_id,
+        line_account_id=line_user.line_account_id,
+        user_id=line_user.user_id,
+        due_at=due_at,
+        trigger_status=trigger_status,
+        status=STATUS_SCHEDULED,
+        **_message_columns(message),
+    )
+    db.session.add(schedule)
+    return schedule
+
+
+def schedule_broadcast(
+    filters: dict, message: dict, due_at: datetime, admin_user_id: Optional[int] = None
+) -> ScheduledMessage:
+    """ตั้งเวลา broadcast ตาม segment (filters จาก segments.parse_filters) add แต่ยังไม่ commit"""
+    broadcasts.validate_message(message)
+    schedule = ScheduledMessage(
+        admin_user_id=admin_user_id,
+        filters=json.dumps(filters, ensure_ascii=False),
+        due_at=due_at,
+        status=STATUS_SCHEDULED,
+        **_message_columns(message),
+    )
+    db.session.add(schedule)
+    return schedule
+
+
+def schedule_status_reminder(
+    line_user: LineUser, status: str, admin_user_id: Optional[int] = None
+) -> Optional[ScheduledMessage]:
+    """
+    ตั้งข้อความเตือนอัตโนมัติของสถานะแชท (เช่น deposit) ตาม STATUS_REMINDER_MINUTES
+    คืน None ถ้าสถานะนี้ไม่มีการเตือน หรือมีเตือนที่รอส่งอยู่แล้ว
+    """
+    minutes = _reminder_minutes(current_app.config.get("STATUS_REMINDER_MINUTES", "")).get(status)
+    text = current_app.config.get(f"STATUS_REMINDER_TEXT_{status.upper()}")
+    if not minutes or not text:
+        return None
+
+    pending = ScheduledMessage.query.filter_by(
+        line_account_id=line_user.line_account_id,
+        user_id=line_user.user_id,
+        status=STATUS_SCHEDULED,
+        trigger_status=status,
+    ).first()
+    if pending is not None:
+        return None
+
+    return schedule_message(
+        line_user,
+        {"type": "text", "text": text},
+        datetime.utcnow() + timedelta(minutes=minutes),
+        admin_user_id=admin_user_id,
+        trigger_status=status,
+    )
+
+
+def cancel_for_status_change(line_user: LineUser, new_status: str) -> int:
+    """ยกเลิกข้อความเตือนที่ผูกกับสถานะเดิมของแชทนี้ (ยังไม่ commit) คืนจำนวนที่ยกเลิก"""
+    return ScheduledMessage.query.filter(
+        ScheduledMessage.line_account_id == line_user.line_account_id,
+        ScheduledMessage.user_id == line_user.user_id,
+        ScheduledMessage.status == STATUS_SCHEDULED,
+        ScheduledMessage.trigger_status.isnot(None),
+        ScheduledMessage.trigger_status != new_status,
+    ).update({"status": STATUS_CANCELLED}, synchronize_session=False)
+
+
+def cancel(schedule_id: int) -> bool:
+    """ยกเลิกข้อความที่ยังไม่ถึงเวลา คืน False ถ้าส่งไปแล้ว/ยกเลิกไปแล้ว"""
+    cancelled = ScheduledMessage.query.filter_by(id=schedule_id, status=STATUS_SCHEDULED).update(
+        {"status": STATUS_CANCELLED}, synchronize_session=False
+    )
+    db.session.commit()
+    if cancelled and _wheel is not None:
+        with _lock:
+            _wheel.remove(schedule_id)
+    return bool(cancelled)
+
+
+def submit(schedule: ScheduledMessage) -> None:
+    """
+    หลัง commit: ถ้าถึงเวลาภายใน window ใส่ลง wheel ของ process นี้เลย (ไม่ต้องรอรอบโหลดถัดไป)
+    process อื่นจะเห็นตอนโหลด window รอบหน้า ใครยิงก่อนคนนั้นได้ (claim แบบ atomic)
+    """
+    app = current_app._get_current_object()
+    _ensure_started(app)
+    window = float(app.config.get("SCHEDULE_WINDOW_SECONDS", 600))
+    due_ts = _to_epoch(schedule.due_at)
+    if due_ts < time.time() + window:
+        with _lock:
+            _wheel.add(schedule.id, due_ts)
+
+
+def serialize(schedule: ScheduledMessage) -> dict:
+    return {
+        "id": schedule.id,
+        "status": schedule.status,
+        "due_at": schedule.due_at.isoformat() + "Z",
+        "oa_id": schedule.line_account_id,
+        "user_id": schedule.user_id,
+        "is_broadcast": schedule.filters is not None,
+        "message_type": schedule.message_type,
+        "message_text": schedule.message_text,
+        "trigger_status": schedule.trigger_status,
+        "line_message_id": schedule.line_message_id,
+        "broadcast_id": schedule.broadcast_id,
+        "last_error": schedule.last_error,
+    }
+
+
+def _message_columns(message: dict) -> dict:
+    return {
+        "message_type": message.get("type") or "text",
+        "message_text": message.get("text"),
+        "message_url": message.get("url"),
+        "package_id": message.get("package_id"),
+        "sticker_id": message.get("sticker_id"),
+    }
+
+
+def _message_of(schedule: ScheduledMessage) -> dict:
+    return {
+        "type": schedule.message_type,
+        "text": schedule.message_text,
+        "url": schedule.message_url,
+        "package_id": schedule.package_id,
+        "sticker_id": schedule.sticker_id,
+    }
+
+
+def _reminder_minutes(raw: str) -> Dict[str, int]:
+    # "deposit=30,withdraw=60" -> {'deposit': 30, 'withdraw': 60}
+    minutes: Dict[str, int] = {}
+    for part in (raw or "").split(","):
+        status, _, value = part.partition("=")
+        if status.strip() and value.strip():
+            minutes[status.strip()] = int(value)
+    return minutes
+
+
+def _to_epoch(naive_utc: datetime) -> float:
+    return naive_utc.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _ensure_started(app: Flask) -> None:
+    global _wheel
+    if _wheel is not None:
+        return
+    with _lock:
+        if _wheel is not None:
+            return
+        _wheel = TimerWheel(
+            int(app.config.get("SCHEDULE_WHEEL_SLOTS", 512)),
+            float(app.config.get("SCHEDULE_TICK_SECONDS", 1)),
+            time.time(),
+        )
+    socketio.start_background_task(_run, app)
+
+
+def _run(app: Flask) -> None:
+    """เดินเข็มทุก tick (ในหน่วยความจำ) และ query DB แค่ทุกครึ่ง window เพื่อเติมงานช่วงเวลาข้างหน้า"""
+    window = float(app.config.get("SCHEDULE_WINDOW_SECONDS", 600))
+    next_load = 0.0
+    while True:
+        now = time.time()
+        if now >= next_load:
+            loaded = _load_window(app, now + window)
+            next_load = now + (window / 2 if loaded else _LOAD_RETRY_SECONDS)
+
+        with _lock:
+            due_ids = _wheel.advance(now)
+        for schedule_id in due_ids:
+            try:
+                with app.app_context():
+                    _fire(schedule_id)
+            except Exception:
+                traceback.print_exc()
+
+        metrics.set_gauge("scheduled_wheel_size", len(_wheel))
+        socketio.sleep(_wheel.tick_seconds)
+
+
+def _load_window(app: Flask, horizon_ts: float) -> bool:
+    """
+    โหลดงานที่ถึงเวลาก่อน horizon (รวมงานที่เลยเวลาตอน process ดับ) ลง wheel
+    ใช้ index (status, due_at) อ่านแค่ช่วงเวลาข้างหน้า ไม่ใช่ทั้งตาราง
+    """
+    horizon = datetime.utcfromtimestamp(horizon_ts)
+    limit = int(app.config.get("SCHEDULE_LOAD_LIMIT", 10000))
+    with app.app_context():
+        try:
+            rows = (
+                db.session.query(ScheduledMessage.id, ScheduledMessage.due_at)
+                .filter(ScheduledMessage.status == STATUS_SCHEDULED, ScheduledMessage.due_at < horizon)
+                .order_by(ScheduledMessage.due_at.asc())
+                .limit(limit)
+                .all()
+            )
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            return False
+
+    with _lock:
+        for schedule_id, due_at in rows:
+            _wheel.add(schedule_id, _to_epoch(due_at))
+    metrics.incr("scheduled_window_loads_total")
+    return True
+
+
+def _fire(schedule_id: int) -> None:
+    """จอง (scheduled -> dispatched แบบ atomic กันหลาย process ยิงซ้ำ) แล้วส่งต่อให้ outbound / broadcast"""
+    schedule = db.session.get(ScheduledMessage, schedule_id)
+    if schedule is None or schedule.status != STATUS_SCHEDULED:
+        return
+
+    now = datetime.utcnow()
+    if schedule.due_at > now:
+        # ถูกเลื่อนเวลาหลังจากโหลดเข้า wheel
+        with _lock:
+            _wheel.add(schedule_id, _to_epoch(schedule.due_at))
+        return
+
+    claimed = ScheduledMessage.query.filter_by(id=schedule_id, status=STATUS_SCHEDULED).update(
+        {"status": STATUS_DISPATCHED, "dispatched_at": now}, synchronize_session=False
+    )
+    if not claimed:
+        db.session.rollback()
+        return
+
+    try:
+        if schedule.filters is not None:
+            _dispatch_broadcast(schedule)
+        else:
+            _dispatch_message(schedule)
+    except Exception as e:
+        db.session.rollback()
+        traceback.print_exc()
+        ScheduledMessage.query.filter_by(id=schedule_id).update(
+            {"status": STATUS_FAILED, "last_error": str(e)}, synchronize_session=False
+        )
+        db.session.commit()
+        metrics.incr("scheduled_messages_total", status=STATUS_FAILED)
+        return
+    metrics.incr("scheduled_messages_total", status=STATUS_DISPATCHED)
+    metrics.incr("scheduled_dispatch_lag_seconds_total", max(0.0, (now - schedule.due_at).total_seconds()))
+
+
+def _dispatch_broadcast(schedule: ScheduledMessage) -> None:
+    broadcast = broadcasts.build(json.loads(schedule.filters), _message_of(schedule), schedule.admin_user_id)
+    db.session.add(broadcast)
+    db.session.flush()
+    schedule.broadcast_id = broadcast.id
+    db.session.commit()
+    broadcasts.start(broadcast.id)
+
+
+def _dispatch_message(schedule: ScheduledMessage) -> None:
+    """สร้าง LineMessage ขาออกแบบเดียวกับ /chats/api/send_message แล้วเข้าคิว outbound"""
+    # import ภายในฟังก์ชันกันวงกลม (routes import service นี้)
+    from app.blueprints.chats.routes import _generate_conversation_data, format_message_for_api
+
+    user_id, oa_id = schedule.user_id, schedule.line_account_id
+    line_user = LineUser.query.filter_by(user_id=user_id, line_account_id=oa_id).first()
+    if line_user is None:
+        raise LookupError("User not found")
+
+    now = datetime.utcnow()
+    line_user.last_message_at = now
+    message = LineMessage(
+        user_id=user_id,
+        line_account_id=oa_id,
+        message_type=schedule.message_type,
+        message_text=schedule.message_text,
+        message_url=schedule.message_url,
+        package_id=schedule.package_id,
+        sticker_id=schedule.sticker_id,
+        is_outgoing=True,
+        timestamp=now,
+        admin_user_id=schedule.admin_user_id,
+    )
+    if line_user.is_blocked:
+        message.line_sent_successfully = False
+        message.line_error_message = "Message not sent: This user has blocked the OA."
+        message.send_status = outbound.STATUS_FAILED
+    else:
+        outbound.prepare(message)
+    db.session.add(message)
+    db.session.flush()
+    schedule.line_message_id = message.id
+
+    payload = format_message_for_api(message)
+    payload.update({"user_id": user_id, "oa_id": oa_id})
+    target_rooms = oa_rooms.rooms_for(oa_id)
+    room_events.emit("new_message", payload, to=target_rooms)
+    fresh_data = _generate_conversation_data(user_id, oa_id)
+    if fresh_data:
+        room_events.emit("render_conversation_update", fresh_data, to=target_rooms)
+
+    db.session.commit()
+    if not line_user.is_blocked:
+        outbound.submit(oa_id)
@@ -0,0 +1,71 @@
+# app/services/segments.py - เงื่อนไขกรอง LineUser ชุดเดียวกับหน้าค้นหา (/api/search/users) ใช้ร่วมกับ broadcast
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Mapping
+
+import pytz
+from sqlalchemy import or_
+
+from app.models import LineAccount, LineUser, Tag
+
+BKK_ZONE = pytz.timezone("Asia/Bangkok")
+
+
+def parse_filters(args: Mapping) -> dict:
+    """
+    อ่านเงื่อนไขจาก query string / JSON (q, tags='1,2', oa_id, start_date, end_date แบบ YYYY-MM-DD)
+    raise ValueError ถ้ารูปแบบ tag id หรือวันที่ไม่ถูกต้อง
+    """
+    tags = args.get("tags") or ""
+    if isinstance(tags, (list, tuple)):
+        tag_ids = [int(tag_id) for tag_id in tags]
+    else:
+        tag_ids = [int(tag_id) for tag_id in str(tags).split(",") if tag_id.strip()]
+    oa_id = args.get("oa_id")
+    filters = {
+        "q": (args.get("q") or "").strip(),
+        "tags": tag_ids,
+        "oa_id": int(oa_id) if oa_id not in (None, "") else None,
+        "start_date": args.get("start_date") or None,
+        "end_date": args.get("end_date") or None,
+    }
+    for key in ("start_date", "end_date"):
+        if filters[key]:
+            datetime.strptime(filters[key], "%Y-%m-%d")
+    return filters
+
+
+def _bkk_day_start_utc(date_str: str, extra_days: int = 0) -> datetime:
+    naive = datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=extra_days)
+    return BKK_ZONE.localize(naive).astimezone(pytz.utc)
+
+
+def user_query(filters: dict):
+    """query ของ LineUser ตามเงื่อนไข (join LineAccount ไว้แล้ว, join tag อาจได้แถวซ้ำถ้าเลือกหลาย tag)"""
+    query = LineUser.query.join(LineAccount, LineUser.line_account_id == LineAccount.id)
+
+    if filters.get("q"):
+        search_pattern = f"%{filters['q']}%"
+        query = query.filter(
+            or_(
+                LineUser.display_name.ilike(search_pattern),
+                LineUser.nickname.ilike(search_pattern),
+                LineUser.phone.ilike(search_pattern),
+                LineUser.user_id.ilike(search_pattern),
+            )
+        )
+
+    if filters.get("tags"):
+        query = query.join(LineUser.tags).filter(Tag.id.in_(filters["tags"]))
+
+    if filters.get("oa_id"):
+        query = query.filter(LineUser.line_account_id == filters["oa_id"])
+
+    # วันที่ในเงื่อนไขเป็นวันตามเวลาไทย แปลงเป็นช่วงเวลา UTC
+    if filters.get("start_date"):
+        query = query.filter(LineUser.last_message_at >= _bkk_day_start_utc(filters["start_date"]))
+    if filters.get("end_date"):
+        query = query.filter(LineUser.last_message_at < _bkk_day_start_utc(filters["end_date"], extra_days=1))
+
+    return query
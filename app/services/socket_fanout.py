@@ -0,0 +1,114 @@
+# app/services/socket_fanout.py - กระจาย emit ของ Socket.IO ข้ามหลาย gunicorn worker ผ่าน message queue
+#
+# SOCKETIO_MESSAGE_QUEUE:
+#   ว่าง                                  -> process เดียว (ค่าเดิม) ต้องรัน gunicorn -w 1
+#   redis://host:6379/0                 -> production (ใช้ package redis ใน requirements.txt)
+#   sqlite:////abs/path/socketio_mq.db  -> ตัวแทนในเครื่องสำหรับ dev/ทดสอบหลาย worker บนเครื่องเดียว (ไม่ต้องมี broker)
+#   amqp://... หรือ URL อื่นที่ kombu รองรับ (ต้อง pip install kombu เพิ่ม)
+#
+# sticky session: การ handshake แบบ long-polling ต้องวิ่งไป worker เดิมทุกครั้ง
+#   - หลัง load balancer หลายเครื่อง: เปิด sticky session (cookie / ip_hash) ที่ LB
+#   - gunicorn หลาย worker บนเครื่องเดียวไม่มี sticky: ตั้ง SOCKETIO_WEBSOCKET_ONLY=1 ให้ client ต่อ websocket ตรง
+#     (เชื่อมต่อครั้งเดียวจบใน worker เดียว ไม่ต้องพึ่ง sticky)
+from __future__ import annotations
+
+import pickle
+import sqlite3
+import time
+from typing import Optional
+
+import socketio
+from flask import Flask
+
+
+class SQLiteManager(socketio.PubSubManager):
+    """
+    pub/sub ผ่านไฟล์ SQLite (แทน redis ตอน dev/ทดสอบ): publish = INSERT, listen = poll แถวที่ id ใหม่กว่าที่อ่านล่าสุด
+    ใช้ได้เฉพาะ worker ที่อยู่บนเครื่องเดียวกัน (เห็นไฟล์เดียวกัน)
+    """
+
+    name = "sqlite"
+
+    def __init__(self, url: str, channel: str = "socketio", write_only: bool = False, logger=None,
+                 poll_seconds: float = 0.05, retention_seconds: float = 60.0):
+        self.path = url[len("sqlite:///"):]
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS socketio_mq ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+                "payload BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _publish(self, data):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO socketio_mq (channel, payload, created_at) VALUES (?, ?, ?)",
+                (self.channel, pickle.dumps(data), time.time()),
+            )
+        finally:
+            conn.close()
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM socketio_mq").fetchone()[0]
+        next_prune = time.monotonic() + self.retention_seconds
+        while True:
+            rows = conn.execute(
+                "SELECT id, payload FROM socketio_mq WHERE id > ? AND channel = ? ORDER BY id",
+                (last_id, self.channel),
+            ).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield pickle.loads(payload)
+            if time.monotonic() >= next_prune:
+                conn.execute("DELETE FROM socketio_mq WHERE created_at < ?", (time.time() - self.retention_seconds,))
+                next_prune = time.monotonic() + self.retention_seconds
+            if not rows:
+                time.sleep(self.poll_seconds)
+
+
+def _manager_class(url: str):
+    if url.startswith("sqlite:///"):
+        return SQLiteManager
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.RedisManager
+    if url.startswith("kafka://"):
+        return socketio.KafkaManager
+    if url.startswith("zmq"):
+        return socketio.ZmqManager
+    return socketio.KombuManager
+
+
+def client_manager(app: Flask):
+    """
+    สร้าง client manager ตาม SOCKETIO_MESSAGE_QUEUE (None = ไม่ใช้ queue)
+    ทุก emit ที่ worker ได้รับจาก queue (รวมของ worker อื่น) จะถูกเก็บลง ring buffer ของ room_events ด้วย
+    ทำให้ client ที่ reconnect ไปเจอ worker ไหนก็ขอ event ที่พลาดไปได้
+    """
+    url: Optional[str] = app.config.get("SOCKETIO_MESSAGE_QUEUE") or None
+    if not url:
+        return None
+
+    from app.services import room_events  # import ภายในฟังก์ชันกันวงกลม (room_events ใช้ socketio ของ extensions)
+
+    room_events.configure(app)
+    base = _manager_class(url)
+
+    class RecordingManager(base):
+        def _handle_emit(self, message):
+            room_events.record_remote(message.get("event"), message.get("data"))
+            return super()._handle_emit(message)
+
+    return RecordingManager(
+        url,
+        channel=app.config.get("SOCKETIO_CHANNEL", "linebackend-socketio"),
+    )
@@ -0,0 +1,196 @@
+# app/services/summary_cache.py - LRU ของ payload สรุป conversation (sidebar) ต่อ (OA, user_id) พร้อม version stamp
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import event, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Conversation
+from app.services import metrics
+
+SummaryKey = Tuple[int, str]  # (line_account_id, user_id)
+
+MODE_LOCAL = "local"    # invalidate เฉพาะใน process นี้ (worker เดียว)
+MODE_SHARED = "shared"  # เช็ค conversation.cache_version ใน DB ทุกครั้งที่ hit (หลาย gunicorn worker เห็นตรงกัน)
+
+_DIRTY_KEY = "summary_cache_dirty"
+
+_lock = threading.Lock()
+# key -> (version, payload ที่ serialize เป็น JSON แล้ว)
+_entries: "OrderedDict[SummaryKey, Tuple[int, str]]" = OrderedDict()
+# key -> epoch ที่ถูก invalidate ล่าสุด (กันผู้อ่านที่โหลดข้อมูลเก่าไว้ก่อนเขียนกลับมาทับ)
+_tombstones: "OrderedDict[SummaryKey, int]" = OrderedDict()
+_tombstone_floor = 0
+_epoch = 0
+_hits = 0
+_misses = 0
+_listening = False
+
+
+def _enabled() -> bool:
+    return bool(current_app.config.get("SUMMARY_CACHE_ENABLED", True))
+
+
+def _mode() -> str:
+    return current_app.config.get("SUMMARY_CACHE_MODE", MODE_LOCAL)
+
+
+def _max_entries() -> int:
+    return int(current_app.config.get("SUMMARY_CACHE_MAX_ENTRIES", 5000))
+
+
+def _record(hits: int, misses: int) -> None:
+    global _hits, _misses
+    if hits:
+        metrics.incr("summary_cache_hits_total", hits)
+    if misses:
+        metrics.incr("summary_cache_misses_total", misses)
+    with _lock:
+        _hits += hits
+        _misses += misses
+        total = _hits + _misses
+        ratio = _hits / total if total else 0.0
+        size = len(_entries)
+    metrics.set_gauge("summary_cache_hit_ratio", round(ratio, 4))
+    metrics.set_gauge("summary_cache_entries", size)
+
+
+def _load_versions(keys) -> Dict[SummaryKey, int]:
+    return {
+        (oa_id, user_id): version
+        for oa_id, user_id, version in db.session.execute(
+            select(Conversation.line_account_id, Conversation.user_id, Conversation.cache_version)
+            .where(tuple_(Conversation.line_account_id, Conversation.user_id).in_(list(keys)))
+        )
+    }
+
+
+def begin() -> int:
+    """epoch ปัจจุบัน เรียกก่อนอ่าน DB แล้วส่งให้ put_many() (ข้อมูลที่อ่านก่อนถูก invalidate จะไม่ถูกเก็บ)"""
+    with _lock:
+        return _epoch
+
+
+def get_many(keys: Iterable[SummaryKey], versions: Optional[Dict[SummaryKey, int]] = None) -> Dict[SummaryKey, dict]:
+    """
+    คืน payload ที่อยู่ใน cache (dict ใหม่ทุกครั้ง แก้ไขได้)
+    - ส่ง versions มา (เช่น จากแถว conversation ที่โหลดแล้ว) จะนับเป็น hit เฉพาะ version ที่ตรงกัน
+    - โหมด shared ที่ไม่ได้ส่ง versions จะอ่าน cache_version จาก DB ใน query เดียว
+    - key ที่ถูกแก้ใน transaction นี้ (ยังไม่ commit) นับเป็น miss เสมอ ให้ผู้เรียก build จากข้อมูลล่าสุด
+    """
+    keys = list(keys)
+    if not keys or not _enabled():
+        return {}
+    pending = db.session.info.get(_DIRTY_KEY, ())
+    with _lock:
+        found = {}
+        for key in keys:
+            if key in pending:
+                continue
+            entry = _entries.get(key)
+            if entry is not None:
+                _entries.move_to_end(key)
+                found[key] = entry
+    if found and versions is None and _mode() == MODE_SHARED:
+        versions = _load_versions(found)
+    result = {}
+    stale = []
+    for key, (version, serialized) in found.items():
+        if versions is not None and versions.get(key) != version:
+            stale.append(key)
+            continue
+        result[key] = json.loads(serialized)
+    if stale:
+        metrics.incr("summary_cache_stale_total", len(stale))
+        with _lock:
+            for key in stale:
+                if _entries.get(key, (None,))[0] == found[key][0]:
+                    del _entries[key]
+    _record(len(result), len(keys) - len(result))
+    return result
+
+
+def put_many(entries: Dict[SummaryKey, Tuple[int, dict]], since: int) -> None:
+    """เก็บ payload ที่เพิ่ง build ({key: (cache_version, payload)}) ข้าม key ที่ถูกแก้หลัง since หรือยังไม่ commit"""
+    if not entries or not _enabled():
+        return
+    pending = db.session.info.get(_DIRTY_KEY, ())
+    serialized = {
+        key: (version, json.dumps(payload, ensure_ascii=False))
+        for key, (version, payload) in entries.items()
+        if key not in pending
+    }
+    max_entries = _max_entries()
+    evicted = 0
+    with _lock:
+        for key, entry in serialized.items():
+            if since < _tombstone_floor or _tombstones.get(key, -1) > since:
+                continue
+            _entries[key] = entry
+            _entries.move_to_end(key)
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+            evicted += 1
+        size = len(_entries)
+    if evicted:
+        metrics.incr("summary_cache_evictions_total", evicted)
+    metrics.set_gauge("summary_cache_entries", size)
+
+
+def invalidate(keys: Iterable[SummaryKey]) -> None:
+    """ลบ entry ของ conversation ที่เปลี่ยนแล้ว (เรียกหลัง commit/rollback)"""
+    global _epoch, _tombstone_floor
+    keys = list(keys)
+    if not keys:
+        return
+    max_tombstones = _max_entries()
+    with _lock:
+        _epoch += 1
+        for key in keys:
+            _entries.pop(key, None)
+            _tombstones[key] = _epoch
+            _tombstones.move_to_end(key)
+        while len(_tombstones) > max_tombstones:
+            _, dropped_epoch = _tombstones.popitem(last=False)
+            _tombstone_floor = max(_tombstone_floor, dropped_epoch)
+    metrics.incr("summary_cache_invalidations_total", len(keys))
+
+
+def clear() -> None:
+    global _epoch, _tombstone_floor
+    with _lock:
+        _epoch += 1
+        _tombstone_floor = _epoch
+        _entries.clear()
+        _tombstones.clear()
+
+
+def mark_dirty(keys: Iterable[SummaryKey], session: Optional[Session] = None) -> None:
+    """จด key ที่ถูกแก้ใน transaction นี้ แล้วค่อย invalidate ตอน commit (หรือ rollback)"""
+    info = (session if session is not None else db.session).info
+    info.setdefault(_DIRTY_KEY, set()).update((int(oa_id), str(user_id)) for oa_id, user_id in keys)
+
+
+def _flush_dirty(session: Session) -> None:
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    if dirty:
+        invalidate(dirty)
+
+
+def _after_rollback(session: Session) -> None:
+    # payload ที่ build ระหว่าง transaction อาจเห็นข้อมูลที่ยังไม่ commit ล้างทิ้งด้วย
+    _flush_dirty(session)
+
+
+def init_app(app: Flask) -> None:
+    global _listening
+    if not _listening:
+        event.listen(Session, "after_commit", _flush_dirty)
+        event.listen(Session, "after_rollback", _after_rollback)
+        _listening = True
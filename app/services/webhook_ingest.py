@@ -0,0 +1,220 @@
+# app/services/webhook_ingest.py - รับ webhook แบบ async: เขียนลงคิว DB แล้วให้ worker เบื้องหลังประมวลผล
+from __future__ import annotations
+
+import queue
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import exists
+from sqlalchemy.orm import aliased
+
+from app.extensions import db, socketio
+from app.models import LineAccount, WebhookInbox
+from app.services import metrics
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_FAILED = "failed"
+
+# งานที่ค้างสถานะ processing นานเกินนี้ถือว่า worker ตายไประหว่างทาง
+STALE_CLAIM_AFTER = timedelta(minutes=5)
+
+_lock = threading.Lock()
+_shards: List[queue.Queue] = []
+
+
+def is_async_enabled(app: Optional[Flask] = None) -> bool:
+    """เช็คว่าเปิดโหมด ingest แบบ async อยู่หรือไม่ (WEBHOOK_INGEST_MODE=sync เพื่อใช้แบบเดิม)"""
+    app = app or current_app
+    return str(app.config.get("WEBHOOK_INGEST_MODE", "async")).lower() == "async"
+
+
+def init_app(app: Flask) -> None:
+    """สตาร์ท worker pool ตอน request แรก (ไม่สตาร์ทตอนรันคำสั่ง CLI) ให้งานที่ค้างจากรอบก่อนถูกกู้โดยไม่ต้องรอ webhook ใหม่"""
+
+    @app.before_request
+    def _start_webhook_workers():
+        if is_async_enabled(app):
+            _ensure_workers(app)
+
+
+def enqueue(line_account_id: int, body: str, signature: Optional[str]) -> int:
+    """บันทึก body ดิบลงตาราง webhook_inbox แล้วปลุก worker ของ OA นั้น คืนค่า id ของงาน"""
+    row = WebhookInbox(line_account_id=line_account_id, body=body, signature=signature)
+    db.session.add(row)
+    db.session.commit()
+
+    _ensure_workers(current_app._get_current_object())
+    _dispatch(line_account_id)
+    return row.id
+
+
+def _dispatch(line_account_id: int) -> None:
+    # OA เดียวกันจะตกอยู่ shard เดิมเสมอ จึงถูกประมวลผลตามลำดับ
+    _shards[line_account_id % len(_shards)].put(line_account_id)
+    _publish_queue_depth()
+
+
+def _publish_queue_depth() -> None:
+    metrics.set_gauge("webhook_queue_depth", sum(inbox.qsize() for inbox in _shards))
+
+
+def _ensure_workers(app: Flask) -> None:
+    """สตาร์ท worker pool และรอบกวาดงานค้าง (ครั้งเดียวต่อ process)"""
+    if _shards:
+        return
+    with _lock:
+        if _shards:
+            return
+        count = max(1, int(app.config.get("WEBHOOK_WORKER_COUNT", 4)))
+        shards = [queue.Queue() for _ in range(count)]
+        for inbox in shards:
+            socketio.start_background_task(_worker_loop, app, inbox)
+        _shards.extend(shards)
+        socketio.start_background_task(_sweep_loop, app)
+
+
+def _worker_loop(app: Flask, inbox: queue.Queue) -> None:
+    while True:
+        line_account_id = inbox.get()
+        _publish_queue_depth()
+        try:
+            with app.app_context():
+                _drain_account(line_account_id)
+        except Exception:
+            traceback.print_exc()
+
+
+def _sweep_loop(app: Flask) -> None:
+    interval = float(app.config.get("WEBHOOK_SWEEP_SECONDS", 60))
+    while True:
+        _recover_pending(app)
+        socketio.sleep(interval)
+
+
+def _recover_pending(app: Flask) -> None:
+    """
+    นำงานที่ค้างในตาราง (จากการรีสตาร์ท, worker ล่ม หรือ OA ที่ process อื่นถือไว้แล้วตายไป) กลับเข้าคิว
+    รันเป็นรอบ ๆ ทุก WEBHOOK_SWEEP_SECONDS
+    """
+    with app.app_context():
+        try:
+            stale_before = datetime.now(timezone.utc) - STALE_CLAIM_AFTER
+            WebhookInbox.query.filter(
+                WebhookInbox.status == STATUS_PROCESSING,
+                WebhookInbox.claimed_at < stale_before,
+            ).update({"status": STATUS_PENDING}, synchronize_session=False)
+            db.session.commit()
+
+            account_ids = [
+                oa_id for (oa_id,) in db.session.query(WebhookInbox.line_account_id)
+                .filter(WebhookInbox.status == STATUS_PENDING)
+                .distinct()
+            ]
+        except Exception:
+            db.session.rollback()
+            traceback.print_exc()
+            return
+
+    for oa_id in account_ids:
+        _dispatch(oa_id)
+
+
+def _claim_next(line_account_id: int) -> Optional[WebhookInbox]:
+    """
+    จองงานที่เก่าที่สุดของ OA แบบ atomic (กันสอง worker หยิบงานเดียวกัน)
+    OA ละงานเดียวทั้งระบบ: ถ้ามีงานของ OA นี้ค้าง processing (worker ของ process อื่น) คืน None
+    ให้ worker นั้นทำต่อตามลำดับ (ถ้ามันตาย รอบกวาดจะคืนงานให้หลัง STALE_CLAIM_AFTER)
+    """
+    busy = aliased(WebhookInbox)
+    while True:
+        # ล็อกแถว OA ให้การจองของ OA เดียวกันจากหลาย process เกิดทีละราย (SQLite เขียนทีละ transaction อยู่แล้ว)
+        db.session.query(LineAccount.id).filter_by(id=line_account_id).with_for_update().first()
+        candidate = (
+            db.session.query(WebhookInbox.id)
+            .filter_by(line_account_id=line_account_id, status=STATUS_PENDING)
+            .order_by(WebhookInbox.id.asc())
+            .first()
+        )
+        if candidate is None:
+            db.session.commit()
+            return None
+
+        claimed = (
+            WebhookInbox.query.filter(
+                WebhookInbox.id == candidate.id,
+                WebhookInbox.status == STATUS_PENDING,
+                ~exists().where(
+                    busy.line_account_id == line_account_id,
+                    busy.status == STATUS_PROCESSING,
+                ),
+            )
+            .update(
+                {
+                    "status": STATUS_PROCESSING,
+                    "attempts": WebhookInbox.attempts + 1,
+                    "claimed_at": datetime.now(timezone.utc),
+                },
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(WebhookInbox, candidate.id)
+        if db.session.query(
+            exists().where(
+                WebhookInbox.line_account_id == line_account_id,
+                WebhookInbox.status == STATUS_PROCESSING,
+            )
+        ).scalar():
+            return None
+
+
+def _drain_account(line_account_id: int) -> None:
+    # import ภายในฟังก์ชันกันวงกลม (routes import service นี้)
+    from app.blueprints.line_webhook.routes import process_inbox_body
+
+    while True:
+        job = _claim_next(line_account_id)
+        if job is None:
+            return
+
+        job_id, attempts = job.id, job.attempts
+        try:
+            process_inbox_body(job.line_account_id, job.body, job.signature)
+        except Exception as e:
+            db.session.rollback()
+            traceback.print_exc()
+            if _record_failure(job_id, attempts, e):
+                # หยุด OA นี้ไว้ก่อนเพื่อรักษาลำดับ แล้วลองใหม่หลัง backoff
+                socketio.start_background_task(
+                    _redispatch_later, line_account_id, min(60, 2 ** attempts)
+                )
+                return
+            continue
+
+        WebhookInbox.query.filter_by(id=job_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def _record_failure(job_id: int, attempts: int, error: Exception) -> bool:
+    """บันทึก error ของงาน คืน True ถ้ายังจะลองใหม่ได้"""
+    max_attempts = int(current_app.config.get("WEBHOOK_MAX_ATTEMPTS", 5))
+    will_retry = attempts < max_attempts
+    WebhookInbox.query.filter_by(id=job_id).update(
+        {
+            "status": STATUS_PENDING if will_retry else STATUS_FAILED,
+            "last_error": f"{type(error).__name__}: {error}"[:2000],
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return will_retry
+
+
+def _redispatch_later(line_account_id: int, delay_seconds: float) -> None:
+    socketio.sleep(delay_seconds)
+    _dispatch(line_account_id)
@@ -32,3 +32,122 @@ class Config:
     
     MAX_CONTENT_LENGTH = 25 * 1024 * 1024
     UPLOAD_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
+
+    # --- Webhook ingest ---
+    # "async" = ตรวจ signature แล้วเก็บลงคิว webhook_inbox ตอบ LINE ทันที / "sync" = ประมวลผลใน request แบบเดิม
+    WEBHOOK_INGEST_MODE = os.environ.get("WEBHOOK_INGEST_MODE", "async")
+    WEBHOOK_WORKER_COUNT = int(os.environ.get("WEBHOOK_WORKER_COUNT", "4"))
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "5"))
+    # ทุกกี่วินาทีคืนงานที่ค้าง processing นานเกิน (worker ตาย) และปลุก OA ที่ยังมีงาน pending
+    WEBHOOK_SWEEP_SECONDS = float(os.environ.get("WEBHOOK_SWEEP_SECONDS", "60"))
+
+    # --- LINE client registry ---
+    LINE_REGISTRY_TTL_SECONDS = int(os.environ.get("LINE_REGISTRY_TTL_SECONDS", "300"))
+    LINE_HTTP_POOL_MAXSIZE = int(os.environ.get("LINE_HTTP_POOL_MAXSIZE", "50"))
+
+    # --- LINE profile enrichment ---
+    PROFILE_WORKER_COUNT = int(os.environ.get("PROFILE_WORKER_COUNT", "4"))
+    PROFILE_FETCH_PER_OA_CONCURRENCY = int(os.environ.get("PROFILE_FETCH_PER_OA_CONCURRENCY", "2"))
+    PROFILE_CACHE_MAX_ENTRIES = int(os.environ.get("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+    PROFILE_CACHE_TTL_SECONDS = int(os.environ.get("PROFILE_CACHE_TTL_SECONDS", str(6 * 3600)))
+    PROFILE_REFRESH_AFTER_HOURS = int(os.environ.get("PROFILE_REFRESH_AFTER_HOURS", str(24 * 7)))
+    # ดึงโปรไฟล์ไม่สำเร็จ (เช่น 404 user เลิกติดตาม) รอเท่านี้ก่อนลองใหม่ ไม่ให้วนกลับมาทุกรอบ refresh
+    PROFILE_FAILED_RETRY_HOURS = int(os.environ.get("PROFILE_FAILED_RETRY_HOURS", "24"))
+
+    # --- Inbound media pipeline ---
+    MEDIA_WORKER_COUNT = int(os.environ.get("MEDIA_WORKER_COUNT", "4"))
+    MEDIA_MAX_ATTEMPTS = int(os.environ.get("MEDIA_MAX_ATTEMPTS", "3"))
+    MEDIA_STREAM_CHUNK_BYTES = int(os.environ.get("MEDIA_STREAM_CHUNK_BYTES", str(256 * 1024)))
+    # วิดีโอ/เสียงที่ LINE ยังแปลงไฟล์อยู่: เช็คสถานะทุกกี่วินาที และรอได้นานสุดเท่าไรก่อนถือว่า failed
+    MEDIA_TRANSCODING_POLL_SECONDS = float(os.environ.get("MEDIA_TRANSCODING_POLL_SECONDS", "10"))
+    MEDIA_TRANSCODING_MAX_WAIT_SECONDS = float(os.environ.get("MEDIA_TRANSCODING_MAX_WAIT_SECONDS", "900"))
+    # งานที่ค้าง processing นานเกินนี้ (worker/process ตายระหว่างดาวน์โหลด) ถูกคืนให้ worker อื่นหยิบ
+    MEDIA_CLAIM_LEASE_SECONDS = int(os.environ.get("MEDIA_CLAIM_LEASE_SECONDS", "600"))
+    S3_MULTIPART_CHUNK_BYTES = int(os.environ.get("S3_MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
+    S3_MULTIPART_CONCURRENCY = int(os.environ.get("S3_MULTIPART_CONCURRENCY", "2"))
+
+    # --- LINE API rate limit ---
+    # local = ใน process, redis://... หรือ sqlite:////path = ใช้ bucket ร่วมกันหลาย worker (ดู app/services/rate_limit.py)
+    LINE_RATE_LIMIT_BACKEND = os.environ.get("LINE_RATE_LIMIT_BACKEND", "local")
+    # ทับค่า default ต่อกลุ่ม endpoint เช่น "push=200,multicast=20:40" (ต่อวินาที[:burst])
+    LINE_RATE_LIMITS = os.environ.get("LINE_RATE_LIMITS", "")
+    # รอ budget ได้นานสุดเท่านี้ เกินนั้นงานเบื้องหลังจะเลื่อนตัวเองไปแทน
+    LINE_RATE_MAX_WAIT_SECONDS = float(os.environ.get("LINE_RATE_MAX_WAIT_SECONDS", "5"))
+    # โดน 429 จาก LINE แล้วพัก bucket นั้นกี่วินาที
+    LINE_RATE_429_COOLDOWN_SECONDS = float(os.environ.get("LINE_RATE_429_COOLDOWN_SECONDS", "1"))
+
+    # --- LINE OA circuit breaker ---
+    # error ติดกัน (5xx / network) กี่ครั้งถึงเปิดวงจร (401/403 หรือ health check ว่า token ใช้ไม่ได้ = เปิดทันที)
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    # พักกี่วินาทีก่อนปล่อย probe (half-open) ถ้า probe ล้มเหลวจะพักนานขึ้นเท่าตัวจนถึงค่าสูงสุด
+    CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get("CIRCUIT_COOLDOWN_SECONDS", "30"))
+    CIRCUIT_MAX_COOLDOWN_SECONDS = float(os.environ.get("CIRCUIT_MAX_COOLDOWN_SECONDS", "600"))
+
+    # --- Segment broadcast ---
+    # ผู้รับต่อ multicast 1 ครั้ง (LINE รับได้ไม่เกิน 500)
+    BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "500"))
+    BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", "5"))
+
+    # --- Scheduled messages ---
+    # timer wheel ในหน่วยความจำ เดินทุก tick; DB ถูกอ่านทุกครึ่ง window เพื่อโหลดงานช่วงเวลาข้างหน้า (ดู app/services/scheduler.py)
+    SCHEDULE_TICK_SECONDS = float(os.environ.get("SCHEDULE_TICK_SECONDS", "1"))
+    SCHEDULE_WHEEL_SLOTS = int(os.environ.get("SCHEDULE_WHEEL_SLOTS", "512"))
+    SCHEDULE_WINDOW_SECONDS = int(os.environ.get("SCHEDULE_WINDOW_SECONDS", "600"))
+    SCHEDULE_LOAD_LIMIT = int(os.environ.get("SCHEDULE_LOAD_LIMIT", "10000"))
+    # เตือนลูกค้าอัตโนมัติหลังแอดมินตั้งสถานะแชท เช่น "deposit=30,withdraw=60" (นาที) ว่าง = ปิด
+    # เปลี่ยนสถานะไปเป็นอย่างอื่นก่อนถึงเวลา ข้อความเตือนจะถูกยกเลิก
+    STATUS_REMINDER_MINUTES = os.environ.get("STATUS_REMINDER_MINUTES", "")
+    STATUS_REMINDER_TEXT_DEPOSIT = os.environ.get(
+        "STATUS_REMINDER_TEXT_DEPOSIT",
+        "แอดมินขอสอบถามรายการฝากเงินค่ะ หากโอนเรียบร้อยแล้ว รบกวนส่งสลิปให้แอดมินตรวจสอบด้วยนะคะ",
+    )
+    STATUS_REMINDER_TEXT_WITHDRAW = os.environ.get(
+        "STATUS_REMINDER_TEXT_WITHDRAW",
+        "แอดมินกำลังดำเนินการรายการถอนเงินให้ค่ะ หากยังไม่ได้รับยอด แจ้งแอดมินได้เลยนะคะ",
+    )
+
+    # --- Outbound send queue ---
+    # ข้อความที่แอดมินส่งถูกบันทึกเป็น pending แล้วให้ worker ส่งไป LINE (ลำดับเดิมต่อ OA, backoff 2^n วินาที)
+    OUTBOUND_WORKER_COUNT = int(os.environ.get("OUTBOUND_WORKER_COUNT", "4"))
+    OUTBOUND_MAX_ATTEMPTS = int(os.environ.get("OUTBOUND_MAX_ATTEMPTS", "6"))
+    OUTBOUND_MAX_BACKOFF_SECONDS = int(os.environ.get("OUTBOUND_MAX_BACKOFF_SECONDS", "60"))
+    # ทุกกี่วินาทีปลุก OA ที่มีข้อความถึงเวลาส่ง (backoff ครบ / lease ของ worker ที่ตายหมดอายุ)
+    OUTBOUND_SWEEP_SECONDS = float(os.environ.get("OUTBOUND_SWEEP_SECONDS", "30"))
+
+    # --- Conversation summary cache ---
+    SUMMARY_CACHE_ENABLED = os.environ.get("SUMMARY_CACHE_ENABLED", "1") == "1"
+    SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+    # local = invalidate ภายใน process, shared = ตรวจ conversation.cache_version ใน DB ก่อนใช้ (หลาย gunicorn worker)
+    SUMMARY_CACHE_MODE = os.environ.get("SUMMARY_CACHE_MODE", "local")
+
+    # --- Socket.IO multi-worker ---
+    # ว่าง = process เดียว, redis://... หรือ sqlite:////abs/path/socketio_mq.db (ตัวแทนในเครื่อง) ดู app/services/socket_fanout.py
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+    SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "linebackend-socketio")
+    # 1 = client ต่อ websocket ตรง (ไม่ใช้ long-polling) ใช้เมื่อ LB/gunicorn หลาย worker ไม่มี sticky session
+    SOCKETIO_WEBSOCKET_ONLY = os.environ.get("SOCKETIO_WEBSOCKET_ONLY", "0") == "1"
+
+    # --- Realtime room events ---
+    # อายุ cache OA -> ห้อง group_* (กันกรณีแก้กลุ่มจาก worker อื่น)
+    OA_ROOMS_TTL_SECONDS = int(os.environ.get("OA_ROOMS_TTL_SECONDS", "60"))
+    # จำนวน event ล่าสุดต่อห้อง group_* ที่เก็บไว้ส่งซ้ำให้ client ที่ reconnect
+    ROOM_EVENT_BUFFER_SIZE = int(os.environ.get("ROOM_EVENT_BUFFER_SIZE", "200"))
+    # พัก emit ไว้กี่ ms เพื่อรวม new_message / render_conversation_update ของ conversation เดียวกัน (0 = ส่งทันที)
+    ROOM_EMIT_COALESCE_MS = int(os.environ.get("ROOM_EMIT_COALESCE_MS", "100"))
+
+    # --- Webhook idempotency ---
+    WEBHOOK_DEDUP_LRU_SIZE = int(os.environ.get("WEBHOOK_DEDUP_LRU_SIZE", "50000"))
+
+    # --- Load test ---
+    # ส่ง header X-DB-Query-Count ทุก response (เปิดเฉพาะตอนยิง load test)
+    ENABLE_QUERY_COUNT_HEADER = os.environ.get("ENABLE_QUERY_COUNT_HEADER", "0") == "1"
+    # ชี้ไปที่ fake LINE API ตอน load test (ว่าง = ใช้ api.line.me / api-data.line.me ตาม SDK)
+    LINE_API_ENDPOINT = os.environ.get("LINE_API_ENDPOINT")
+    LINE_API_DATA_ENDPOINT = os.environ.get("LINE_API_DATA_ENDPOINT")
+
+    # --- Webhook admission control ---
+    # เกิน limit แล้วจะเขียน body ลงดิสก์แทนการถือ DB connection ไว้ใน greenlet
+    WEBHOOK_MAX_IN_FLIGHT = int(os.environ.get("WEBHOOK_MAX_IN_FLIGHT", "64"))
+    WEBHOOK_MAX_IN_FLIGHT_PER_OA = int(os.environ.get("WEBHOOK_MAX_IN_FLIGHT_PER_OA", "16"))
+    WEBHOOK_SPOOL_DIR = os.environ.get("WEBHOOK_SPOOL_DIR") or os.path.join(basedir, "instance", "webhook_spool")
+    WEBHOOK_SPOOL_POLL_SECONDS = float(os.environ.get("WEBHOOK_SPOOL_POLL_SECONDS", "2"))
@@ -38,4 +38,61 @@ def create_admin(email, password):
         db.session.commit()
 
         print("--- Commit finished ---")
-        click.echo("Admin created")
\ No newline at end of file
+        click.echo("Admin created")
+
+@app.cli.command("fake-line-api")
+@click.option("--port", default=9900, show_default=True)
+@click.option("--image-kb", default=200, show_default=True, help="ขนาดไฟล์ที่ตอบกลับจาก /content")
+@click.option("--latency-ms", default=0, show_default=True, help="หน่วงทุก response เพื่อจำลอง LINE")
+def fake_line_api(port, image_kb, latency_ms):
+    """รัน fake LINE API (profile/content/push) ให้แอปชี้ LINE_API_ENDPOINT มาที่นี่ตอน load test"""
+    import time
+    from app.services import loadgen
+
+    loadgen.start_fake_line_api(port, image_kb=image_kb, latency_ms=latency_ms)
+    click.echo(f"Fake LINE API on http://127.0.0.1:{port} (Ctrl+C เพื่อหยุด)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.cli.command("replay-webhooks")
+@click.option("--base-url", default="http://127.0.0.1:5000", show_default=True)
+@click.option("--requests", "total_requests", default=1000, show_default=True)
+@click.option("--rate", default=50.0, show_default=True, help="request ต่อวินาที (0 = ยิงเต็มที่)")
+@click.option("--concurrency", default=16, show_default=True)
+@click.option("--users", default=1000, show_default=True, help="จำนวน LINE user จำลอง")
+@click.option("--events-per-body", default=3, show_default=True)
+@click.option("--oa-limit", default=0, show_default=True, help="จำกัดจำนวน OA ที่ยิง (0 = ทุก OA)")
+@click.option(
+    "--ingest-mode", type=click.Choice(["sync", "server"]), default="sync", show_default=True,
+    help="sync = ให้ server ประมวลผลใน request เพื่อนับ query ครบ / server = ใช้ WEBHOOK_INGEST_MODE ของ server "
+         "(async จะนับแค่ query ที่เขียนลงคิว)",
+)
+def replay_webhooks(base_url, total_requests, rate, concurrency, users, events_per_body, oa_limit, ingest_mode):
+    """ยิง webhook ที่เซ็นด้วย channel_secret ของแต่ละ OA แล้วสรุป latency / throughput / query ต่อ request"""
+    import json
+    from app.models import LineAccount
+    from app.services import loadgen
+
+    with app.app_context():
+        query = LineAccount.query.filter(
+            LineAccount.webhook_path.isnot(None), LineAccount.channel_secret.isnot(None)
+        ).order_by(LineAccount.id.asc())
+        if oa_limit:
+            query = query.limit(oa_limit)
+        accounts = [loadgen.TargetAccount(a.webhook_path, a.channel_secret) for a in query]
+
+    if not accounts:
+        click.echo("No LineAccount with webhook_path/channel_secret")
+        return
+
+    click.echo(f"Replaying {total_requests} requests to {len(accounts)} OA(s) at {rate}/s, concurrency {concurrency}")
+    report = loadgen.replay(
+        base_url, accounts, total_requests, rate, concurrency,
+        user_pool=users, events_per_body=events_per_body,
+        ingest_mode="sync" if ingest_mode == "sync" else None,
+    )
+    click.echo(json.dumps(report.summary(), indent=2))
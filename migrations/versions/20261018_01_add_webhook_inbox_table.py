@@ -0,0 +1,46 @@
+# migrations/versions/20261018_01_add_webhook_inbox_table.py - สร้างตารางคิว webhook ขาเข้า
+"""add webhook inbox table
+
+Revision ID: 20261018_01
+Revises: 20251019_02
+Create Date: 2026-10-18 09:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_01"
+down_revision: Union[str, None] = "20251019_02"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "webhook_inbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("line_account_id", sa.Integer(), nullable=False),
+        sa.Column("signature", sa.String(length=255), nullable=True),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), server_default="pending", nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("received_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["line_account_id"], ["line_account.id"], ondelete="CASCADE"),
+    )
+    op.create_index(
+        "ix_webhook_inbox_oa_status_id",
+        "webhook_inbox",
+        ["line_account_id", "status", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_webhook_inbox_oa_status_id", table_name="webhook_inbox")
+    op.drop_table("webhook_inbox")
@@ -0,0 +1,31 @@
+# migrations/versions/20261018_02_add_profile_refreshed_at_to_line_user.py - เก็บเวลาดึงโปรไฟล์ LINE ล่าสุด
+"""add profile_refreshed_at to line_user
+
+Revision ID: 20261018_02
+Revises: 20261018_01
+Create Date: 2026-10-18 10:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_02"
+down_revision: Union[str, None] = "20261018_01"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_user", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("profile_refreshed_at", sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f("ix_line_user_profile_refreshed_at"), ["profile_refreshed_at"], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_user", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_line_user_profile_refreshed_at"))
+        batch_op.drop_column("profile_refreshed_at")
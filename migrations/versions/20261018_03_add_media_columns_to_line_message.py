@@ -0,0 +1,33 @@
+# migrations/versions/20261018_03_add_media_columns_to_line_message.py - คอลัมน์สำหรับดึงไฟล์สื่อเบื้องหลัง
+"""add line_message_id and media_status to line_message
+
+Revision ID: 20261018_03
+Revises: 20261018_02
+Create Date: 2026-10-18 11:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_03"
+down_revision: Union[str, None] = "20261018_02"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("line_message_id", sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column("media_status", sa.String(length=20), nullable=True))
+        batch_op.create_index(batch_op.f("ix_line_message_media_status"), ["media_status"], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_line_message_media_status"))
+        batch_op.drop_column("media_status")
+        batch_op.drop_column("line_message_id")
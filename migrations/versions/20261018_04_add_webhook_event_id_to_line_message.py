@@ -0,0 +1,33 @@
+# migrations/versions/20261018_04_add_webhook_event_id_to_line_message.py - unique key กัน webhook event ซ้ำ
+"""add webhook_event_id and unique keys to line_message
+
+Revision ID: 20261018_04
+Revises: 20261018_03
+Create Date: 2026-10-18 12:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_04"
+down_revision: Union[str, None] = "20261018_03"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("webhook_event_id", sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint("uq_line_message_webhook_event_id", ["webhook_event_id"])
+        batch_op.create_unique_constraint("uq_line_message_line_message_id", ["line_message_id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.drop_constraint("uq_line_message_line_message_id", type_="unique")
+        batch_op.drop_constraint("uq_line_message_webhook_event_id", type_="unique")
+        batch_op.drop_column("webhook_event_id")
@@ -0,0 +1,35 @@
+# migrations/versions/20261018_05_add_media_metadata_to_line_message.py - metadata ของ video/audio/file
+"""add media metadata columns to line_message
+
+Revision ID: 20261018_05
+Revises: 20261018_04
+Create Date: 2026-10-18 13:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_05"
+down_revision: Union[str, None] = "20261018_04"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("media_content_type", sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column("media_size", sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column("media_duration_ms", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("file_name", sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.drop_column("file_name")
+        batch_op.drop_column("media_duration_ms")
+        batch_op.drop_column("media_size")
+        batch_op.drop_column("media_content_type")
@@ -0,0 +1,97 @@
+# migrations/versions/20261018_06_add_conversation_table.py - ตาราง read-model ของ sidebar แชท + เติมข้อมูลจากของเดิม
+"""add conversation table
+
+Revision ID: 20261018_06
+Revises: 20261018_05
+Create Date: 2026-10-18 14:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_06"
+down_revision: Union[str, None] = "20261018_05"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversation",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("line_account_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.String(length=255), nullable=False),
+        sa.Column("line_user_id", sa.Integer(), nullable=True),
+        sa.Column("last_message_id", sa.Integer(), nullable=True),
+        sa.Column("last_message_at", sa.DateTime(), nullable=True),
+        sa.Column("last_message_type", sa.String(length=50), nullable=True),
+        sa.Column("last_message_preview", sa.String(length=255), nullable=True),
+        sa.Column("last_message_is_outgoing", sa.Boolean(), server_default=sa.false(), nullable=False),
+        sa.Column("unread_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("status", sa.String(length=50), server_default="read", nullable=False),
+        sa.Column("status_rank", sa.SmallInteger(), server_default="0", nullable=False),
+        sa.Column("read_by_admin_id", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(["line_account_id"], ["line_account.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["line_user_id"], ["line_user.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["read_by_admin_id"], ["user.id"], ondelete="SET NULL"),
+        sa.UniqueConstraint("line_account_id", "user_id", name="uq_conversation_oa_user"),
+    )
+    op.create_index("ix_conversation_line_user_id", "conversation", ["line_user_id"], unique=False)
+    op.create_index(
+        "ix_conversation_rank_last_message", "conversation",
+        ["status_rank", "last_message_at", "id"], unique=False,
+    )
+    op.create_index(
+        "ix_conversation_oa_rank_last_message", "conversation",
+        ["line_account_id", "status_rank", "last_message_at", "id"], unique=False,
+    )
+    op.create_index(
+        "ix_conversation_status_last_message", "conversation",
+        ["status", "last_message_at", "id"], unique=False,
+    )
+
+    # เติมข้อมูลจากข้อความที่มีอยู่แล้ว (ข้อความล่าสุดต่อ user + จำนวนที่ยังไม่อ่านตาม last_read_timestamp)
+    op.execute(
+        """
+        INSERT INTO conversation (
+            line_account_id, user_id, line_user_id,
+            last_message_id, last_message_at, last_message_type, last_message_preview, last_message_is_outgoing,
+            unread_count, status, status_rank, read_by_admin_id
+        )
+        SELECT
+            lu.line_account_id, lu.user_id, lu.id,
+            m.id, m.timestamp, m.message_type,
+            CASE WHEN m.message_type IN ('text', 'event') THEN substr(m.message_text, 1, 255) END,
+            COALESCE(m.is_outgoing, false),
+            (
+                SELECT count(*) FROM line_message u
+                WHERE u.line_account_id = lu.line_account_id
+                  AND u.user_id = lu.user_id
+                  AND u.is_outgoing = false
+                  AND (lu.last_read_timestamp IS NULL OR u.timestamp > lu.last_read_timestamp)
+            ),
+            lu.status,
+            CASE WHEN lower(lu.status) = 'closed' THEN 1 ELSE 0 END,
+            lu.read_by_admin_id
+        FROM line_user lu
+        JOIN line_message m ON m.id = (
+            SELECT m2.id FROM line_message m2
+            WHERE m2.line_account_id = lu.line_account_id AND m2.user_id = lu.user_id
+            ORDER BY m2.timestamp DESC, m2.id DESC
+            LIMIT 1
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_conversation_status_last_message", table_name="conversation")
+    op.drop_index("ix_conversation_oa_rank_last_message", table_name="conversation")
+    op.drop_index("ix_conversation_rank_last_message", table_name="conversation")
+    op.drop_index("ix_conversation_line_user_id", table_name="conversation")
+    op.drop_table("conversation")
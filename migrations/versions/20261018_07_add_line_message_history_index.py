@@ -0,0 +1,31 @@
+# migrations/versions/20261018_07_add_line_message_history_index.py - index สำหรับ keyset pagination ของประวัติแชท
+"""add composite index for message history paging
+
+Revision ID: 20261018_07
+Revises: 20261018_06
+Create Date: 2026-10-18 15:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_07"
+down_revision: Union[str, None] = "20261018_06"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_line_message_oa_user_time_id",
+        "line_message",
+        ["line_account_id", "user_id", "timestamp", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_line_message_oa_user_time_id", table_name="line_message")
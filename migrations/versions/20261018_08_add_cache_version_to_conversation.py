@@ -0,0 +1,29 @@
+# migrations/versions/20261018_08_add_cache_version_to_conversation.py - version stamp ของ conversation สำหรับ summary cache
+"""add cache_version to conversation
+
+Revision ID: 20261018_08
+Revises: 20261018_07
+Create Date: 2026-10-18 16:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_08"
+down_revision: Union[str, None] = "20261018_07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("conversation", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("cache_version", sa.BigInteger(), nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("conversation", schema=None) as batch_op:
+        batch_op.drop_column("cache_version")
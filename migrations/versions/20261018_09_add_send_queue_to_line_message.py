@@ -0,0 +1,39 @@
+# migrations/versions/20261018_09_add_send_queue_to_line_message.py - สถานะคิวส่งข้อความขาออก (outbound worker)
+"""add send queue columns to line_message
+
+Revision ID: 20261018_09
+Revises: 20261018_08
+Create Date: 2026-10-18 17:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_09"
+down_revision: Union[str, None] = "20261018_08"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("send_status", sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column("send_attempts", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("send_next_at", sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column("send_retry_key", sa.String(length=36), nullable=True))
+        batch_op.create_index(
+            "ix_line_message_send_queue", ["line_account_id", "send_status", "id"], unique=False
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.drop_index("ix_line_message_send_queue")
+        batch_op.drop_column("send_retry_key")
+        batch_op.drop_column("send_next_at")
+        batch_op.drop_column("send_attempts")
+        batch_op.drop_column("send_status")
@@ -0,0 +1,90 @@
+# migrations/versions/20261018_10_add_broadcast_tables.py - ตาราง broadcast / batch / ผู้รับ สำหรับส่ง multicast ตาม segment
+"""add broadcast tables
+
+Revision ID: 20261018_10
+Revises: 20261018_09
+Create Date: 2026-10-18 18:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_10"
+down_revision: Union[str, None] = "20261018_09"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "broadcast",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("admin_user_id", sa.Integer(), nullable=True),
+        sa.Column("filters", sa.Text(), nullable=False),
+        sa.Column("message_type", sa.String(length=20), nullable=False),
+        sa.Column("message_text", sa.Text(), nullable=True),
+        sa.Column("message_url", sa.String(length=512), nullable=True),
+        sa.Column("package_id", sa.String(length=50), nullable=True),
+        sa.Column("sticker_id", sa.String(length=50), nullable=True),
+        sa.Column("status", sa.String(length=20), server_default="resolving", nullable=False),
+        sa.Column("total_recipients", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("skipped_blocked", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("sent_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("failed_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["admin_user_id"], ["user.id"], ondelete="SET NULL"),
+    )
+    op.create_index("ix_broadcast_status", "broadcast", ["status"], unique=False)
+
+    op.create_table(
+        "broadcast_batch",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("broadcast_id", sa.Integer(), nullable=False),
+        sa.Column("line_account_id", sa.Integer(), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=20), server_default="pending", nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("recipient_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("retry_key", sa.String(length=36), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["broadcast_id"], ["broadcast.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["line_account_id"], ["line_account.id"], ondelete="CASCADE"),
+    )
+    op.create_index(
+        "ix_broadcast_batch_broadcast_status_seq",
+        "broadcast_batch",
+        ["broadcast_id", "status", "seq"],
+        unique=False,
+    )
+
+    op.create_table(
+        "broadcast_recipient",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), primary_key=True),
+        sa.Column("broadcast_id", sa.Integer(), nullable=False),
+        sa.Column("batch_id", sa.Integer(), nullable=False),
+        sa.Column("line_account_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=20), server_default="pending", nullable=False),
+        sa.ForeignKeyConstraint(["broadcast_id"], ["broadcast.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["batch_id"], ["broadcast_batch.id"], ondelete="CASCADE"),
+        sa.UniqueConstraint("broadcast_id", "line_account_id", "user_id", name="uq_broadcast_recipient"),
+    )
+    op.create_index("ix_broadcast_recipient_batch_id", "broadcast_recipient", ["batch_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_broadcast_recipient_batch_id", table_name="broadcast_recipient")
+    op.drop_table("broadcast_recipient")
+    op.drop_index("ix_broadcast_batch_broadcast_status_seq", table_name="broadcast_batch")
+    op.drop_table("broadcast_batch")
+    op.drop_index("ix_broadcast_status", table_name="broadcast")
+    op.drop_table("broadcast")
@@ -0,0 +1,60 @@
+# migrations/versions/20261018_11_add_scheduled_message_table.py - ตารางข้อความตั้งเวลาส่ง + index (status, due_at) ของ dispatcher
+"""add scheduled_message table
+
+Revision ID: 20261018_11
+Revises: 20261018_10
+Create Date: 2026-10-18 20:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_11"
+down_revision: Union[str, None] = "20261018_10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "scheduled_message",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("admin_user_id", sa.Integer(), nullable=True),
+        sa.Column("line_account_id", sa.Integer(), nullable=True),
+        sa.Column("user_id", sa.String(length=255), nullable=True),
+        sa.Column("filters", sa.Text(), nullable=True),
+        sa.Column("message_type", sa.String(length=20), nullable=False),
+        sa.Column("message_text", sa.Text(), nullable=True),
+        sa.Column("message_url", sa.String(length=512), nullable=True),
+        sa.Column("package_id", sa.String(length=50), nullable=True),
+        sa.Column("sticker_id", sa.String(length=50), nullable=True),
+        sa.Column("due_at", sa.DateTime(), nullable=False),
+        sa.Column("status", sa.String(length=20), server_default="scheduled", nullable=False),
+        sa.Column("trigger_status", sa.String(length=50), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("dispatched_at", sa.DateTime(), nullable=True),
+        sa.Column("line_message_id", sa.Integer(), nullable=True),
+        sa.Column("broadcast_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["admin_user_id"], ["user.id"], ondelete="SET NULL"),
+        sa.ForeignKeyConstraint(["line_account_id"], ["line_account.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["line_message_id"], ["line_message.id"], ondelete="SET NULL"),
+        sa.ForeignKeyConstraint(["broadcast_id"], ["broadcast.id"], ondelete="SET NULL"),
+    )
+    op.create_index("ix_scheduled_message_status_due", "scheduled_message", ["status", "due_at"], unique=False)
+    op.create_index(
+        "ix_scheduled_message_oa_user_status",
+        "scheduled_message",
+        ["line_account_id", "user_id", "status"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_scheduled_message_oa_user_status", table_name="scheduled_message")
+    op.drop_index("ix_scheduled_message_status_due", table_name="scheduled_message")
+    op.drop_table("scheduled_message")
@@ -0,0 +1,29 @@
+# migrations/versions/20261018_12_add_media_claimed_at_to_line_message.py - เวลาที่ worker จองงานดึงไฟล์สื่อ (lease)
+"""add media_claimed_at to line_message
+
+Revision ID: 20261018_12
+Revises: 20261018_11
+Create Date: 2026-10-18 21:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_12"
+down_revision: Union[str, None] = "20261018_11"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("media_claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.drop_column("media_claimed_at")
@@ -0,0 +1,39 @@
+# migrations/versions/20261018_13_widen_line_message_message_url.py - ขยาย message_url ให้รับ originalContentUrl ภายนอกได้ครบ
+"""widen line_message.message_url to 2000
+
+Revision ID: 20261018_13
+Revises: 20261018_12
+Create Date: 2026-10-18 22:00:00.000000
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "20261018_13"
+down_revision: Union[str, None] = "20261018_12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.alter_column(
+            "message_url",
+            existing_type=sa.String(length=255),
+            type_=sa.String(length=2000),
+            existing_nullable=True,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("line_message", schema=None) as batch_op:
+        batch_op.alter_column(
+            "message_url",
+            existing_type=sa.String(length=2000),
+            type_=sa.String(length=255),
+            existing_nullable=True,
+        )
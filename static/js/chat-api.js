@@ -12,8 +12,8 @@ async function fetchChatData(userId, oaId, frozenTime = null) {
 }
 
 // Function to fetch more (older) messages
-async function fetchMoreMessages(userId, oaId, offset) {
-    const response = await fetch(`/chats/${userId}/more?oa=${oaId}&offset=${offset}`);
+async function fetchMoreMessages(userId, oaId, beforeCursor) {
+    const response = await fetch(`/chats/${userId}/more?oa=${oaId}&before=${encodeURIComponent(beforeCursor)}`);
     if (!response.ok) throw new Error('Failed to load more messages');
     return await response.json();
 }
@@ -60,6 +60,18 @@ async function sendImageMessage(userId, oaId, imageFile) {
     return await response.json();
 }
 
+// Function to send a video/audio/document file
+async function sendFileMessage(userId, oaId, file, durationMs) {
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('user_id', userId);
+    formData.append('oa_id', oaId);
+    if (durationMs) formData.append('duration_ms', durationMs);
+    const response = await fetch('/chats/api/send_file', { method: 'POST', body: formData });
+    if (!response.ok) throw new Error('File upload failed');
+    return await response.json();
+}
+
 // Function to send a sticker message
 async function sendStickerMessage(userId, oaId, packageId, stickerId) {
     const response = await fetch('/chats/api/send_sticker', {
@@ -16,6 +16,12 @@ function createMessageElement(msgData) {
     // จัดการเนื้อหาและ Meta ก่อน (ใช้ Logic เดิมของคุณ)
     switch (msgData.message_type) {
         case 'image':
+            if (!msgData.content) {
+                // รูปจากลูกค้าที่ระบบยังดึงขึ้น S3 ไม่เสร็จ จะถูกแทนที่เมื่อได้รับ message_updated
+                content.classList.add('chat-media-pending');
+                content.textContent = msgData.media_status === 'failed' ? '[ไม่สามารถโหลดรูปภาพได้]' : 'กำลังโหลดรูปภาพ...';
+                break;
+            }
             const img = document.createElement('img');
             img.classList.add('chat-image');
             img.dataset.src = msgData.content;
@@ -25,6 +31,16 @@ function createMessageElement(msgData) {
             });
             content.appendChild(img);
             break;
+        case 'video':
+        case 'audio':
+        case 'file':
+            if (!msgData.content) {
+                content.classList.add('chat-media-pending');
+                content.textContent = msgData.media_status === 'failed' ? '[ไม่สามารถโหลดไฟล์ได้]' : 'กำลังโหลดไฟล์...';
+                break;
+            }
+            content.appendChild(createMediaElement(msgData));
+            break;
         case 'sticker':
             const stickerImg = document.createElement('img');
             stickerImg.classList.add('chat-sticker');
@@ -41,6 +57,10 @@ function createMessageElement(msgData) {
 
     if (msgData.sender_type === 'admin') {
         meta.textContent = `@${msgData.oa_name || 'System'} : ${msgData.admin_email || ''} - ${msgData.full_datetime || ''}`;
+        if (msgData.send_status === 'pending' || msgData.send_status === 'sending') {
+            // ยังอยู่ในคิวส่งไป LINE จะถูกแทนที่เมื่อได้รับ message_updated
+            meta.textContent += ' · กำลังส่ง...';
+        }
     } else {
         meta.textContent = msgData.full_datetime || '';
     }
@@ -80,6 +100,54 @@ function createMessageElement(msgData) {
     return { element: wrapper, promise: imageLoadPromise };
 }
 
+function formatFileSize(bytes) {
+    if (!bytes && bytes !== 0) return '';
+    if (bytes < 1024) return `${bytes} B`;
+    if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+    return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+}
+
+function formatDuration(ms) {
+    if (!ms) return '';
+    const totalSeconds = Math.round(ms / 1000);
+    return `${Math.floor(totalSeconds / 60)}:${String(totalSeconds % 60).padStart(2, '0')}`;
+}
+
+// สร้าง element สำหรับวิดีโอ/เสียง/ไฟล์ (ใช้ preload=metadata ไม่โหลดไฟล์ทั้งก้อนจนกว่าจะกดเล่น)
+function createMediaElement(msgData) {
+    if (msgData.message_type === 'video' || msgData.message_type === 'audio') {
+        const player = document.createElement(msgData.message_type);
+        player.classList.add(msgData.message_type === 'video' ? 'chat-video' : 'chat-audio');
+        player.controls = true;
+        player.preload = 'metadata';
+        player.src = msgData.content;
+        if (msgData.media_duration_ms) {
+            player.title = formatDuration(msgData.media_duration_ms);
+        }
+        return player;
+    }
+
+    const link = document.createElement('a');
+    link.classList.add('chat-file');
+    link.href = msgData.content;
+    link.target = '_blank';
+    link.rel = 'noopener';
+    const icon = document.createElement('i');
+    icon.className = 'bi bi-file-earmark-arrow-down me-1';
+    const name = document.createElement('span');
+    name.textContent = msgData.file_name || 'ไฟล์แนบ';
+    link.appendChild(icon);
+    link.appendChild(name);
+    const size = formatFileSize(msgData.media_size);
+    if (size) {
+        const sizeLabel = document.createElement('small');
+        sizeLabel.classList.add('text-muted', 'ms-1');
+        sizeLabel.textContent = `(${size})`;
+        link.appendChild(sizeLabel);
+    }
+    return link;
+}
+
 // Function to add a message to the chat container
 function appendMessage(container, msgData, isPrepending = false) {
     // ตรวจสอบว่ามีข้อความ ID นี้อยู่แล้วหรือยัง
@@ -117,6 +185,19 @@ function appendMessage(container, msgData, isPrepending = false) {
     return promise;
 }
 
+// Function to replace an already rendered message (e.g. media placeholder -> real image, pending -> sent/failed)
+function replaceMessage(msgData) {
+    const existing = msgData.id ? document.getElementById(`msg-${msgData.id}`) : null;
+    if (!existing) return null;
+
+    const { element, promise } = createMessageElement(msgData);
+    existing.replaceWith(element);
+    if (msgData.line_sent_successfully === false) {
+        markMessageAsFailed(msgData.id, msgData.line_error_message);
+    }
+    return promise;
+}
+
 // Function to populate the quick reply modal list
 function populateQuickReplyList(listElement, replies) {
     listElement.innerHTML = '';
@@ -79,8 +79,8 @@ document.addEventListener('DOMContentLoaded', function () {
     let currentUserDbId = null;
     let selectedImageFile = null;
     let availableQuickReplies = [];
-    let currentOffset = 0;
-    let totalMessages = 0;
+    let historyCursor = null; // cursor ของข้อความที่เก่าที่สุดที่โหลดแล้ว (keyset)
+    let hasMoreHistory = false;
     let isLoadingMore = false;
     let currentRoom = null;
     let currentUserDisplayName = '';
@@ -104,7 +104,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const serverDataEl = document.getElementById('server-data');
     const SERVER_DATA = JSON.parse(serverDataEl.textContent);
     const currentUserEmail = SERVER_DATA.current_user_email;
-    const socket = io();
+    // หลาย worker ที่ไม่มี sticky session: ต่อ websocket ตรง (handshake แบบ polling ต้องอยู่ worker เดิม)
+    const socket = SERVER_DATA.socket_websocket_only ? io({ transports: ['websocket'] }) : io();
 
     // 2. ELEMENT SELECTORS
     const userList = document.getElementById('user-list');
@@ -115,6 +116,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const replyMessageInput = document.getElementById('reply-message');
     const attachImageBtn = document.getElementById('attach-image-btn');
     const imageInput = document.getElementById('image-input');
+    const attachFileBtn = document.getElementById('attach-file-btn');
+    const fileInput = document.getElementById('file-input');
     const imagePreviewModal = new bootstrap.Modal(document.getElementById('imagePreviewModal'));
     const previewImage = document.getElementById('preview-image');
     const confirmSendImageBtn = document.getElementById('confirm-send-image-btn');
@@ -355,8 +358,8 @@ document.addEventListener('DOMContentLoaded', function () {
             currentOaId = oaId;
             currentUserDbId = data.user.db_id;
             window.currentUserPictureUrl = data.user.picture_url;
-            currentOffset = data.messages.length;
-            totalMessages = data.total_messages;
+            historyCursor = data.before;
+            hasMoreHistory = data.has_more;
             isLoadingMore = false;
             currentFullNote = data.user.note || '';
 
@@ -472,17 +475,9 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
-    function handleConversationUpdate(convData) {
-        if (!convData || !convData.user_id) return;
-
-        // --- ส่วนที่ 1: สร้าง Element ใหม่ (เหมือนเดิม) ---
-        const existingUserLink = document.querySelector(`.list-group-item-action[data-userid="${convData.user_id}"][data-oaid="${convData.line_account_id}"]`);
-        if (existingUserLink) {
-            existingUserLink.remove();
-        }
-
+    // สร้าง element ของ sidebar 1 แถวจาก JSON (ใช้ทั้ง socket update และ /chats/api/sidebar)
+    function buildSidebarItem(convData) {
         const newLink = document.createElement('a');
-        // ... (โค้ดส่วนสร้าง newLink ทั้งหมดเหมือนเดิม) ...
         newLink.href = "#";
         newLink.className = `list-group-item list-group-item-action d-flex align-items-center status-${convData.status}`;
         newLink.dataset.userid = convData.user_id;
@@ -525,6 +520,22 @@ document.addEventListener('DOMContentLoaded', function () {
             </p>
         </div>`;
 
+        if (String(convData.user_id) === String(currentUserId) && String(convData.line_account_id) === String(currentOaId)) {
+            newLink.classList.add('active');
+        }
+        return newLink;
+    }
+
+    function handleConversationUpdate(convData) {
+        if (!convData || !convData.user_id) return;
+
+        // --- ส่วนที่ 1: สร้าง Element ใหม่ ---
+        const existingUserLink = document.querySelector(`.list-group-item-action[data-userid="${convData.user_id}"][data-oaid="${convData.line_account_id}"]`);
+        if (existingUserLink) {
+            existingUserLink.remove();
+        }
+        const newLink = buildSidebarItem(convData);
+
         // --- ★★★ ส่วนที่ 2: Logic ใหม่สำหรับหาตำแหน่งที่จะแทรก ★★★ ---
         const userList = document.getElementById('user-list');
 
@@ -544,56 +555,169 @@ document.addEventListener('DOMContentLoaded', function () {
             // ให้นำไปวางไว้บนสุดเหมือนเดิม
             userList.prepend(newLink);
         }
-
-        if (String(convData.user_id) === String(currentUserId) && String(convData.line_account_id) === String(currentOaId)) {
-            newLink.classList.add('active');
-        }
     }
 
 
     // 4. SOCKET.IO EVENT LISTENERS (ตัวดักฟังจาก Server)
 
+    // ดึง sidebar เป็น JSON (keyset pagination) cursor ว่าง = หน้าแรก
+    async function fetchSidebarPage(cursor) {
+        const params = new URLSearchParams(window.location.search);
+        const query = new URLSearchParams({ status_filter: params.get('status_filter') || 'all' });
+        if (cursor) query.set('cursor', cursor);
+        const response = await fetch(`/chats/api/sidebar?${query.toString()}`);
+        if (!response.ok) {
+            throw new Error('Failed to fetch sidebar content');
+        }
+        return await response.json();
+    }
+
+    function updateSidebarLoadMore(nextCursor) {
+        const loadMoreBtn = document.getElementById('sidebar-load-more');
+        if (!loadMoreBtn) return;
+        loadMoreBtn.dataset.cursor = nextCursor || '';
+        loadMoreBtn.style.display = nextCursor ? '' : 'none';
+    }
+
     async function reloadSidebar() {
         console.log('🔄 Received resort signal. Reloading sidebar...');
         try {
-            // 1. ยิง request ไปที่หน้าแชทหลัก เพื่อขอ HTML ล่าสุด
-            const response = await fetch('/chats/');
-            if (!response.ok) {
-                throw new Error('Failed to fetch sidebar content');
-            }
-            const htmlText = await response.text();
-
-            // 2. แปลงข้อความ HTML ให้กลายเป็น Document object ชั่วคราวใน memory
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(htmlText, 'text/html');
-
-            // 3. ดึงเนื้อหาใหม่จาก Document ชั่วคราวนั้น
-            const newUserListContent = doc.getElementById('user-list').innerHTML;
-            const newPaginationContent = doc.getElementById('sidebar-pagination-container').innerHTML;
-
-            // 4. นำเนื้อหาใหม่ไป "สวมทับ" ของเก่าบนหน้าเว็บจริง
-            document.getElementById('user-list').innerHTML = newUserListContent;
-            document.getElementById('sidebar-pagination-container').innerHTML = newPaginationContent;
-
-
+            const page = await fetchSidebarPage(null);
+            const userList = document.getElementById('user-list');
+            userList.replaceChildren(...page.conversations.map(buildSidebarItem));
+            updateSidebarLoadMore(page.next_cursor);
+            updateUnreadTimers();
             console.log('✅ Sidebar reloaded successfully.');
         } catch (error) {
             console.error('Failed to reload sidebar:', error);
         }
     }
 
+    async function loadMoreSidebar(event) {
+        const loadMoreBtn = event.currentTarget;
+        const cursor = loadMoreBtn.dataset.cursor;
+        if (!cursor) return;
+        loadMoreBtn.disabled = true;
+        try {
+            const page = await fetchSidebarPage(cursor);
+            const userList = document.getElementById('user-list');
+            page.conversations.forEach(convData => {
+                // แถวที่ socket ใส่เข้ามาแล้วไม่ต้องซ้ำ
+                const exists = userList.querySelector(`.list-group-item-action[data-userid="${convData.user_id}"][data-oaid="${convData.line_account_id}"]`);
+                if (!exists) userList.appendChild(buildSidebarItem(convData));
+            });
+            updateSidebarLoadMore(page.next_cursor);
+            updateUnreadTimers();
+        } catch (error) {
+            console.error('Failed to load more conversations:', error);
+        } finally {
+            loadMoreBtn.disabled = false;
+        }
+    }
+
+    const sidebarLoadMoreBtn = document.getElementById('sidebar-load-more');
+    if (sidebarLoadMoreBtn) {
+        sidebarLoadMoreBtn.addEventListener('click', loadMoreSidebar);
+    }
+
     // =======================================================
     // START: SOCKET.IO EVENT LISTENERS (FINAL DEBUG VERSION)
     // =======================================================
 
     console.log('Attempting to connect to Socket.IO server...');
 
+    // ---- ลำดับ event ของห้องกลุ่ม: server ใส่ seqs {room: seq} และ stream มากับทุก event ----
+    // seq นับแยกต่อ worker (stream) จึงจำ seq ล่าสุดเป็น roomCursors[room][stream]
+    // event เดียวถูกส่งถึงทุกห้องที่ OA สังกัดในครั้งเดียว จึงนับเฉพาะห้องที่เราอยู่ (joinedRooms)
+    const roomCursors = {};
+    let joinedRooms = new Set();
+    const resyncPending = new Set();
+    let sidebarReloadTimer = null;
+
+    function scheduleSidebarReload() {
+        // หน่วงแบบสุ่มกัน client จำนวนมากโหลด sidebar พร้อมกันหลัง server รีสตาร์ท
+        if (sidebarReloadTimer) return;
+        sidebarReloadTimer = setTimeout(() => {
+            sidebarReloadTimer = null;
+            reloadSidebar();
+        }, 500 + Math.random() * 2000);
+    }
+
+    function requestRoomResync(room) {
+        if (resyncPending.has(room)) return;
+        resyncPending.add(room);
+        socket.emit('resync_rooms', { cursors: { [room]: roomCursors[room] || {} } }, (ack) => {
+            resyncPending.delete(room);
+            applyRoomSync(ack);
+        });
+    }
+
+    function acceptRoomEvent(data) {
+        // คืน true ถ้าควรประมวลผล event นี้ (ตัดตัวซ้ำ และขอ event ที่ขาดเมื่อ seq กระโดด)
+        if (!data || !data.seqs || !data.stream) return true;
+        const rooms = Object.keys(data.seqs).filter(room => joinedRooms.has(room));
+        if (rooms.length === 0) return true;
+        let isNew = false;
+        let gapRoom = null;
+        rooms.forEach(room => {
+            const cursors = roomCursors[room] || (roomCursors[room] = {});
+            const last = cursors[data.stream];
+            const seq = data.seqs[room];
+            if (last === undefined || seq === last + 1) {
+                cursors[data.stream] = seq;
+                isNew = true;
+            } else if (seq > last + 1) {
+                gapRoom = room;
+            }
+        });
+        if (gapRoom) {
+            // event ตัวนี้อยู่ใน ring buffer ของ server ด้วย จะได้รับพร้อมตัวที่ขาดตามลำดับ
+            requestRoomResync(gapRoom);
+            return false;
+        }
+        return isNew;
+    }
+
+    function applyRoomSync(ack) {
+        if (!ack || !ack.rooms) return;
+        let needsReload = false;
+        Object.entries(ack.rooms).forEach(([room, streams]) => {
+            const cursors = roomCursors[room] || (roomCursors[room] = {});
+            Object.entries(streams).forEach(([stream, state]) => {
+                if (state.resync) {
+                    // ช่องว่างเกิน buffer หรือ worker นั้นรีสตาร์ทไปแล้ว: ต้องโหลด sidebar ใหม่
+                    needsReload = true;
+                    if (state.seq) cursors[stream] = state.seq;
+                    else delete cursors[stream];
+                    return;
+                }
+                state.events.forEach(item => {
+                    const handler = ROOM_EVENT_HANDLERS[item.event];
+                    if (handler && acceptRoomEvent(item.data)) handler(item.data);
+                });
+                cursors[stream] = Math.max(cursors[stream] || 0, state.seq);
+            });
+        });
+        if (needsReload) scheduleSidebarReload();
+    }
+
+    function applyJoinedRooms(ack) {
+        // ack ของ update_active_groups มีครบทุกห้องที่อยู่ ห้องที่ออกไปแล้วไม่ต้องจำ seq ต่อ
+        if (!ack || !ack.rooms) return;
+        joinedRooms = new Set(Object.keys(ack.rooms));
+        Object.keys(roomCursors).forEach(room => {
+            if (!joinedRooms.has(room)) delete roomCursors[room];
+        });
+        applyRoomSync(ack);
+    }
+
     socket.on('connect', () => {
         console.log('✅✅✅ SUCCESS: Connected to WebSocket server! Session ID:', socket.id);
 
         // ดึง group_ids ที่ใช้งานอยู่จาก SERVER_DATA ที่ Flask ส่งมาให้
+        // ตอน reconnect ส่ง seq ล่าสุดของแต่ละห้องไปด้วย เพื่อรับเฉพาะ event ที่พลาดไป (ไม่ต้องโหลด sidebar ใหม่)
         const activeGroupIds = SERVER_DATA.selected_group_ids || [];
-        socket.emit('update_active_groups', { group_ids: activeGroupIds });
+        socket.emit('update_active_groups', { group_ids: activeGroupIds, cursors: roomCursors }, applyJoinedRooms);
     });
 
     socket.on('connect_error', (err) => {
@@ -609,7 +733,7 @@ document.addEventListener('DOMContentLoaded', function () {
         console.warn('🔌 Socket.IO Disconnected. Reason:', reason);
     });
 
-    socket.on('render_conversation_update', (freshData) => {
+    function onConversationUpdate(freshData) {
         if (isSearching) {
             console.log('Search is active. Ignoring real-time sidebar update.');
 
@@ -655,12 +779,12 @@ document.addEventListener('DOMContentLoaded', function () {
                 existingElement.remove();
             }
         }
-    });
+    }
 
-    socket.on('new_message', function (msgData) {
+    function onNewMessage(msgData, notify = true) {
         // --- ส่วนที่ 1: จัดการการแจ้งเตือน (เสียง & Desktop) ---
         const isAdminMessage = msgData.sender_type === 'admin';
-        if (msgData.message_type !== 'event' && !isAdminMessage) {
+        if (notify && msgData.message_type !== 'event' && !isAdminMessage) {
             // เล่นเสียง
             notificationSound.play().catch(e => console.warn("Sound notification failed.", e));
 
@@ -691,6 +815,33 @@ document.addEventListener('DOMContentLoaded', function () {
                 markCurrentChatAsRead('live-message');
             }
         }
+    }
+
+    function onNewMessages(batch) {
+        // server รวมข้อความที่เข้ามาติด ๆ กันของ conversation เดียวเป็นชุดเดียว: แจ้งเตือนแค่ครั้งเดียว (ข้อความลูกค้าล่าสุด)
+        const messages = batch.messages || [];
+        let notifyIndex = -1;
+        messages.forEach((msgData, index) => {
+            if (msgData.sender_type !== 'admin' && msgData.message_type !== 'event') notifyIndex = index;
+        });
+        messages.forEach((msgData, index) => onNewMessage(msgData, index === notifyIndex));
+    }
+
+    function onMessageUpdated(msgData) {
+        // ข้อความที่ถูกอัปเดตภายหลัง (เช่น รูปที่ worker อัปโหลดขึ้น S3 เสร็จแล้ว, ผลการส่งข้อความของแอดมินไป LINE)
+        replaceMessage(msgData);
+    }
+
+    const ROOM_EVENT_HANDLERS = {
+        render_conversation_update: onConversationUpdate,
+        new_message: onNewMessage,
+        new_messages: onNewMessages,
+        message_updated: onMessageUpdated,
+    };
+    Object.entries(ROOM_EVENT_HANDLERS).forEach(([eventName, handler]) => {
+        socket.on(eventName, (data) => {
+            if (acceptRoomEvent(data)) handler(data);
+        });
     });
 
     // =======================================================
@@ -783,6 +934,48 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // อ่านความยาวไฟล์เสียง (LINE ต้องใช้ duration ตอนส่ง audio)
+    function readMediaDurationMs(file) {
+        if (!file.type.startsWith('audio/') && !file.type.startsWith('video/')) {
+            return Promise.resolve(null);
+        }
+        return new Promise(resolve => {
+            const probe = document.createElement(file.type.startsWith('audio/') ? 'audio' : 'video');
+            const objectUrl = URL.createObjectURL(file);
+            probe.preload = 'metadata';
+            probe.onloadedmetadata = () => {
+                URL.revokeObjectURL(objectUrl);
+                resolve(isFinite(probe.duration) ? Math.round(probe.duration * 1000) : null);
+            };
+            probe.onerror = () => {
+                URL.revokeObjectURL(objectUrl);
+                resolve(null);
+            };
+            probe.src = objectUrl;
+        });
+    }
+
+    async function handleFileSelection(event) {
+        const file = event.target.files[0];
+        if (!file || !currentUserId) return;
+
+        try {
+            const durationMs = await readMediaDurationMs(file);
+            const result = await sendFileMessage(currentUserId, currentOaId, file, durationMs);
+            if (result && result.db_saved_successfully) {
+                appendMessage(messagesContainer, result);
+            } else {
+                throw new Error(result.db_error || 'Failed to process file on server');
+            }
+        } catch (error) {
+            console.error('Send file error:', error);
+            alert('Failed to send file.');
+        } finally {
+            fileInput.value = '';
+            replyMessageInput.focus();
+        }
+    }
+
     function processAndPreviewImage(file) {
         if (file && file.type.startsWith('image/')) {
             selectedImageFile = file;
@@ -853,7 +1046,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
 
     async function handleScrollToLoadMore() {
-        if (isLoadingMore || messagesContainer.scrollTop !== 0 || currentOffset >= totalMessages) {
+        if (isLoadingMore || messagesContainer.scrollTop !== 0 || !hasMoreHistory || !historyCursor) {
             return;
         }
         isLoadingMore = true;
@@ -863,20 +1056,21 @@ document.addEventListener('DOMContentLoaded', function () {
         messagesContainer.prepend(loadingIndicator);
 
         try {
-            const data = await fetchMoreMessages(currentUserId, currentOaId, currentOffset);
+            const data = await fetchMoreMessages(currentUserId, currentOaId, historyCursor);
             const oldScrollHeight = messagesContainer.scrollHeight;
             loadingIndicator.remove();
 
             if (data.messages.length > 0) {
                 data.messages.forEach(msg => appendMessage(messagesContainer, msg, true));
                 messagesContainer.scrollTop = messagesContainer.scrollHeight - oldScrollHeight;
-                currentOffset += data.messages.length;
-            } else {
+            }
+            historyCursor = data.before;
+            hasMoreHistory = data.has_more;
+            if (!data.has_more) {
                 const endOfHistory = document.createElement('p');
                 endOfHistory.className = 'text-center text-muted small py-3';
                 endOfHistory.textContent = 'End of conversation history';
                 messagesContainer.prepend(endOfHistory);
-                totalMessages = currentOffset;
             }
         } catch (error) {
             console.error("Load more error:", error);
@@ -1215,6 +1409,8 @@ document.addEventListener('DOMContentLoaded', function () {
     confirmSendImageBtn.addEventListener('click', handleSendImage);
     attachImageBtn.addEventListener('click', () => imageInput.click());
     imageInput.addEventListener('change', handleImageSelection);
+    attachFileBtn.addEventListener('click', () => fileInput.click());
+    fileInput.addEventListener('change', handleFileSelection);
     messagesContainer.addEventListener('scroll', handleScrollToLoadMore);
     messagesContainer.addEventListener('click', (event) => {
         if (event.target.classList.contains('chat-image')) {
@@ -1281,8 +1477,8 @@ document.addEventListener('DOMContentLoaded', function () {
             if (searchInput.value.trim() === '') {
                 isSearching = false; // ★★★ ยกเลิกสถานะการค้นหา ★★★
                 console.log('Search cleared. Reloading default chat list.');
-                // กลับไปที่หน้าแรกเพื่อโหลดรายการแชทล่าสุด
-                window.location.href = '/chats/';
+                // โหลดรายการแชทล่าสุดจาก JSON แทนการโหลดหน้าใหม่ทั้งหน้า
+                reloadSidebar();
             }
         });
     }
@@ -1365,7 +1561,7 @@ document.addEventListener('DOMContentLoaded', function () {
             // เมื่อกด Apply Filter ให้อ่านค่า checkbox ที่เลือกใหม่
             const selectedIds = Array.from(document.querySelectorAll('.group-checkbox:checked')).map(cb => parseInt(cb.value));
             // แล้วส่งไปอัปเดตที่ server ทันที
-            socket.emit('update_active_groups', { group_ids: selectedIds });
+            socket.emit('update_active_groups', { group_ids: selectedIds }, applyJoinedRooms);
 
             // หมายเหตุ: ส่วนนี้เป็นการยิง socket event ควบคู่ไปกับการ submit form เดิมของคุณ
             // ไม่ต้องลบโค้ด submit form เดิมออก
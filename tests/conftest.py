@@ -0,0 +1,66 @@
+# tests/conftest.py - แอปทดสอบบน SQLite ชั่วคราว (รันได้ทันทีด้วย python -m pytest -q tests ไม่ต้องมี PostgreSQL)
+import os
+
+import pytest
+
+os.environ.setdefault("USE_EVENTLET", "0")
+
+# create_all สร้างตาราง changelog ไม่ได้ (index ชื่อ ix_change_logs_created_at ซ้ำกับ index=True ของคอลัมน์)
+# และไม่มีการทดสอบไหนใช้ จึงข้ามไป
+_SKIPPED_TABLES = {"change_logs", "change_log_files"}
+
+
+def create_tables(db):
+    db.metadata.create_all(
+        db.engine, tables=[t for t in db.metadata.sorted_tables if t.name not in _SKIPPED_TABLES]
+    )
+
+
+def drop_tables(db):
+    db.metadata.drop_all(
+        db.engine, tables=[t for t in db.metadata.sorted_tables if t.name not in _SKIPPED_TABLES]
+    )
+
+
+@pytest.fixture()
+def app(tmp_path, monkeypatch):
+    from config import Config
+
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(Config, "WEBHOOK_INGEST_MODE", "sync")
+    monkeypatch.setattr(Config, "WEBHOOK_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(Config, "SOCKETIO_MESSAGE_QUEUE", "")
+    monkeypatch.setattr(Config, "SUMMARY_CACHE_ENABLED", False)
+
+    from app import create_app
+    from app.extensions import db
+
+    from app.services import line_registry, oa_rooms
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        create_tables(db)
+        # cache ระดับ module ของ process อาจค้างจากฐานข้อมูลของเทสก่อนหน้า
+        line_registry.clear()
+        oa_rooms.invalidate()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture()
+def line_account(app):
+    from app.extensions import db
+    from app.models import LineAccount
+
+    account = LineAccount(
+        name="Test OA",
+        channel_id="test-channel",
+        channel_secret="test-channel-secret",
+        channel_access_token="test-token",
+        webhook_path="test-oa",
+    )
+    db.session.add(account)
+    db.session.commit()
+    return account
@@ -0,0 +1,99 @@
+# tests/test_admission_spool.py - drainer ของ spool: ประมวลผลตามลำดับ, จำกัดจำนวนครั้งที่ลองใหม่, เคารพไฟล์ที่ process อื่นจองอยู่
+import json
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture()
+def processed(monkeypatch):
+    """แทน process_inbox_body: จำ body ที่ถูกประมวลผล และโยน error ถ้า body ขึ้นต้นด้วย 'fail'"""
+    from app.blueprints.line_webhook import routes
+
+    calls = []
+
+    def fake_process(line_account_id, body, signature):
+        if body.startswith("fail"):
+            raise RuntimeError(f"cannot process {body}")
+        calls.append((line_account_id, body))
+
+    monkeypatch.setattr(routes, "process_inbox_body", fake_process)
+    return calls
+
+
+def _spool_names(app):
+    return sorted(os.listdir(app.config["WEBHOOK_SPOOL_DIR"]))
+
+
+def test_drain_replays_files_in_arrival_order_and_clears_backlog(app, processed):
+    from app.services import admission
+
+    for oa_id, body in [(1, "a1"), (2, "b1"), (1, "a2"), (2, "b2")]:
+        admission.spool(oa_id, body, "sig")
+    assert admission._spooled_by_oa == {1: 2, 2: 2}
+
+    admission._drain_pass(app, 0)
+
+    assert processed == [(1, "a1"), (2, "b1"), (1, "a2"), (2, "b2")]
+    assert _spool_names(app) == []
+    assert admission._spooled_by_oa == {}
+
+
+def test_failing_file_is_retried_then_set_aside(app, processed):
+    from app.services import admission
+
+    app.config["WEBHOOK_MAX_ATTEMPTS"] = 2
+    admission.spool(1, "fail-me", "sig")
+    admission.spool(1, "a2", "sig")
+
+    # รอบแรกล้มเหลว: ไฟล์ยังอยู่ที่เดิม (นับครั้งไว้ในไฟล์) และไฟล์ถัดไปของ OA เดียวกันต้องรอ
+    admission._drain_pass(app, 0)
+    names = _spool_names(app)
+    assert processed == []
+    assert len(names) == 2 and all(name.endswith(".json") for name in names)
+    with open(os.path.join(app.config["WEBHOOK_SPOOL_DIR"], names[0]), encoding="utf-8") as f:
+        assert json.load(f)["attempts"] == 1
+
+    # ครบจำนวนครั้ง: แยกเป็น .bad แล้วไปต่อกับไฟล์ถัดไป
+    admission._drain_pass(app, 0)
+    names = _spool_names(app)
+    assert processed == [(1, "a2")]
+    assert len(names) == 1 and names[0].endswith(".json.bad")
+    assert admission._spooled_by_oa == {}
+
+
+def test_oa_claimed_by_another_drainer_is_skipped(app, processed):
+    from app.services import admission
+
+    admission.spool(1, "a1", "sig")
+    admission.spool(1, "a2", "sig")
+    admission.spool(2, "b1", "sig")
+    directory = app.config["WEBHOOK_SPOOL_DIR"]
+    first = os.path.join(directory, _spool_names(app)[0])
+    os.rename(first, f"{first}{admission._CLAIM_MARK}99999-abcdef")
+
+    admission._drain_pass(app, 0)
+
+    # OA 1 ยังถูกจองอยู่ (ยังไม่หมด lease): ต้องไม่ส่ง a2 แซง a1
+    assert processed == [(2, "b1")]
+    assert admission._spooled_by_oa == {1: 2}
+
+
+def test_stale_claim_is_released_and_replayed(app, processed):
+    from app.services import admission
+
+    admission.spool(1, "a1", "sig")
+    directory = app.config["WEBHOOK_SPOOL_DIR"]
+    first = os.path.join(directory, _spool_names(app)[0])
+    claimed = f"{first}{admission._CLAIM_MARK}99999-abcdef"
+    os.rename(first, claimed)
+    expired = time.time() - admission.CLAIM_LEASE_SECONDS - 10
+    os.utime(claimed, (expired, expired))
+
+    # รอบแรกคืนไฟล์ที่ lease หมด รอบถัดไปจึงเห็นเป็นไฟล์ปกติ
+    admission._drain_pass(app, 0)
+    admission._drain_pass(app, 0)
+
+    assert processed == [(1, "a1")]
+    assert _spool_names(app) == []
@@ -0,0 +1,183 @@
+# tests/test_outbound.py - state machine ของคิวส่งข้อความ: retry พร้อม backoff, 409 = ส่งแล้ว, rate limit/circuit เลื่อนโดยไม่นับ attempt
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from linebot.exceptions import LineBotApiError
+from linebot.models.error import Error
+
+
+class FakeApi:
+    """แทน LineBotApi: จำ retry key ของทุกคำขอ และโยน error ตามคิวที่เตรียมไว้"""
+
+    def __init__(self, errors=()):
+        self.headers = {"Authorization": "Bearer test-token"}
+        self.errors = list(errors)
+        self.calls = []
+
+    def push_message(self, to, messages):
+        self.calls.append((to, self.headers.get("X-Line-Retry-Key")))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def _api_error(status_code):
+    return LineBotApiError(status_code, {}, error=Error(message=f"status {status_code}"))
+
+
+@pytest.fixture()
+def redispatched(monkeypatch):
+    from app.services import outbound
+
+    calls = []
+    monkeypatch.setattr(outbound, "_redispatch_later", lambda oa_id, delay: calls.append((oa_id, delay)))
+    return calls
+
+
+def _use_api(monkeypatch, line_account, api):
+    from app.services import line_registry
+
+    account = SimpleNamespace(id=line_account.id, api=api)
+    monkeypatch.setattr(line_registry, "get_by_id", lambda oa_id: account if int(oa_id) == line_account.id else None)
+
+
+def _queue_message(line_account, text="hello"):
+    from app.extensions import db
+    from app.models import LineMessage
+    from app.services import outbound
+
+    message = LineMessage(
+        line_account_id=line_account.id,
+        user_id="U1",
+        message_type="text",
+        message_text=text,
+        is_outgoing=True,
+        timestamp=datetime.utcnow(),
+    )
+    outbound.prepare(message)
+    db.session.add(message)
+    db.session.commit()
+    return message.id
+
+
+def _reload(message_id):
+    from app.extensions import db
+    from app.models import LineMessage
+
+    db.session.expire_all()
+    return db.session.get(LineMessage, message_id)
+
+
+def test_server_error_is_retried_with_backoff_and_the_same_retry_key(app, line_account, monkeypatch, redispatched):
+    from app.extensions import db
+    from app.services import outbound
+
+    api = FakeApi(errors=[_api_error(500)])
+    _use_api(monkeypatch, line_account, api)
+    message_id = _queue_message(line_account)
+
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_PENDING
+    assert message.send_attempts == 1
+    assert message.send_next_at > datetime.utcnow()
+    # หัวคิวติด backoff: ตั้งเวลาปลุกแทนการข้ามไปส่งข้อความถัดไป
+    assert len(redispatched) == 1 and redispatched[0][0] == line_account.id
+
+    message.send_next_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_SENT
+    assert message.line_sent_successfully is True
+    assert message.send_attempts == 2
+    retry_keys = [key for _, key in api.calls]
+    assert retry_keys == [message.send_retry_key, message.send_retry_key]
+    # สำเนาของ api เท่านั้นที่มี retry key ตัว api กลางของ OA ไม่ติด key ค้าง
+    assert "X-Line-Retry-Key" not in api.headers
+
+
+def test_conflict_means_line_already_accepted_the_retry_key(app, line_account, monkeypatch, redispatched):
+    from app.services import outbound
+
+    _use_api(monkeypatch, line_account, FakeApi(errors=[_api_error(409)]))
+    message_id = _queue_message(line_account)
+
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_SENT
+    assert message.line_error_message is None
+
+
+def test_client_error_fails_without_retry(app, line_account, monkeypatch, redispatched):
+    from app.services import outbound
+
+    api = FakeApi(errors=[_api_error(400)])
+    _use_api(monkeypatch, line_account, api)
+    message_id = _queue_message(line_account)
+
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_FAILED
+    assert message.line_sent_successfully is False
+    assert "status 400" in message.line_error_message
+    assert len(api.calls) == 1 and redispatched == []
+
+
+def test_retries_stop_at_max_attempts(app, line_account, monkeypatch, redispatched):
+    from app.services import outbound
+
+    app.config["OUTBOUND_MAX_ATTEMPTS"] = 1
+    _use_api(monkeypatch, line_account, FakeApi(errors=[_api_error(503)]))
+    message_id = _queue_message(line_account)
+
+    outbound._drain_account(line_account.id)
+
+    assert _reload(message_id).send_status == outbound.STATUS_FAILED
+
+
+def _backpressure_error(kind, line_account_id):
+    from app.services.circuit_breaker import CircuitOpen
+    from app.services.rate_limit import RateLimited
+
+    if kind == "rate_limited":
+        return RateLimited(line_account_id, "push", 5.0)
+    return CircuitOpen(line_account_id, 5.0, "LINE 5xx", False)
+
+
+@pytest.mark.parametrize("kind", ["rate_limited", "circuit_open"])
+def test_local_backpressure_defers_without_spending_an_attempt(app, line_account, monkeypatch, redispatched, kind):
+    from app.services import outbound
+
+    api = FakeApi(errors=[_backpressure_error(kind, line_account.id)])
+    _use_api(monkeypatch, line_account, api)
+    message_id = _queue_message(line_account)
+    later_id = _queue_message(line_account, text="second")
+
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_PENDING
+    assert message.send_attempts == 0
+    assert message.send_next_at > datetime.utcnow() + timedelta(seconds=3)
+    # ข้อความถัดไปต้องรอหัวคิว ไม่ส่งแซง
+    assert _reload(later_id).send_status == outbound.STATUS_PENDING
+    assert len(api.calls) == 1 and len(redispatched) == 1
+
+
+def test_revoked_token_fails_immediately(app, line_account, monkeypatch, redispatched):
+    from app.services import outbound
+    from app.services.circuit_breaker import CircuitOpen
+
+    _use_api(monkeypatch, line_account, FakeApi(errors=[CircuitOpen(line_account.id, 60.0, "token revoked", True)]))
+    message_id = _queue_message(line_account)
+
+    outbound._drain_account(line_account.id)
+
+    message = _reload(message_id)
+    assert message.send_status == outbound.STATUS_FAILED
+    assert "token revoked" in message.line_error_message
@@ -0,0 +1,121 @@
+# tests/test_pagination.py - keyset cursor ของ sidebar และประวัติแชท: เดินครบทุกแถว ไม่ซ้ำ ไม่ตกหล่น หน้าเต็มตามขนาด
+from datetime import datetime, timedelta
+
+BASE_TIME = datetime(2026, 10, 1, 12, 0, 0)
+
+
+def _add_user(line_account, user_id, status="read"):
+    from app.extensions import db
+    from app.models import LineUser
+
+    user = LineUser(user_id=user_id, line_account_id=line_account.id, display_name=user_id, status=status)
+    db.session.add(user)
+    return user
+
+
+def _add_message(line_account, user_id, timestamp, text="hi", is_outgoing=False):
+    from app.extensions import db
+    from app.models import LineMessage
+
+    message = LineMessage(
+        line_account_id=line_account.id,
+        user_id=user_id,
+        message_type="text",
+        message_text=text,
+        is_outgoing=is_outgoing,
+        timestamp=timestamp,
+    )
+    db.session.add(message)
+    return message
+
+
+def _walk_sidebar(limit):
+    from app.blueprints.chats.routes import _decode_sidebar_cursor, _fetch_sidebar_page
+
+    pages, cursor = [], None
+    while True:
+        rows, next_cursor = _fetch_sidebar_page("all", None, cursor=cursor, limit=limit)
+        pages.append([conv.user_id for conv in rows])
+        if next_cursor is None:
+            return pages
+        cursor = _decode_sidebar_cursor(next_cursor)
+
+
+def test_sidebar_pages_cover_every_conversation_in_order(app, line_account):
+    from app.extensions import db
+
+    for i in range(7):
+        _add_user(line_account, f"U{i}", status="closed" if i == 1 else "unread")
+    db.session.flush()
+    for i in range(7):
+        _add_message(line_account, f"U{i}", BASE_TIME + timedelta(minutes=i))
+    # สองคนที่ข้อความล่าสุดเวลาเดียวกัน: ต้องตัดสินด้วย id ไม่ให้หายหรือซ้ำระหว่างหน้า
+    _add_user(line_account, "U-tie")
+    db.session.flush()
+    _add_message(line_account, "U-tie", BASE_TIME + timedelta(minutes=3))
+    db.session.commit()
+
+    pages = _walk_sidebar(limit=3)
+    flat = [user_id for page in pages for user_id in page]
+
+    # เปิดอยู่ก่อน (ใหม่ -> เก่า) แล้วค่อย closed
+    assert flat == ["U6", "U5", "U4", "U-tie", "U3", "U2", "U0", "U1"]
+    assert [len(page) for page in pages] == [3, 3, 2]
+
+
+def test_sidebar_page_is_full_when_some_conversations_have_no_line_user(app, line_account):
+    from app.extensions import db
+
+    for i in range(4):
+        _add_user(line_account, f"U{i}")
+    db.session.flush()
+    for i in range(4):
+        _add_message(line_account, f"U{i}", BASE_TIME + timedelta(minutes=i))
+    # ข้อความของ user ที่ไม่มีแถว LineUser: conversation มี line_user_id เป็น NULL
+    for i in range(3):
+        _add_message(line_account, f"U-orphan-{i}", BASE_TIME + timedelta(minutes=10 + i))
+    db.session.commit()
+
+    pages = _walk_sidebar(limit=2)
+
+    assert pages == [["U3", "U2"], ["U1", "U0"]]
+
+
+def _walk_history(line_account, user_id, limit):
+    from app.blueprints.chats.routes import _decode_history_cursor, _fetch_history_page
+
+    pages, before = [], None
+    while True:
+        rows, has_more, before_cursor = _fetch_history_page(user_id, line_account.id, before=before, limit=limit)
+        pages.append([message.message_text for message in rows])
+        if not has_more:
+            assert before_cursor is None
+            return pages
+        before = _decode_history_cursor(before_cursor)
+
+
+def test_history_pages_walk_back_without_gaps_or_duplicates(app, line_account):
+    from app.extensions import db
+
+    _add_user(line_account, "U1")
+    db.session.flush()
+    for i in range(25):
+        # ทุกสามข้อความใช้เวลาเดียวกัน (ข้อความใน batch เดียวกันของ webhook)
+        _add_message(line_account, "U1", BASE_TIME + timedelta(seconds=i // 3), text=f"m{i:02d}")
+    _add_message(line_account, "U-other", BASE_TIME, text="other user")
+    db.session.commit()
+
+    pages = _walk_history(line_account, "U1", limit=10)
+
+    # แต่ละหน้าเรียงเก่า -> ใหม่ หน้าแรกคือข้อความล่าสุด
+    assert pages[0] == [f"m{i:02d}" for i in range(15, 25)]
+    assert [len(page) for page in pages] == [10, 10, 5]
+    flat = [text for page in reversed(pages) for text in page]
+    assert flat == [f"m{i:02d}" for i in range(25)]
+
+
+def test_invalid_cursors_are_rejected():
+    from app.blueprints.chats.routes import _decode_history_cursor, _decode_sidebar_cursor
+
+    assert _decode_sidebar_cursor("not-a-cursor") is None
+    assert _decode_history_cursor("bm9wZQ") is None
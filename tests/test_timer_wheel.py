@@ -0,0 +1,51 @@
+# tests/test_timer_wheel.py - TimerWheel ของ dispatcher ข้อความตั้งเวลา: ไม่ยิงก่อนเวลา, ยิงครบแม้เข็มหยุดไปนาน
+from app.services.scheduler import TimerWheel
+
+
+def test_fires_on_the_tick_of_its_due_time_not_before():
+    wheel = TimerWheel(slots=8, tick_seconds=1.0, now=100.0)
+    wheel.add(1, 102.5)
+
+    assert wheel.advance(101.9) == []
+    assert wheel.advance(102.4) == []
+    assert wheel.advance(103.0) == [1]
+    assert len(wheel) == 0
+
+
+def test_item_due_more_than_one_revolution_ahead_waits_in_its_slot():
+    wheel = TimerWheel(slots=4, tick_seconds=1.0, now=0.0)
+    wheel.add(7, 9.0)  # ช่องเดียวกับ tick 1 และ 5 แต่ต้องรอถึงรอบที่สาม
+
+    for now in range(1, 9):
+        assert wheel.advance(float(now)) == [], now
+    assert wheel.advance(9.0) == [7]
+
+
+def test_past_due_item_fires_on_the_next_tick():
+    wheel = TimerWheel(slots=8, tick_seconds=1.0, now=50.0)
+    wheel.add(3, 10.0)
+
+    assert wheel.advance(50.0) == [3]
+
+
+def test_catches_up_after_a_stall_longer_than_the_wheel():
+    wheel = TimerWheel(slots=4, tick_seconds=1.0, now=0.0)
+    for item_id, due in ((1, 1.0), (2, 2.5), (3, 6.0), (4, 30.0)):
+        wheel.add(item_id, due)
+
+    assert sorted(wheel.advance(20.0)) == [1, 2, 3]
+    assert len(wheel) == 1
+    assert wheel.advance(29.0) == []
+    assert wheel.advance(30.0) == [4]
+
+
+def test_remove_and_reschedule():
+    wheel = TimerWheel(slots=8, tick_seconds=1.0, now=0.0)
+    wheel.add(1, 2.0)
+    wheel.add(2, 2.0)
+    wheel.remove(1)
+    wheel.add(2, 5.0)  # ย้ายเวลา
+
+    assert wheel.advance(3.0) == []
+    assert wheel.advance(5.0) == [2]
+    assert len(wheel) == 0
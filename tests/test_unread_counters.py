@@ -0,0 +1,72 @@
+# tests/test_unread_counters.py - ตัวนับ unread แบบเพิ่มทีละข้อความ และ reconcile_unread_counts ที่ซ่อมตัวนับที่คลาดเคลื่อน
+from datetime import datetime, timedelta
+
+BASE_TIME = datetime(2026, 10, 1, 12, 0, 0)
+
+
+def _seed(line_account, inbound=3, outbound=1):
+    from app.extensions import db
+    from app.models import LineMessage, LineUser
+
+    user = LineUser(user_id="U1", line_account_id=line_account.id, display_name="U1", status="unread")
+    db.session.add(user)
+    db.session.flush()
+    for i in range(inbound + outbound):
+        db.session.add(LineMessage(
+            line_account_id=line_account.id,
+            user_id="U1",
+            message_type="text",
+            message_text=f"m{i}",
+            is_outgoing=i >= inbound,
+            timestamp=BASE_TIME + timedelta(minutes=i),
+        ))
+    db.session.commit()
+    return user
+
+
+def _counts(user):
+    from app.extensions import db
+    from app.models import Conversation
+
+    db.session.expire_all()
+    conv = Conversation.query.filter_by(line_account_id=user.line_account_id, user_id=user.user_id).one()
+    return user.unread_count, conv.unread_count
+
+
+def test_inbound_messages_increment_both_counters(app, line_account):
+    user = _seed(line_account, inbound=3, outbound=1)
+
+    assert _counts(user) == (3, 3)
+
+
+def test_reconcile_repairs_drifted_counters(app, line_account):
+    from app.extensions import db
+    from app.models import Conversation
+    from app.services.conversations import reconcile_unread_counts
+
+    user = _seed(line_account, inbound=3, outbound=1)
+    db.session.execute(db.update(Conversation).values(unread_count=7))
+    user.unread_count = 0
+    db.session.commit()
+
+    result = reconcile_unread_counts()
+
+    assert result == {"checked": 1, "repaired": 2}
+    assert _counts(user) == (3, 3)
+    assert reconcile_unread_counts() == {"checked": 1, "repaired": 0}
+
+
+def test_reconcile_counts_only_messages_after_last_read(app, line_account):
+    from app.extensions import db
+    from app.services.conversations import reconcile_unread_counts
+
+    user = _seed(line_account, inbound=3, outbound=0)
+    # อ่านถึงข้อความแรกแล้ว: mark_read ล้างตัวนับ แต่ยังเหลือสองข้อความที่มาทีหลัง
+    user.last_read_timestamp = BASE_TIME
+    user.unread_count = 0
+    db.session.commit()
+    assert _counts(user) == (0, 0)
+
+    reconcile_unread_counts(batch_size=1)
+
+    assert _counts(user) == (2, 2)